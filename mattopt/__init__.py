@@ -1,9 +1,15 @@
 from .parameter import *
+from .parameter_space import *
 from .shape import *
 from .surface import *
 from .equilibrium import *
 from .vmec import *
 from .target import *
+from .computation import *
+from .target_graph import *
+from .evaluation_cache import *
+from .trace import *
+from .mpi import *
 from .rosenbrock import *
 from .least_squares_term import *
 from .least_squares_problem import *
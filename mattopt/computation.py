@@ -0,0 +1,166 @@
+"""
+This module provides the Computation class, for expensive
+calculations that produce several quantities which can be targeted
+separately.
+"""
+
+import functools
+import time
+from .parameter import Parameter, ParameterGroup
+from .parameter_space import ParameterSpace
+from .target import Target, EvaluationStats, _as_dependencies, \
+    _function_label, _profiler
+
+class Computation:
+    """
+    A Computation is a function of a set of Parameters that returns a
+    bundle of several results, such as a tuple, a dict, or an object
+    with attributes. The function is called at most once for each
+    state of the Parameters, so several Targets can share one
+    Computation, each Target projecting one field of the bundle. For
+    instance the area and volume of a surface can both be obtained
+    from a single evaluation on the surface grid.
+
+    The result is reused until the val of one of the Parameters
+    changes, which is detected with version numbers. If the function
+    also depends on something that is not a Parameter, call
+    invalidate() when that changes. In particular, if the function
+    uses the results of other Targets or Computations, these should be
+    listed in dependencies, and handled with a TargetGraph.
+
+    While profiling is enabled, statistics about the evaluations are
+    collected in the stats attribute, as for a Target.
+    """
+
+    def __init__(self, parameters, function, dependencies=(), name=None):
+        """
+        parameters must be a python set or a ParameterGroup of the
+        Parameter objects upon which the function depends, and
+        function must be callable
+        with no arguments. dependencies is an iterable of the Targets
+        and Computations whose results are used by function. name is
+        used in profiling reports; by default it is derived from the
+        function.
+        """
+        if isinstance(parameters, ParameterGroup):
+            pass
+        elif type(parameters) is not set:
+            raise ValueError("parameters must have type 'set'")
+        else:
+            for param in parameters:
+                if type(param) is not Parameter:
+                    raise ValueError("Each element of parameters must have " \
+                                         "type Parameter.")
+        if not callable(function):
+            raise ValueError("function must be callable.")
+        self._parameters = parameters
+        self._function = function
+        self._dependencies = _as_dependencies(dependencies)
+        self._name = name
+        self._stats = None
+        self._space = None
+        self.invalidate()
+
+    def __repr__(self):
+        return "Computation(parameters=" + self._parameters.__repr__() + \
+            "; function=" + self._function.__repr__() + ")"
+
+    @property
+    def parameters(self):
+        """
+        Return the set of Parameter objects upon which the computation
+        depends.
+        """
+        return self._parameters
+
+    @property
+    def dependencies(self):
+        """
+        Return a tuple of the Targets and Computations whose results
+        are used by this Computation.
+        """
+        return self._dependencies
+
+    @property
+    def name(self):
+        """
+        Return the name of this Computation, as used in profiling
+        reports.
+        """
+        if self._name is None:
+            return _function_label(self._function)
+        return self._name
+
+    @property
+    def stats(self):
+        """
+        Return the EvaluationStats of this Computation.
+        """
+        if self._stats is None:
+            self._stats = EvaluationStats()
+        return self._stats
+
+    def invalidate(self):
+        """
+        Discard the stored result, so the function is called again at
+        the next evaluation.
+        """
+        self._version = None
+        self._result = None
+
+    def evaluate(self):
+        """
+        Return the bundle of results, calling the function only if a
+        Parameter has changed since the last call.
+        """
+        if not _profiler.enabled:
+            return self._evaluate(None)
+        stats = self.stats
+        start = time.perf_counter()
+        try:
+            return self._evaluate(stats)
+        finally:
+            stats.record(time.perf_counter() - start)
+
+    def _evaluate(self, stats):
+        """
+        Return the stored result or call the function. If stats is not
+        None, calls of the function are counted in it.
+        """
+        # The set of parameters may have been modified in place:
+        space = self._space
+        if space is None or len(space) != len(self._parameters):
+            space = ParameterSpace(self._parameters)
+            self._space = space
+            self.invalidate()
+        elif self._version is not None \
+                and not space.changed_since(self._version):
+            return self._result
+
+        version = space.version
+        if stats is not None:
+            stats.evaluations += 1
+        result = self._function()
+        self._version = version
+        self._result = result
+        return result
+
+    def get(self, field):
+        """
+        Return one field of the bundle of results. field is an index
+        or key if the bundle is a tuple, list, or dict, or otherwise
+        the name of an attribute.
+        """
+        bundle = self.evaluate()
+        if isinstance(field, str) and not isinstance(bundle, dict):
+            return getattr(bundle, field)
+        return bundle[field]
+
+    def target(self, field, cache_size=0):
+        """
+        Return a Target whose value is one field of the bundle of
+        results. See get() for the meaning of field.
+        """
+        return Target(self._parameters, functools.partial(self.get, field), \
+                          cache_size=cache_size, dependencies=(self,), \
+                          name=self.name + "[" + repr(field) + "]")
@@ -0,0 +1,186 @@
+"""
+This module provides the EvaluationCache class, which stores the
+results of expensive evaluations in a file so they can be reused by
+later runs.
+"""
+
+import hashlib
+import pickle
+import sqlite3
+import threading
+import time
+import numpy as np
+
+class EvaluationCache:
+    """
+    An EvaluationCache is a persistent store of results, kept in an
+    SQLite database file, so results survive a restart of an
+    optimization and can be shared by several processes. Each result
+    is keyed by a hash of a label (such as the name of a Target), the
+    vector of Parameter values, and a fingerprint. The fingerprint
+    should describe anything else that affects the results, such as
+    the version of a physics code or its numerical resolution, so
+    that results computed with a different configuration are never
+    returned.
+
+    When the total size of the stored results exceeds max_bytes, the
+    least recently used results are deleted.
+    """
+
+    def __init__(self, filename, fingerprint="", max_bytes=2**30):
+        """
+        filename is the database file, which is created if it does not
+        exist. fingerprint is a str, and max_bytes is the largest
+        total size of the stored results, or None for no limit.
+        """
+        if not isinstance(fingerprint, str):
+            raise ValueError("fingerprint must be a str")
+        if max_bytes is not None and max_bytes <= 0:
+            raise ValueError("max_bytes must be positive or None")
+        self._filename = filename
+        self._fingerprint = fingerprint
+        self._max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._connect()
+
+    def _connect(self):
+        """
+        Open the database file, creating the table if needed.
+        """
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self._filename, timeout=60, \
+                                               check_same_thread=False)
+        with self._connection:
+            self._connection.execute( \
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, " \
+                    "fingerprint TEXT, value BLOB, size INTEGER, " \
+                    "last_used REAL)")
+            self._connection.execute( \
+                "CREATE INDEX IF NOT EXISTS results_last_used ON " \
+                    "results (last_used)")
+
+    def __getstate__(self):
+        """
+        A pickled EvaluationCache, e.g. in another process, opens its
+        own connection to the same file.
+        """
+        state = self.__dict__.copy()
+        del state['_lock']
+        del state['_connection']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._connect()
+
+    def __repr__(self):
+        return "EvaluationCache(" + repr(self._filename) + ", fingerprint=" \
+            + repr(self._fingerprint) + ")"
+
+    @property
+    def fingerprint(self):
+        """
+        Return the fingerprint that is part of every key.
+        """
+        return self._fingerprint
+
+    def key(self, label, x):
+        """
+        Return the key of the result for the str label and the vector
+        of Parameter values x.
+        """
+        x = np.ascontiguousarray(x, dtype=np.float64)
+        h = hashlib.sha256()
+        for part in (self._fingerprint, label):
+            part = part.encode()
+            h.update(len(part).to_bytes(8, 'little'))
+            h.update(part)
+        h.update(x.tobytes())
+        return h.hexdigest()
+
+    def get(self, label, x, default=None):
+        """
+        Return the stored result for label and x, or default if there
+        is none.
+        """
+        key = self.key(label, x)
+        with self._lock, self._connection:
+            row = self._connection.execute( \
+                "SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._connection.execute( \
+                "UPDATE results SET last_used = ? WHERE key = ?", \
+                    (time.time(), key))
+        return pickle.loads(row[0])
+
+    def put(self, label, x, value):
+        """
+        Store a result for label and x, then evict the least recently
+        used results if the cache is too large.
+        """
+        key = self.key(label, x)
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock, self._connection:
+            self._connection.execute( \
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", \
+                    (key, self._fingerprint, blob, len(blob), time.time()))
+            if self._max_bytes is not None:
+                self._evict()
+
+    def _evict(self):
+        """
+        Delete the least recently used results until the total size is
+        at most max_bytes.
+        """
+        total, = self._connection.execute( \
+            "SELECT COALESCE(SUM(size), 0) FROM results").fetchone()
+        if total <= self._max_bytes:
+            return
+        keys = []
+        for key, size in self._connection.execute( \
+            "SELECT key, size FROM results ORDER BY last_used"):
+            if total <= self._max_bytes:
+                break
+            keys.append((key,))
+            total -= size
+        self._connection.executemany("DELETE FROM results WHERE key = ?", keys)
+
+    def __len__(self):
+        with self._lock:
+            count, = self._connection.execute( \
+                "SELECT COUNT(*) FROM results").fetchone()
+        return count
+
+    @property
+    def nbytes(self):
+        """
+        Return the total size of the stored results.
+        """
+        with self._lock:
+            total, = self._connection.execute( \
+                "SELECT COALESCE(SUM(size), 0) FROM results").fetchone()
+        return total
+
+    def clear(self, all_fingerprints=False):
+        """
+        Delete the results stored with this fingerprint, or all the
+        results if all_fingerprints is True.
+        """
+        with self._lock, self._connection:
+            if all_fingerprints:
+                self._connection.execute("DELETE FROM results")
+            else:
+                self._connection.execute( \
+                    "DELETE FROM results WHERE fingerprint = ?", \
+                        (self._fingerprint,))
+
+    def close(self):
+        """
+        Close the database file.
+        """
+        with self._lock:
+            self._connection.close()
@@ -2,22 +2,171 @@
 This module provides the LeastSquaresProblem class.
 """
 
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import pickle
 import numpy as np
+from .parameter_space import ParameterSpace
 from .least_squares_term import LeastSquaresTerm
+from .target import EvaluationStats, _profiler
+from .target_graph import TargetGraph
 from scipy.optimize import least_squares
 import logging
+import time
+
+# Relative step for finite differences, the same as the default of
+# scipy.optimize.least_squares:
+_fd_step = np.sqrt(np.finfo(float).eps)
+
+# Types of values that are known to be scalars:
+_scalar_types = frozenset((float, int, np.float64))
+
+# The copy of the problem held by a worker process of a parallel
+# Jacobian:
+_worker_problem = None
+
+def _init_worker(pickled_problem):
+    """
+    Unpickle the problem in a worker process.
+    """
+    global _worker_problem
+    _worker_problem = pickle.loads(pickled_problem)
+
+def _worker_residuals(x):
+    """
+    Return the residuals of the worker's copy of the problem at x.
+    """
+    return _worker_problem._residuals_at(x)
+
+class _BroydenJacobian:
+    """
+    This class is passed to scipy.optimize as the Jacobian in the
+    Broyden mode of LeastSquaresProblem.solve(). Between full
+    computations of the Jacobian, it applies the rank-one update
+
+    J += outer(df - J dx, dx) / (dx . dx)
+
+    for the step dx between successive calls, where df is the change
+    of the residual vector. The residual vectors are recorded by fun(),
+    which must be passed to scipy.optimize in place of the residual
+    function.
+    """
+
+    def __init__(self, residual_func, jacobian_func, refresh, stall):
+        self._residual_func = residual_func
+        self._jacobian_func = jacobian_func
+        self._refresh = refresh
+        self._stall = stall
+        self._jac = None
+        self._x = None
+        self._residuals = None
+        self._latest = (None, None)
+        self._since_refresh = 0
+        self.nfull = 0
+        self.nupdates = 0
+
+    @property
+    def fresh(self):
+        """
+        Return True if the latest Jacobian was computed in full.
+        """
+        return self._since_refresh == 0
+
+    def reset(self):
+        """
+        Compute the Jacobian in full at the next call.
+        """
+        self._jac = None
+
+    def fun(self, x):
+        """
+        Return the residuals at x, recording them for the update.
+        """
+        residuals = self._residual_func(x)
+        self._latest = (np.array(x), residuals)
+        return residuals
+
+    def __call__(self, x):
+        """
+        Return the Jacobian at x.
+        """
+        latest_x, residuals = self._latest
+        if latest_x is None or not np.array_equal(latest_x, x):
+            residuals = self.fun(x)
+        if self._jac is None or self._since_refresh >= self._refresh:
+            refresh = True
+        else:
+            # The reduction of the sum of squares by the step:
+            old = np.dot(self._residuals, self._residuals)
+            new = np.dot(residuals, residuals)
+            refresh = old - new < self._stall * old
+        if refresh:
+            self._jac = np.array(self._jacobian_func(x), dtype=float)
+            self._since_refresh = 0
+            self.nfull += 1
+        else:
+            dx = x - self._x
+            dx2 = np.dot(dx, dx)
+            if dx2 > 0:
+                change = residuals - self._residuals - self._jac @ dx
+                self._jac += np.outer(change, dx / dx2)
+            self._since_refresh += 1
+            self.nupdates += 1
+        self._x = np.array(x)
+        self._residuals = residuals
+        # scipy.optimize may modify the matrix it is given:
+        return self._jac.copy()
 
 class LeastSquaresProblem:
     """
     This class represents a nonlinear-least-squares optimization
     problem. The class stores a list of LeastSquaresTerm objects.
+
+    Each term contributes a block of residuals: one residual for a
+    scalar Target, or one per element for a vector-valued Target. The
+    layout of the residual vector is worked out at the first
+    evaluation and reused until the size of a block changes. The
+    goals and sigmas of all the terms are then held in two vectors,
+    so the values of the Targets are copied into a preallocated buffer
+    and the residuals are computed with one vectorized operation.
+
+    If any of the Targets has a gradient function, the Jacobian of
+    the residuals is assembled by jacobian() and passed to the
+    optimizer. The blocks of the Targets with no gradient function are
+    then computed by forward finite differences, perturbing only the
+    Parameters of that Target. Otherwise the optimizer computes the
+    whole Jacobian by finite differences.
+
+    The Targets of the terms, and everything they depend on, form a
+    TargetGraph. Each evaluation only recomputes the Targets whose
+    Parameters have changed, which for instance saves work in
+    finite-difference steps that change a single Parameter. This
+    assumes that each Target depends only on its Parameters. If a
+    Target also reads some other state, call invalidate() after that
+    state changes. solve() calls invalidate() when it starts.
     """
 
-    def __init__(self, terms):
+    def __init__(self, terms, disk_cache=None, executor=None, trace=None):
         """
         The argument "terms" must be convertable to a list by the
         list() subroutine. Each entry of the resulting list must have
         type LeastSquaresTerm.
+
+        disk_cache can be None or an EvaluationCache, in which the
+        values of the Targets at the points requested by the optimizer
+        are stored, keyed by the names of the Targets and the vals of
+        all the Parameters. A restarted optimization then gets the
+        residuals of points it has already visited from the cache, even
+        if goals or sigmas have been changed.
+
+        executor can be None, or an object with a submit() method like
+        the executors of concurrent.futures. In the latter case, the
+        Targets that depend on disjoint sets of Parameters, and hence
+        presumably on different underlying codes, are computed
+        concurrently. See TargetGraph.evaluate().
+
+        trace can be None or a TraceRecorder, to which every residual
+        evaluation requested by the optimizer is appended.
         """
         try:
             terms = list(terms)
@@ -32,55 +181,221 @@ class LeastSquaresProblem:
                 raise ValueError("Each term in terms must be an instance of " \
                                      "LeastSquaresTerm.")
         self._terms = terms
-        # Get a list of all Parameters
-        params = set()
-        for j in range(len(terms)):
-            params = params.union(terms[j].in_target.parameters)
-        self._parameters = list(params)
+        # Number all the Parameters that the terms depend on:
+        self._space = ParameterSpace()
+        for term in terms:
+            self._space.add(term.in_target.parameters)
+        self._parameters = self._space.parameters
+        self._in_targets = [term.in_target for term in terms]
+        # Sizes of the residual blocks, and their end positions in the
+        # residual vector. The rest of the layout is set by
+        # _compile_residuals():
+        self._block_sizes = None
+        self._block_ends = None
+        # The residuals only need the Targets of the terms, not their
+        # out_targets:
+        self._graph = TargetGraph(self._in_targets)
+        # Statistics of the calls from the optimizer:
+        self._residual_stats = EvaluationStats()
+        self.disk_cache = disk_cache
+        self.executor = executor
+        self.trace = trace
 
     @property
     def parameters(self):
         """
         Return a list of all Parameter objects upon which the
-        objective function depends.
+        objective function depends, in the order of their index in
+        the ParameterSpace.
         """
         return self._parameters
 
+    def snapshot(self):
+        """
+        Return a ParameterSnapshot holding the val of every Parameter
+        upon which the objective function depends.
+        """
+        return self._space.snapshot()
+
+    def restore(self, snapshot):
+        """
+        Set the Parameters back to the vals held in a snapshot from
+        snapshot().
+        """
+        self._space.restore(snapshot)
+
+    def rollback_on_error(self):
+        """
+        Return a context manager that restores the Parameters if the
+        block raises an exception. See
+        ParameterSpace.rollback_on_error().
+        """
+        return self._space.rollback_on_error()
+
+    def invalidate(self):
+        """
+        Forget the values of all the Targets, so they are all
+        recomputed at the next evaluation. This is needed when a Target
+        depends on something other than the vals of its Parameters, and
+        that has changed.
+        """
+        self._graph.invalidate()
+
+    @property
+    def graph(self):
+        """
+        Return the TargetGraph of all the Targets upon which the
+        objective function depends.
+        """
+        return self._graph
+
     @property
     def objective(self):
         """
-        Return the value of the total objective function, by summing
-        the terms.
+        Return the value of the total objective function, the sum of
+        the squares of the residuals.
         """
         logger = logging.getLogger(__name__)
         logger.info("objective called.")
-        sum = 0
-        for term in self._terms:
-            sum += term.out_val
-        return sum
+        residuals = self.residuals()
+        return float(np.dot(residuals, residuals))
 
-    def solve(self):
+    def solve(self, jacobian_processes=None, mpi=None, broyden_refresh=None, \
+                  broyden_stall=0.01):
         """
-        Solve the nonlinear-least-squares minimization problem.
+        Solve the nonlinear-least-squares minimization problem. The min
+        and max of the non-fixed Parameters are passed to the optimizer
+        as bounds, and the trust-region-reflective method is used, so
+        the residuals are never evaluated outside the bounds.
+
+        If jacobian_processes is an int, the finite-difference Jacobian
+        is computed by that many worker processes. Each worker holds
+        its own copy of the problem, and of all the objects it depends
+        on, which is sent to the worker with pickle when the solve
+        starts. The perturbed points of one Jacobian are divided among
+        the workers, so the time for each Jacobian decreases in
+        proportion to the number of processes. The residuals at the
+        points chosen by the optimizer are still computed in this
+        process.
+
+        If mpi is an MpiPartition, every MPI process must call solve(),
+        with a copy of the same problem. Rank 0 of the world runs the
+        optimizer, and the columns of each finite-difference Jacobian
+        are divided among the worker groups. All the processes of a
+        group evaluate the same points, so a code like VMEC can run in
+        parallel on the communicator of the group. The residuals at
+        the points chosen by the optimizer are computed by group 0. At
+        the end, the Parameters of every process are set to the
+        optimum.
+
+        If broyden_refresh is an int, the Jacobian is only computed in
+        full (by any of the above methods) at the first iteration,
+        every broyden_refresh iterations, and when progress stalls,
+        i.e. when an accepted step reduces the sum of squares by less
+        than a fraction broyden_stall. At the other iterations the
+        Jacobian is updated with a Broyden rank-one correction from the
+        step, which needs no extra evaluations. On smooth problems this
+        saves most of the finite-difference evaluations.
         """
         logger = logging.getLogger(__name__)
         logger.info("Beginning solve.")
+        # All the MPI processes check the arguments and bounds, so they
+        # all raise the same exception:
+        if broyden_refresh is not None and (not isinstance(broyden_refresh, \
+                                                               int) \
+                                                or broyden_refresh < 1):
+            raise ValueError("broyden_refresh must be a positive int or None")
+        # The Targets may depend on something other than the Parameters
+        # that has changed since the last evaluation:
+        self.invalidate()
+        lower, upper = self._space.get_bounds()
+        pinned = lower >= upper
+        if np.any(pinned):
+            names = [param._storage._element_label(param._index) \
+                         for param, bad \
+                         in zip(self._space.free_parameters, pinned) if bad]
+            raise ValueError("The min of a non-fixed Parameter must be " \
+                                 "less than its max. Fix these Parameters " \
+                                 "instead: " + ", ".join(names))
+        if mpi is not None:
+            if jacobian_processes is not None:
+                raise ValueError("jacobian_processes and mpi cannot both " \
+                                     "be used.")
+            if not mpi.proc0_world:
+                self._mpi_worker_loop(mpi)
+                return
         # Get vector of initial values for the parameters:
         #print("Parameters for solve:",self._parameters)
-        x0 = [param.val for param in self._parameters if not param.fixed]
+        x0 = self._space.get_x()
         #print("x0:",x0)
-        # Call scipy.optimize:
-        result = least_squares(self._residual_func, x0, verbose=2)
+        # Call scipy.optimize. If the solve fails, the Parameters are
+        # set back to their initial values:
+        pool = None
+        if jacobian_processes is not None:
+            if not isinstance(jacobian_processes, int) \
+                    or jacobian_processes < 1:
+                raise ValueError("jacobian_processes must be a positive int")
+            pool = ProcessPoolExecutor(max_workers=jacobian_processes, \
+                                           initializer=_init_worker, \
+                                           initargs=(pickle.dumps(self),))
+            jac = functools.partial(self._parallel_jacobian, pool, \
+                                        jacobian_processes)
+        elif mpi is not None:
+            jac = functools.partial(self._mpi_jacobian, mpi)
+        elif any(term.in_target.has_gradient for term in self._terms):
+            jac = self._jacobian_func
+        else:
+            jac = '2-point'
+        if mpi is None:
+            fun = self._residual_func
+        else:
+            fun = functools.partial(self._mpi_residual_func, mpi)
+        if broyden_refresh is not None:
+            if jac == '2-point':
+                jac = self._serial_jacobian
+            broyden = _BroydenJacobian(fun, jac, broyden_refresh, \
+                                           broyden_stall)
+            fun = broyden.fun
+            jac = broyden
+        xopt = None
+        try:
+            with self._space.rollback_on_error():
+                while True:
+                    if broyden_refresh is not None:
+                        nupdates = broyden.nupdates
+                    result = least_squares(fun, x0, jac=jac, \
+                                               bounds=(lower, upper), \
+                                               method='trf', verbose=2)
+                    # The termination tests of scipy may have been
+                    # misled by an approximate Jacobian. If the run
+                    # used any and made progress, start again from a
+                    # full Jacobian:
+                    if broyden_refresh is None \
+                            or broyden.nupdates == nupdates \
+                            or result.nfev == 1:
+                        break
+                    logger.info("Restarting from a full Jacobian.")
+                    broyden.reset()
+                    x0 = result.x
+            xopt = result.x
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            if self.trace is not None:
+                self.trace.flush()
+            if mpi is not None:
+                # Release the other processes. If the solve failed, they
+                # restore their initial Parameters:
+                self._mpi_send(mpi, ("stop", xopt, None), True)
+        if broyden_refresh is not None:
+            logger.info("Full Jacobians: " + str(broyden.nfull) \
+                            + ", Broyden updates: " + str(broyden.nupdates))
         logger.info("Completed solve.")
         #print("optimum x:",result.x)
         #print("optimum residuals:",result.fun)
         #print("optimum cost function:",result.cost)
         # Set Parameters to their values for the optimum
-        index = 0
-        for j in range(len(x0)):
-            if not self._parameters[j].fixed:
-                self._parameters[j].val = result.x[index]
-                index += 1
+        self._space.set_x(result.x)
 
     def _residual_func(self, x):
         """
@@ -89,11 +404,424 @@ class LeastSquaresProblem:
         logger = logging.getLogger(__name__)
         logger.info("_residual_func called.")
         #print("_residual_func called with x=",x)
-        index = 0
-        for j in range(len(self._parameters)):
-            if not self._parameters[j].fixed:
-                self._parameters[j].val = x[index]
-                index += 1
-        assert index == len(x)
-        return [(term.in_val - term.goal) / term.sigma for term in self._terms]
-        
+        trace = self.trace
+        if not _profiler.enabled and trace is None:
+            return self._residuals_at(x)
+        start = time.perf_counter()
+        try:
+            residuals = self._residuals_at(x)
+        finally:
+            duration = time.perf_counter() - start
+            if _profiler.enabled:
+                self._residual_stats.record(duration)
+        if trace is not None:
+            trace.record(x, residuals, self._term_values(residuals), duration)
+        return residuals
+
+    def _term_values(self, residuals):
+        """
+        Return the value of each term, i.e. the sum of the squares of
+        its block of residuals. If the layout of the blocks is not
+        known, which happens when the residuals came from the disk
+        cache, the values are NaN.
+        """
+        ends = self._block_ends
+        if ends is None or ends[-1] != residuals.size:
+            return np.full(len(self._terms), np.nan)
+        values = np.empty(len(ends))
+        start = 0
+        for j, end in enumerate(ends):
+            block = residuals[start:end]
+            values[j] = np.dot(block, block)
+            start = end
+        return values
+
+    def _jacobian_func(self, x):
+        """
+        This private method is passed to scipy.optimize as the
+        Jacobian.
+        """
+        logger = logging.getLogger(__name__)
+        logger.info("_jacobian_func called.")
+        self._space.set_x(x)
+        return self.jacobian()
+
+    def _residuals_at(self, x):
+        """
+        Set the non-fixed Parameters to x and return the residual
+        vector, using the disk cache if there is one.
+        """
+        # set_x changes all the Parameters before notifying any
+        # observers, so each observer is only called once:
+        self._space.set_x(x)
+        disk_cache = self.disk_cache
+        if disk_cache is None:
+            return self.residuals()
+        # The values of the Targets are stored rather than the
+        # residuals, so changing a goal or sigma does not make the
+        # stored results wrong:
+        label = self._cache_label()
+        state = self._space.get_state()
+        vals = disk_cache.get(label, state)
+        if vals is None:
+            vals = self._target_values()
+            disk_cache.put(label, state, vals)
+        return self._residuals_from(vals)
+
+    def _cache_label(self):
+        """
+        Return the label under which the values of the Targets are
+        stored in the disk cache, made from the names of the Targets.
+        """
+        return "LeastSquaresProblem(" \
+            + ", ".join(target.name for target in self._in_targets) + ")"
+
+    def profile(self):
+        """
+        Return a string with a table of the statistics of all the
+        Targets and Computations of the problem, sorted by total time,
+        and of the residual evaluations requested by the optimizer.
+        Statistics are only collected while profiling is enabled,
+        either by calling enable_target_profiling() or inside a
+        "with target_profiling():" block.
+        """
+        stats = self._residual_stats
+        lines = ["Residual evaluations: " + str(stats.calls) \
+                     + ", total time {:.6g} s".format(stats.total_time), \
+                     "{:>8} {:>11} {:>12} {:>12} {:>8} {:>8}  {}".format( \
+                "calls", "evaluations", "total (s)", "max (s)", "hits", \
+                    "misses", "name")]
+        nodes = sorted(self._graph.nodes, \
+                           key=lambda node: node.stats.total_time, \
+                           reverse=True)
+        for node in nodes:
+            stats = node.stats
+            lines.append("{:>8} {:>11} {:>12.6g} {:>12.6g} {:>8} {:>8}  {}" \
+                             .format(stats.calls, stats.evaluations, \
+                                         stats.total_time, stats.max_time, \
+                                         stats.cache_hits, stats.cache_misses, \
+                                         node.name))
+        return "\n".join(lines)
+
+    def reset_profile(self):
+        """
+        Set the statistics reported by profile() to zero.
+        """
+        self._residual_stats.reset()
+        for node in self._graph.nodes:
+            node.stats.reset()
+
+    def residuals(self):
+        """
+        Return a numpy vector with the residuals (target - goal) /
+        sigma of all the terms, for the present values of the
+        Parameters. A new vector is returned each time, since
+        scipy.optimize keeps references to earlier residual vectors.
+        """
+        return self._residuals_from(self._target_values())
+
+    def _target_values(self):
+        """
+        Return a list with the value of the Target of each term.
+        """
+        values = self._graph.evaluate(self.executor)
+        return [values[target] for target in self._in_targets]
+
+    def _residuals_from(self, vals):
+        """
+        Return a new residual vector computed from the list of values
+        of the Targets.
+        """
+        if self._block_ends is None or not self._gather(vals):
+            self._compile_residuals(vals)
+            self._gather(vals)
+        residuals = np.subtract(self._buffer, self._goals)
+        residuals /= self._sigmas
+        return residuals
+
+    def _gather(self, vals):
+        """
+        Copy the values of the Targets into the buffer. Return False if
+        they do not fit the present layout of the blocks.
+        """
+        buffer = self._buffer
+        scalar_terms = self._scalar_terms
+        if self._vector_blocks:
+            scalars = [vals[j] for j in scalar_terms]
+        else:
+            scalars = vals
+        # Most scalar Targets return a python or numpy float, for which
+        # np.ndim() is not needed:
+        for val in scalars:
+            if type(val) not in _scalar_types and np.ndim(val) != 0:
+                return False
+        for j, start, end in self._vector_blocks:
+            val = vals[j]
+            if np.ndim(val) == 0 or np.size(val) != end - start:
+                return False
+            buffer[start:end] = np.ravel(val)
+        if self._vector_blocks:
+            buffer[self._scalar_positions] = scalars
+        else:
+            buffer[:] = scalars
+        return True
+
+    def _compile_residuals(self, vals):
+        """
+        Work out the layout of the residual vector from the values of
+        the Targets: the blocks, the goals and sigmas of all the
+        residuals as vectors, and the buffer into which the values are
+        copied.
+        """
+        sizes = [np.size(val) for val in vals]
+        self._block_sizes = sizes
+        self._block_ends = np.cumsum(sizes).tolist()
+        self._buffer = np.empty(self._block_ends[-1])
+        self._goals = np.empty(self._block_ends[-1])
+        self._sigmas = np.empty(self._block_ends[-1])
+        # Scalar Targets are copied all at once, and vector-valued ones
+        # block by block:
+        self._vector_blocks = []
+        scalar_terms = []
+        start = 0
+        for j, (term, val, end) in enumerate(zip(self._terms, vals, \
+                                                     self._block_ends)):
+            shape = np.shape(val)
+            term._check_shape(shape)
+            self._goals[start:end] = np.ravel(np.broadcast_to(term.goal, shape))
+            self._sigmas[start:end] = \
+                np.ravel(np.broadcast_to(term.sigma, shape))
+            if shape == ():
+                scalar_terms.append(j)
+            else:
+                self._vector_blocks.append((j, start, end))
+            start = end
+        self._scalar_terms = scalar_terms
+        self._scalar_positions = np.array([self._block_ends[j] - 1 \
+                                               for j in scalar_terms], \
+                                              dtype=np.int64)
+
+    def jacobian(self):
+        """
+        Return the Jacobian of residuals() with respect to the
+        non-fixed Parameters, at their present values, as a 2D numpy
+        array. The columns are in the same order as get_x() of the
+        ParameterSpace. The blocks of rows for Targets with a gradient
+        function are computed analytically. The other blocks are
+        computed together by forward finite differences: each non-fixed
+        Parameter they depend on is perturbed in turn, and the Targets
+        are evaluated in one pass of the graph.
+        """
+        residuals = self.residuals()
+        free = self._space.free_parameters
+        columns = {param: j for j, param in enumerate(free)}
+        jac = np.zeros((residuals.size, len(free)))
+        self._fill_gradients(jac, columns)
+        # The rows of the Targets with no gradient function, and the
+        # Parameters they depend on:
+        rows = np.zeros(residuals.size, dtype=bool)
+        differenced = set()
+        start = 0
+        for term, end in zip(self._terms, self._block_ends):
+            target = term.in_target
+            if not target.has_gradient:
+                rows[start:end] = True
+                differenced.update(target.parameters)
+            start = end
+        if not differenced:
+            return jac
+        x = self._space.get_x()
+        steps = self._fd_steps(x, free)
+        try:
+            for j, param in enumerate(free):
+                if param in differenced:
+                    point = x.copy()
+                    point[j] += steps[j]
+                    self._space.set_x(point)
+                    jac[rows, j] = (self.residuals()[rows] - residuals[rows]) \
+                        / steps[j]
+        finally:
+            self._space.set_x(x)
+        return jac
+
+    def _fill_gradients(self, jac, columns):
+        """
+        Write the blocks of rows of the Jacobian for the Targets with a
+        gradient function. columns maps each non-fixed Parameter to its
+        column.
+        """
+        if not any(target.has_gradient for target in self._in_targets):
+            return
+        start = 0
+        for term, end in zip(self._terms, self._block_ends):
+            target = term.in_target
+            if target.has_gradient:
+                jac[start:end, :] = 0
+                for param, derivative in target.evaluate_gradient().items():
+                    j = columns.get(param)
+                    if j is not None:
+                        jac[start:end, j] = np.ravel( \
+                            np.asarray(derivative, dtype=float) / term.sigma)
+            start = end
+
+    @staticmethod
+    def _fd_steps(x, free):
+        """
+        Return the forward-difference step for each non-fixed Parameter,
+        given their vals x. A step is negative if a positive step would
+        exceed the max of the Parameter.
+        """
+        steps = _fd_step * np.maximum(1.0, np.abs(x))
+        maxs = np.array([param.max for param in free], dtype=float)
+        steps[x + steps > maxs] *= -1
+        return steps
+
+    def _parallel_jacobian(self, pool, nworkers, x):
+        """
+        Return the Jacobian at x, computing the finite differences of
+        all the columns in the worker processes of pool, then
+        replacing the blocks of the Targets with a gradient function.
+        """
+        logger = logging.getLogger(__name__)
+        logger.info("_parallel_jacobian called.")
+        residuals = self._residuals_at(x)
+        free = self._space.free_parameters
+        steps = self._fd_steps(x, free)
+        points = [x + step * unit for step, unit in zip(steps, np.eye(x.size))]
+        # Consecutive columns go to the same worker, so each worker
+        # only recomputes the Targets affected by its columns:
+        chunksize = max(1, -(-x.size // nworkers))
+        perturbed = pool.map(_worker_residuals, points, chunksize=chunksize)
+        jac = np.empty((residuals.size, x.size))
+        for j, column in enumerate(perturbed):
+            jac[:, j] = (column - residuals) / steps[j]
+        self._fill_gradients(jac, {param: j for j, param in enumerate(free)})
+        return jac
+
+    def _serial_jacobian(self, x):
+        """
+        Return the Jacobian at x, computing the finite differences of
+        the whole residual vector in this process, one evaluation per
+        column, then replacing the blocks of the Targets with a gradient
+        function. The evaluations go through _residual_func(), so they
+        are traced and profiled like those of the finite differences
+        computed by scipy.optimize.
+        """
+        logger = logging.getLogger(__name__)
+        logger.info("_serial_jacobian called.")
+        free = self._space.free_parameters
+        steps = self._fd_steps(x, free)
+        perturbed = []
+        for j in range(x.size):
+            point = x.copy()
+            point[j] += steps[j]
+            perturbed.append(self._residual_func(point))
+        # Leave the Parameters at x, for the gradients and the next
+        # iteration:
+        residuals = self._residual_func(x)
+        jac = np.empty((residuals.size, x.size))
+        for j, column in enumerate(perturbed):
+            jac[:, j] = (column - residuals) / steps[j]
+        self._fill_gradients(jac, {param: j for j, param in enumerate(free)})
+        return jac
+
+    @staticmethod
+    def _mpi_send(mpi, task, all_groups):
+        """
+        Send a task from rank 0 of the world to the processes of group
+        0, or of all the groups if all_groups is True.
+        """
+        if all_groups:
+            mpi.comm_leaders.bcast(task, root=0)
+        mpi.comm_groups.bcast(task, root=0)
+
+    def _mpi_residual_func(self, mpi, x):
+        """
+        This private method is passed to scipy.optimize in an MPI
+        solve. Group 0 computes the residuals at x.
+        """
+        self._mpi_send(mpi, ("residuals", x, None), False)
+        return self._residual_func(x)
+
+    def _mpi_jacobian(self, mpi, x):
+        """
+        This private method is passed to scipy.optimize as the Jacobian
+        in an MPI solve. Each group computes a block of the columns by
+        finite differences, and the results are gathered on rank 0 of
+        the world.
+        """
+        logger = logging.getLogger(__name__)
+        logger.info("_mpi_jacobian called.")
+        free = self._space.free_parameters
+        steps = self._fd_steps(x, free)
+        self._mpi_send(mpi, ("jacobian", x, steps), True)
+        residuals, indices, columns = self._mpi_columns(mpi, x, steps)
+        jac = np.empty((residuals.size, x.size))
+        for indices, columns in mpi.comm_leaders.gather((indices, columns), \
+                                                            root=0):
+            for j, column in zip(indices, columns):
+                jac[:, j] = (column - residuals) / steps[j]
+        self._fill_gradients(jac, {param: j for j, param in enumerate(free)})
+        return jac
+
+    def _mpi_columns(self, mpi, x, steps):
+        """
+        Compute the residuals at the perturbed points of the columns
+        assigned to the group of this process. Group 0 then also
+        computes the residuals at x, so its Targets are left at x.
+        Return the residuals at x (or None for the other groups), the
+        list of column indices, and the list of perturbed residuals.
+        """
+        indices = list(mpi.columns(x.size))
+        columns = []
+        for j in indices:
+            point = x.copy()
+            point[j] += steps[j]
+            columns.append(self._residuals_at(point))
+        residuals = None
+        if mpi.group == 0:
+            residuals = self._residuals_at(x)
+        return residuals, indices, columns
+
+    def _mpi_worker_loop(self, mpi):
+        """
+        Carry out the tasks sent by rank 0 of the world in an MPI solve,
+        until it sends "stop".
+        """
+        logger = logging.getLogger(__name__)
+        snapshot = self._space.snapshot()
+        while True:
+            task = None
+            if mpi.comm_leaders is not None:
+                task = mpi.comm_leaders.bcast(task, root=0)
+            action, x, steps = mpi.comm_groups.bcast(task, root=0)
+            if action == "stop":
+                if x is None:
+                    self._space.restore(snapshot)
+                else:
+                    self._space.set_x(x)
+                return
+            try:
+                if action == "residuals":
+                    self._residuals_at(x)
+                else:
+                    residuals, indices, columns = \
+                        self._mpi_columns(mpi, x, steps)
+                    if mpi.comm_leaders is not None:
+                        mpi.comm_leaders.gather((indices, columns), root=0)
+            except Exception:
+                # The other processes would wait for this one forever:
+                logger.exception("Evaluation failed on MPI rank " \
+                                     + str(mpi.rank_world))
+                mpi.comm_world.Abort(1)
+
+    def __getstate__(self):
+        """
+        The executor and the trace stay in this process when the
+        problem is pickled, e.g. for the workers of a parallel
+        Jacobian.
+        """
+        state = self.__dict__.copy()
+        state['executor'] = None
+        state['trace'] = None
+        return state
@@ -2,9 +2,34 @@
 This module provides the LeastSquaresTerm class.
 """
 
+import numpy as np
 from .parameter import Parameter, isnumber
 from .target import Target
 
+def _as_float(x, label):
+    """
+    Convert goal or sigma to a float, or to a read-only numpy array of
+    floats if it is array-like.
+    """
+    message = label + ' must be a float or int, or an array of them'
+    # Strings and bools would be converted by float(), so they are
+    # rejected first:
+    if isinstance(x, (str, bytes, bool, np.bool_)):
+        raise ValueError(message)
+    if isnumber(x):
+        return float(x)
+    try:
+        arr = np.asarray(x)
+    except (TypeError, ValueError):
+        raise ValueError(message)
+    if arr.dtype.kind not in 'iuf':
+        raise ValueError(message)
+    arr = np.array(arr, dtype=float)
+    if arr.ndim == 0:
+        return float(arr)
+    arr.flags.writeable = False
+    return arr
+
 class LeastSquaresTerm:
     """
     This class represents one term in a nonlinear-least-squares
@@ -13,23 +38,30 @@ class LeastSquaresTerm:
     (sigma).  The overall value of the term is:
 
     ((target - goal) / sigma) ** 2.
+
+    The target may also return a numpy array, for instance a quantity
+    evaluated at every point of a grid. Then goal and sigma can be
+    floats or arrays of the same shape, and the value of the term is
+    the sum of the squares of the elements of (target - goal) / sigma.
     """
 
     def __init__(self, target, goal, sigma):
         if not isinstance(target, Target):
             raise ValueError('target must be an instance of Target')
-        if not isnumber(goal):
-            raise ValueError('goal must be a float or int')
-        if not isnumber(sigma):
-            raise ValueError('sigma must be a float or int')
-        if sigma == 0:
-            raise ValueError('sigma cannot be 0')
-        self._in_target = target
         # If goal or sigma is an int, convert to a float so we don't
         # have integer division by mistake:
-        self._goal = float(goal)
-        self._sigma = float(sigma)
-        self._out_target = Target(self._in_target.parameters, self._out_function)
+        goal = _as_float(goal, 'goal')
+        sigma = _as_float(sigma, 'sigma')
+        if np.any(np.equal(sigma, 0)):
+            raise ValueError('sigma cannot be 0')
+        self._in_target = target
+        self._goal = goal
+        self._sigma = sigma
+        self._out_target = Target(self._in_target.parameters, \
+                                      self._out_function, \
+                                      dependencies=(self._in_target,), \
+                                      name="LeastSquaresTerm(" \
+                                          + self._in_target.name + ")")
 
     @property
     def in_target(self):
@@ -69,13 +101,48 @@ class LeastSquaresTerm:
         """
         return self._in_target.evaluate()
 
+    @property
+    def residual(self):
+        """
+        Return (target - goal) / sigma. This is a float if the target
+        is a scalar, or a numpy array if the target is vector-valued.
+        """
+        return self._residual_of(self._in_target.evaluate())
+
+    def _residual_of(self, val):
+        """
+        Return the residual for a given value of the target.
+        """
+        if np.ndim(val) > 0:
+            val = np.asarray(val, dtype=float)
+        self._check_shape(np.shape(val))
+        return (val - self._goal) / self._sigma
+
+    def _check_shape(self, shape):
+        """
+        Raise a ValueError unless goal and sigma are floats or arrays
+        with the given shape of the value of the target, so they are
+        never broadcast to a different shape.
+        """
+        for label, x in (('goal', self._goal), ('sigma', self._sigma)):
+            # _as_float() returns either a float or a numpy array:
+            if type(x) is not float and x.shape != shape:
+                raise ValueError('The shape of ' + label + ', ' \
+                                     + str(x.shape) + ', does not match the ' \
+                                     'shape of the value of Target ' \
+                                     + self._in_target.name + ', ' \
+                                     + str(shape))
+
     @property
     def out_val(self):
         """
         Return the overall value of this least-squares term.
         """
-        temp = (self._in_target.evaluate() - self._goal) / self._sigma
-        return temp * temp 
+        temp = self.residual
+        if np.ndim(temp) == 0:
+            return temp * temp
+        temp = np.ravel(temp)
+        return float(np.dot(temp, temp))
 
     def _out_function(self):
         """
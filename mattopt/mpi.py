@@ -0,0 +1,85 @@
+"""
+This module provides the MpiPartition class, which divides the MPI
+processes into groups for distributed optimization.
+"""
+
+import logging
+
+class MpiPartition:
+    """
+    An MpiPartition splits a communicator (by default MPI_COMM_WORLD)
+    into ngroups worker groups of consecutive ranks. Each group has its
+    own communicator, comm_groups, on which a physics code such as
+    VMEC can run in parallel. Rank 0 of each group is the leader of the
+    group, and the leaders are connected by the communicator
+    comm_leaders, which is None on the other processes. Rank 0 of the
+    world is the leader of group 0, and drives the optimizer in
+    LeastSquaresProblem.solve().
+
+    This class requires mpi4py, which is only imported when an
+    MpiPartition is created, so MPI is not initialized by importing
+    mattopt.
+    """
+
+    def __init__(self, ngroups=None, comm_world=None):
+        """
+        ngroups is the number of worker groups, by default one per
+        process. comm_world is an mpi4py communicator, by default
+        MPI.COMM_WORLD.
+        """
+        try:
+            from mpi4py import MPI
+        except ImportError:
+            raise ImportError("MpiPartition requires mpi4py.")
+        if comm_world is None:
+            comm_world = MPI.COMM_WORLD
+        size = comm_world.Get_size()
+        if ngroups is None:
+            ngroups = size
+        if not isinstance(ngroups, int) or ngroups < 1 or ngroups > size:
+            raise ValueError("ngroups must be an int between 1 and the " \
+                                 "number of processes (" + str(size) + ")")
+        self.comm_world = comm_world
+        self.ngroups = ngroups
+        self.rank_world = comm_world.Get_rank()
+        self.nprocs_world = size
+        self.proc0_world = (self.rank_world == 0)
+        # Consecutive ranks form a group, and the group sizes differ by
+        # at most 1:
+        self.group = self.rank_world * ngroups // size
+        self.comm_groups = comm_world.Split(color=self.group, \
+                                                key=self.rank_world)
+        self.rank_groups = self.comm_groups.Get_rank()
+        self.nprocs_groups = self.comm_groups.Get_size()
+        self.proc0_groups = (self.rank_groups == 0)
+        color = 0 if self.proc0_groups else MPI.UNDEFINED
+        self.comm_leaders = comm_world.Split(color=color, key=self.rank_world)
+        if self.comm_leaders == MPI.COMM_NULL:
+            self.comm_leaders = None
+        logger = logging.getLogger(__name__)
+        logger.info("Rank " + str(self.rank_world) + " of " + str(size) \
+                        + " is rank " + str(self.rank_groups) + " of " \
+                        + str(self.nprocs_groups) + " in group " \
+                        + str(self.group) + " of " + str(ngroups))
+
+    def __repr__(self):
+        return "MpiPartition(ngroups=" + str(self.ngroups) + ", nprocs=" \
+            + str(self.nprocs_world) + ")"
+
+    @property
+    def fortran_comm(self):
+        """
+        Return the communicator of this process's group, converted for
+        Fortran codes such as mattopt.vmec.core.VMEC.
+        """
+        return self.comm_groups.py2f()
+
+    def columns(self, n, group=None):
+        """
+        Return the range of the columns, out of n, that are computed by a
+        group (by default, the group of this process). The columns are
+        divided into contiguous blocks whose sizes differ by at most 1.
+        """
+        if group is None:
+            group = self.group
+        return range(group * n // self.ngroups, (group + 1) * n // self.ngroups)
@@ -10,8 +10,41 @@ constraints, i.e. upper and lower bounds.
 This module contains the Parameter class, which stores a single value,
 and the ParameterArray class, which stores arbitrary-dimension arrays
 of Parameters.
+
+The val, fixed, min, and max attributes of Parameters are not stored
+in the Parameter objects themselves, but in contiguous numpy arrays
+held by a _ParameterStorage object. A ParameterArray owns one storage
+object for all of its elements, and each element is a Parameter that
+acts as a thin view into that storage. This way the bulk operations of
+ParameterArray, such as set_val() and get_val(), are single vectorized
+numpy operations. A standalone Parameter owns a _ScalarStorage
+instead, which holds its attributes as plain python objects, so that
+it stays small and cheap to create.
+
+Setting the val of a Parameter calls all of its observers. When many
+Parameters are changed together, the changes can be wrapped in a
+"with parameter_batch():" block, so each distinct observer is called
+only once, when the block exits. Observers are registered once per
+storage, e.g. with ParameterArray.add_observer(), rather than once per
+element. Only elements whose observers differ from the rest of their
+array carry their own set.
+
+Each Parameter also carries a version number, which increases every
+time its val changes to a different value. Version numbers are drawn
+from one global counter, so the largest version in a collection of
+Parameters tells whether anything in the collection has changed since
+a given version, without registering an observer.
+
+The set of non-fixed Parameters in each storage is tracked
+incrementally as the fixed attributes change, so it is available
+without scanning all the Parameters.
+
+A ParameterGroup is an immutable set of Parameters that is validated
+once, when it is created, so it can be shared by many Targets.
 """
 
+from contextlib import contextmanager
+import itertools
 import numpy as np
 
 def isbool(val):
@@ -29,106 +62,713 @@ def isnumber(val):
     return isinstance(val, int) or isinstance(val, float) or \
         isinstance(val, np.int_) or isinstance(val, np.float)
 
+def _as_storage_array(arr, dtype=None, shared=False):
+    """
+    Convert arr to a flat numpy array suitable for a
+    _ParameterStorage. If dtype is None, integer and float data are
+    stored as float64, so a later assignment of a float does not get
+    truncated, and any other data (bool, complex, or something more
+    exotic) keeps its type.
+
+    If shared is True and arr is a single value broadcast to a shape
+    (as from numpy.broadcast_to), the result is a read-only broadcast
+    of that value, which takes no memory per element. The storage
+    replaces it by a real array the first time it is written.
+    """
+    arr = np.asarray(arr)
+    if dtype is None:
+        dtype = np.float64 if arr.dtype.kind in 'iuf' else arr.dtype
+    if shared and arr.size > 0 and not any(arr.strides):
+        value = np.empty((), dtype=dtype)
+        value[()] = arr.flat[0]
+        return np.broadcast_to(value, (arr.size,))
+    return np.array(arr, dtype=dtype).ravel()
+
+# Observers of a Parameter that has none. This set is immutable so it
+# can be shared by all such Parameters:
+_no_observers = frozenset()
+
+def _scalar_array(val, dtype=object):
+    """
+    Return a numpy array of length 1 containing val. With the default
+    dtype, val keeps its exact type.
+    """
+    arr = np.empty(1, dtype=dtype)
+    arr[0] = val
+    return arr
+
+def _changed(old, new):
+    """
+    Return a numpy array of bools that is True wherever old and new
+    differ. If the values cannot be compared, they are considered to
+    differ.
+    """
+    try:
+        return np.asarray(old != new, dtype=bool)
+    except (TypeError, ValueError):
+        return np.full(np.shape(old), True)
+
+# Source of version numbers for all Parameters:
+_versions = itertools.count(1)
+
+def _next_version():
+    """
+    Return a new version number, larger than all the earlier ones.
+    """
+    return next(_versions)
+
+def _advance_versions(version):
+    """
+    Make sure the version numbers given from now on are larger than
+    version, which was obtained in another process.
+    """
+    global _versions
+    if next(_versions) <= version:
+        _versions = itertools.count(version + 1)
+
+class _Batch:
+    """
+    This class records the state of parameter_batch() blocks: how
+    deeply they are nested, and which observers need to be called when
+    the outermost block exits. The pending observers are stored as the
+    keys of a dict, so each is called once, in the order in which they
+    were first encountered.
+    """
+    def __init__(self):
+        self.depth = 0
+        self.pending = {}
+
+    def flush(self):
+        """
+        Call all the pending observers.
+        """
+        pending = list(self.pending)
+        self.pending.clear()
+        for observer in pending:
+            observer()
+
+_batch = _Batch()
+
+class _FixedTracker:
+    """
+    This class counts the changes to the fixed attribute of any
+    Parameter. Anything that depends only on which Parameters are
+    fixed, such as the free indices of a ParameterSpace, can be cached
+    and reused as long as the count has not changed.
+    """
+    def __init__(self):
+        self.epoch = 0
+
+_fixed_tracker = _FixedTracker()
+
+@contextmanager
+def parameter_batch():
+    """
+    Context manager for changing many Parameters at once. Inside the
+    block, setting the val of a Parameter does not call its observers
+    immediately. Instead, each distinct observer of all the changed
+    Parameters is called exactly once when the outermost block
+    exits. Blocks may be nested.
+    """
+    _batch.depth += 1
+    try:
+        yield
+    finally:
+        _batch.depth -= 1
+        if _batch.depth == 0:
+            _batch.flush()
+
+def _notify(observers):
+    """
+    Call each observer in the iterable observers, or defer the calls
+    to the end of the current parameter_batch() block if there is one.
+    """
+    if _batch.depth > 0:
+        for observer in observers:
+            _batch.pending[observer] = None
+    else:
+        for observer in observers:
+            observer()
+
+# Largest number of offending elements listed in a bounds error:
+_max_listed = 10
+
+def _bounds_message(violations):
+    """
+    Combine the strings returned by bounds_violations() into one error
+    message.
+    """
+    return "Bounds violated. " + " ".join(v + "." for v in violations)
+
+class _ParameterStorage:
+    """
+    This class holds the val, fixed, min, max, name, and observers
+    attributes of a collection of Parameters. Each Parameter refers to
+    one storage object and an integer index into it. The attributes
+    other than observers are stored in flat numpy arrays.
+
+    observers is one frozenset of callables, shared by all the
+    elements. If some elements have different observers, these are
+    stored in the dict element_observers, which maps the storage index
+    of the element to its frozenset. Otherwise element_observers is
+    None.
+    """
+    __slots__ = ('val', 'fixed', 'min', 'max', 'name', 'observers', \
+                     'element_observers', 'namer', 'shape', 'latest', \
+                     'version', 'serial', 'nfree', '_free_indices')
+
+    # The storage of a standalone Parameter is a _ScalarStorage:
+    standalone = False
+
+    def __init__(self, val, fixed, min, max, name, observers, \
+                     element_observers=None, namer=None, shape=None):
+        """
+        The arguments val through name should be flat numpy arrays of
+        the same size. Only val must be writeable; the others may be
+        shared read-only arrays, which are copied when first
+        written. observers and element_observers are described
+        above. namer, if not None, is a callable used to generate the
+        name of any element whose name is None, when the name is
+        requested. It is called with the indices of the element in an
+        array of the given shape.
+        """
+        self.val = val
+        self.fixed = fixed
+        self.min = min
+        self.max = max
+        self.name = name
+        self.observers = observers
+        self.element_observers = element_observers
+        self.namer = namer
+        self.shape = val.shape if shape is None else shape
+        # version holds the version number of each element, and
+        # latest holds the largest of these.
+        self.latest = next(_versions)
+        self.version = np.empty(val.size, dtype=np.int64)
+        self.version.fill(self.latest)
+        # serial is unique to each storage and increases in order of
+        # creation, so it gives a reproducible ordering of Parameters:
+        self.serial = self.latest
+        # nfree is the number of non-fixed elements. The sorted array
+        # of their indices is built on demand and cached until fixed
+        # changes.
+        self.nfree = val.size - int(np.count_nonzero(fixed))
+        self._free_indices = None
+
+    @property
+    def size(self):
+        return self.val.size
+
+    def __getstate__(self):
+        """
+        Every version number of this process, in the storage or in the
+        objects pickled with it (e.g. the Targets and TargetGraph of a
+        LeastSquaresProblem), is smaller than the one added here.
+        """
+        state = {attr: getattr(self, attr) for attr in self.__slots__}
+        state['pickled_version'] = next(_versions)
+        return state
+
+    def __setstate__(self, state):
+        """
+        Version numbers given after unpickling must be larger than the
+        ones that come from the pickling process. Otherwise, in a new
+        process whose counter starts again at 1, changes would go
+        unnoticed.
+        """
+        state = dict(state)
+        _advance_versions(state.pop('pickled_version'))
+        for attr, value in state.items():
+            setattr(self, attr, value)
+
+    def writeable(self, attr):
+        """
+        Return the array holding attribute attr, first replacing it by
+        a private copy if it is a shared read-only array.
+        """
+        arr = getattr(self, attr)
+        if not arr.flags.writeable:
+            arr = arr.copy()
+            setattr(self, attr, arr)
+        return arr
+
+    def get_name(self, index):
+        """
+        Return the name of the element with the given storage index,
+        generating it with namer if necessary.
+        """
+        name = self.name[index]
+        if name is None and self.namer is not None:
+            name = self.namer(*np.unravel_index(index, self.shape))
+        return name
+
+    def get_observers(self, index):
+        """
+        Return the frozenset of observers of the element with the
+        given storage index.
+        """
+        if self.element_observers is not None:
+            observers = self.element_observers.get(index)
+            if observers is not None:
+                return observers
+        return self.observers
+
+    def set_observers(self, indices, observers):
+        """
+        Set the observers of the elements with the given storage
+        indices. observers can be one frozenset for all these
+        elements, or a sequence of frozensets with one entry for each
+        element of indices. If indices is None, observers must be a
+        frozenset, which becomes the observers of every element in
+        O(1) time.
+        """
+        if indices is None:
+            self.observers = observers
+            self.element_observers = None
+            return
+        indices = np.ravel(indices).tolist()
+        if isinstance(observers, frozenset):
+            observers = itertools.repeat(observers)
+        overrides = self.element_observers
+        if overrides is None:
+            overrides = {}
+        for index, element_observers in zip(indices, observers):
+            if element_observers == self.observers:
+                overrides.pop(index, None)
+            else:
+                overrides[index] = element_observers
+        self.element_observers = overrides if overrides else None
+
+    def update_observers(self, indices, function):
+        """
+        Replace the observers of each element with the given storage
+        indices by function(observers). If indices is None, all the
+        elements are updated, in time proportional to the number of
+        distinct sets of observers rather than to the number of
+        elements.
+        """
+        if indices is None:
+            self.observers = function(self.observers)
+            if self.element_observers is not None:
+                self.element_observers = {index: function(observers) \
+                                              for index, observers \
+                                              in self.element_observers.items()}
+            return
+        indices = np.ravel(indices).tolist()
+        self.set_observers(indices, [function(self.get_observers(index)) \
+                                         for index in indices])
+
+    def set_fixed(self, indices, fixed):
+        """
+        Set the fixed attribute of the elements with the given storage
+        indices, updating the count of non-fixed elements.
+        """
+        old = self.fixed[indices]
+        changed = _changed(old, fixed)
+        if not np.any(changed):
+            return
+        fixed_array = self.writeable('fixed')
+        fixed_array[indices] = fixed
+        # Count from the whole mask, since indices may repeat an
+        # element:
+        self.nfree = fixed_array.size - int(np.count_nonzero(fixed_array))
+        self._free_indices = None
+        _fixed_tracker.epoch += 1
+
+    @property
+    def free_indices(self):
+        """
+        Return a sorted numpy array with the storage indices of the
+        non-fixed elements.
+        """
+        if self._free_indices is None:
+            self._free_indices = np.flatnonzero(np.logical_not(self.fixed))
+        return self._free_indices
+
+    def bounds_violations(self, indices, val=None, min=None, max=None):
+        """
+        Vectorized check that min <= val <= max for the elements with
+        the given storage indices. Potential new values for val, min,
+        or max can be checked via the optional arguments. Return a list
+        of strings describing each kind of violation, which is empty
+        if the bounds are satisfied.
+        """
+        if val is None:
+            val = self.val[indices]
+        if min is None:
+            min = self.min[indices]
+        if max is None:
+            max = self.max[indices]
+
+        violations = []
+        for bad, relation, left, left_label, right, right_label in \
+                ((min > max, "min > max", min, "min", max, "max"), \
+                     (val < min, "val < min", val, "val", min, "min"), \
+                     (val > max, "val > max", val, "val", max, "max")):
+            if not np.any(bad):
+                continue
+            # Only describe the offending elements:
+            shape = np.shape(bad)
+            bad_indices = np.broadcast_to(indices, shape)[bad]
+            left = np.broadcast_to(left, shape)[bad]
+            right = np.broadcast_to(right, shape)[bad]
+            listed = [self._element_label(index) + ": " + left_label + " = " \
+                          + str(l) + ", " + right_label + " = " + str(r) \
+                          for index, l, r in zip(bad_indices[:_max_listed], \
+                                                     left, right)]
+            message = str(bad_indices.size) + " Parameter(s) have " \
+                + relation + ": " + "; ".join(listed)
+            if bad_indices.size > _max_listed:
+                message += "; and " + str(bad_indices.size - _max_listed) \
+                    + " more"
+            violations.append(message)
+        return violations
+
+    def _element_label(self, index):
+        """
+        Return a string identifying the element with the given storage
+        index in an error message.
+        """
+        name = self.get_name(index)
+        label = str(tuple(int(j) for j in np.unravel_index(index, self.shape)))
+        if name is not None:
+            label += " (" + str(name) + ")"
+        return label
+
+    def verify_bounds(self, indices, val=None, min=None, max=None):
+        """
+        Raise a ValueError listing the offending elements if
+        min <= val <= max is not satisfied for all the elements with
+        the given storage indices. The arguments are the same as for
+        bounds_violations().
+        """
+        violations = self.bounds_violations(indices, val=val, min=min, \
+                                                max=max)
+        if violations:
+            raise ValueError(_bounds_message(violations))
+
+    def set_val(self, indices, val, checked=False):
+        """
+        Write new vals for the elements with the given storage indices,
+        after checking the bounds unless checked is True. Only the
+        elements whose val actually changes get a new version number
+        and notify their observers.
+        """
+        if not checked:
+            self.verify_bounds(indices, val=val)
+        changed = _changed(self.val[indices], val)
+        self.val[indices] = val
+        if np.any(changed):
+            changed_indices = indices[changed]
+            self.touch(changed_indices)
+            self.notify(changed_indices)
+
+    def touch(self, indices):
+        """
+        Record that the vals with the given storage indices have
+        changed, by giving them a new version number.
+        """
+        self.latest = next(_versions)
+        self.version[indices] = self.latest
+
+    def notify(self, indices):
+        """
+        Call the observers of the Parameters with the given storage
+        indices. Each distinct observer is called once.
+        """
+        overrides = self.element_observers
+        if overrides is None:
+            # All the elements share the same observers:
+            _notify(self.observers)
+            return
+        with parameter_batch():
+            notified = False
+            for index in np.ravel(indices).tolist():
+                observers = overrides.get(index)
+                if observers is not None:
+                    _notify(observers)
+                elif not notified:
+                    _notify(self.observers)
+                    notified = True
+
+def _scalar(val):
+    """
+    Return the element of an array of length 1, or val itself if it is
+    not an array.
+    """
+    if isinstance(val, np.ndarray):
+        return val.flat[0]
+    return val
+
+class _ScalarStorage:
+    """
+    This class holds the attributes of a standalone Parameter. It has
+    the methods of _ParameterStorage, for the single element with
+    storage index 0, but the attributes are plain python objects
+    rather than numpy arrays, and latest is the version number of the
+    element. This keeps standalone Parameters small and fast to create.
+    """
+    __slots__ = ('val', 'fixed', 'min', 'max', 'name', 'observers', \
+                     'namer', 'latest', 'serial')
+
+    standalone = True
+    shape = ()
+    size = 1
+    element_observers = None
+
+    def __init__(self, val, fixed, min, max, name, observers, namer=None):
+        self.val = val
+        self.fixed = fixed
+        self.min = min
+        self.max = max
+        self.name = name
+        self.observers = observers
+        self.namer = namer
+        self.latest = next(_versions)
+        self.serial = self.latest
+
+    # The version numbers are handled as for a _ParameterStorage:
+    __getstate__ = _ParameterStorage.__getstate__
+    __setstate__ = _ParameterStorage.__setstate__
+
+    @property
+    def nfree(self):
+        return 0 if self.fixed else 1
+
+    def get_name(self, index):
+        if self.name is None and self.namer is not None:
+            return self.namer()
+        return self.name
+
+    def get_observers(self, index):
+        return self.observers
+
+    def set_observers(self, indices, observers):
+        if not isinstance(observers, frozenset):
+            observers, = observers
+        self.observers = observers
+
+    def update_observers(self, indices, function):
+        self.observers = function(self.observers)
+
+    def set_fixed(self, indices, fixed):
+        fixed = _scalar(fixed)
+        if fixed == self.fixed:
+            return
+        self.fixed = fixed
+        _fixed_tracker.epoch += 1
+
+    def bounds_violations(self, indices, val=None, min=None, max=None):
+        """
+        Check that min <= val <= max, returning a list of strings as
+        _ParameterStorage.bounds_violations() does. The optional
+        arguments may be single values or arrays of length 1.
+        """
+        val = self.val if val is None else _scalar(val)
+        min = self.min if min is None else _scalar(min)
+        max = self.max if max is None else _scalar(max)
+        violations = []
+        for bad, relation, left, left_label, right, right_label in \
+                ((min > max, "min > max", min, "min", max, "max"), \
+                     (val < min, "val < min", val, "val", min, "min"), \
+                     (val > max, "val > max", val, "val", max, "max")):
+            if bad:
+                violations.append("1 Parameter(s) have " + relation + ": " \
+                                      + self._element_label(0) + ": " \
+                                      + left_label + " = " + str(left) \
+                                      + ", " + right_label + " = " \
+                                      + str(right))
+        return violations
+
+    def _element_label(self, index):
+        name = self.get_name(index)
+        return "Parameter" if name is None else str(name)
+
+    verify_bounds = _ParameterStorage.verify_bounds
+
+    def set_val(self, indices, val, checked=False):
+        val = _scalar(val)
+        if not checked:
+            self.verify_bounds(indices, val=val)
+        changed = np.any(_changed(self.val, val))
+        self.val = val
+        if changed:
+            self.touch(indices)
+            self.notify(indices)
+
+    def touch(self, indices):
+        self.latest = next(_versions)
+
+    def notify(self, indices):
+        _notify(self.observers)
+
 class Parameter:
     """
     This class represents a value that has the potential to be varied
     in an optimization, though sometime it may also be held
-    fixed. This class has private variables _val, _fixed, _min, and
-    _max. For each of these variables there is a public "property":
-    val, fixed, min, and max. By using the @property decorator it is
-    possible to do some validation any time a user attempts to change
-    the attributes.
+    fixed. This class has public "properties" val, fixed, min, and
+    max. By using the @property decorator it is possible to do some
+    validation any time a user attempts to change the attributes.
+
+    The data behind these properties lives in a storage object, at
+    position _index. The elements of a ParameterArray share the
+    _ParameterStorage of the array, whereas a standalone Parameter has
+    its own _ScalarStorage.
 
     The instance variables val, min, and max can be any type, not just
     float. This is important because we may want parameters that have
     type int, bool, complex, or something more exotic.
+
+    To keep Parameters small, the class uses __slots__.
     """
+    __slots__ = ('_storage', '_index')
+
     def __init__(self, val=0.0, observers=None, fixed=True, min=np.NINF, \
                      max=np.Inf, name=None):
         """
         Constructor. observer can be None, or a single callable, or a
-        set of callables.
+        set of callables. name can be a str, or a callable with no
+        arguments that returns the name. In the latter case the name
+        is only generated when it is requested.
         """
-        self._val = val
-        self._fixed = fixed
-        self._min = min
-        self._max = max
-        self.verify_bounds()
-        self.name = name
-        # Initialize _observers to be a set of all observers
+        # Initialize observers to be a set of all observers
         if observers is None:
-            self._observers = set()
+            observers = _no_observers
         elif callable(observers):
-            self._observers = {observers}
+            observers = frozenset((observers,))
         elif type(observers) is set:
             for s in observers:
                 if not callable(s):
                     raise ValueError("observers must be None, a callable, or " \
                                          + "a set of callable objects.")
-            self._observers = observers
+            observers = frozenset(observers)
         else:
             raise ValueError("observers must be None, a callable, or a set " \
                                  + "of callable objects.")
 
+        namer = None
+        if callable(name):
+            namer = name
+            name = None
+
+        self._storage = _ScalarStorage(val, fixed, min, max, name, \
+                                           observers, namer=namer)
+        self._index = 0
+        self.verify_bounds()
+
+    @classmethod
+    def _view(cls, storage, index):
+        """
+        Create a Parameter that refers to element index of an
+        existing _ParameterStorage, without copying any data.
+        """
+        param = cls.__new__(cls)
+        param._storage = storage
+        param._index = index
+        return param
+
     # When "val", "min", or "max" is altered by a user, we should
     # check that val is indeed in between min and max.
 
     @property
     def val(self):
-        return self._val
+        storage = self._storage
+        if storage.standalone:
+            return storage.val
+        return storage.val[self._index]
 
     @val.setter
     def val(self, newval):
         self.verify_bounds(val=newval)
-        self._val = newval
-        # Update all objects that observe this Parameter:
-        for observers in self._observers:
-            observers()
+        storage = self._storage
+        index = self._index
+        standalone = storage.standalone
+        old = storage.val if standalone else storage.val[index]
+        # A plain comparison is enough for scalars. Values that cannot
+        # be compared this way go through _changed():
+        try:
+            changed = bool(old != newval)
+        except (TypeError, ValueError):
+            changed = np.any(_changed(old, newval))
+        if standalone:
+            storage.val = newval
+        else:
+            storage.val[index] = newval
+        # If the value actually changed, update the version number and
+        # all objects that observe this Parameter:
+        if changed:
+            version = next(_versions)
+            storage.latest = version
+            if not standalone:
+                storage.version[index] = version
+            storage.notify(index)
 
     @property
     def min(self):
-        return self._min
+        storage = self._storage
+        if storage.standalone:
+            return storage.min
+        return storage.min[self._index]
 
     @min.setter
     def min(self, newmin):
         self.verify_bounds(min=newmin)
-        self._min = newmin
+        if self._storage.standalone:
+            self._storage.min = newmin
+        else:
+            self._storage.writeable('min')[self._index] = newmin
 
     @property
     def max(self):
-        return self._max
+        storage = self._storage
+        if storage.standalone:
+            return storage.max
+        return storage.max[self._index]
 
     @max.setter
     def max(self, newmax):
         self.verify_bounds(max=newmax)
-        self._max = newmax
+        if self._storage.standalone:
+            self._storage.max = newmax
+        else:
+            self._storage.writeable('max')[self._index] = newmax
 
     # When "fixed" is changed, we do not need to verify the bounds,
     # but we do want to ensure that "fixed" has type bool.
     @property
     def fixed(self):
-        return self._fixed
+        storage = self._storage
+        if storage.standalone:
+            return storage.fixed
+        return storage.fixed[self._index]
 
     @fixed.setter
     def fixed(self, value):
         if not isbool(value):
             raise ValueError(
                 "fixed attribute of a Parameter must have type bool.")
-        self._fixed = value
+        self._storage.set_fixed(self._index, value)
 
     @property
     def name(self):
-        return self._name
+        return self._storage.get_name(self._index)
 
     @name.setter
     def name(self, newname):
         # At some point we may want to force name to be a str, but for
         # now no validation is done.
-        self._name = newname
+        if self._storage.standalone:
+            self._storage.name = newname
+        else:
+            self._storage.writeable('name')[self._index] = newname
 
     @property
     def observers(self):
-        return self._observers
+        """
+        Return the frozenset of callables that are called when val
+        changes.
+        """
+        return self._storage.get_observers(self._index)
 
     @observers.setter
     def observers(self, newobservers):
@@ -138,7 +778,56 @@ class Parameter:
         for x in newobservers:
             if not callable(x):
                 raise ValueError(errmsg)
-        self._observers = newobservers
+        self._storage.set_observers(self._owner_index(), \
+                                        frozenset(newobservers))
+
+    # Alias for code that accesses the observers directly:
+    _observers = observers
+
+    def _owner_index(self):
+        """
+        Return the storage index of this Parameter, or None if the
+        Parameter is the only element of its storage.
+        """
+        return None if self._storage.standalone else self._index
+
+    def add_observer(self, observer):
+        """
+        Add a callable to the observers of this Parameter.
+        """
+        if not callable(observer):
+            raise ValueError("observer must be callable")
+        self._storage.update_observers(self._owner_index(), \
+                                           lambda s: s | {observer})
+
+    def remove_observer(self, observer):
+        """
+        Remove a callable from the observers of this Parameter, if it
+        is present.
+        """
+        self._storage.update_observers(self._owner_index(), \
+                                           lambda s: s - {observer})
+
+    @property
+    def version(self):
+        """
+        Return the version number of this Parameter, which increases
+        each time val is changed to a different value.
+        """
+        storage = self._storage
+        if storage.standalone:
+            return storage.latest
+        return int(storage.version[self._index])
+
+    def changed_since(self, version):
+        """
+        Return True if val has changed since the given version number
+        was obtained.
+        """
+        storage = self._storage
+        if storage.standalone:
+            return storage.latest > version
+        return storage.version[self._index] > version
 
     def __repr__(self):
         """
@@ -149,23 +838,23 @@ class Parameter:
         else:
             namestr = str(self.name) + "="
 
-        return namestr + str(self._val) + ' (fixed=' + str(self._fixed) \
-            + ', min=' + str(self._min) + ', max=' + str(self._max) + ')'
+        return namestr + str(self.val) + ' (fixed=' + str(self.fixed) \
+            + ', min=' + str(self.min) + ', max=' + str(self.max) + ')'
 
     def verify_bounds(self, val=None, min=None, max=None):
         """
         Check that the value, lower bound, and upper bound are
         consistent. If no arguments are supplied, the method checks
-        the private variables of this instance. The method can also
+        the stored values of this instance. The method can also
         check potential new values for val, min, or max, via optional
         arguments.
         """
         if val is None:
-            val = self._val
+            val = self.val
         if min is None:
-            min = self._min
+            min = self.min
         if max is None:
-            max = self._max
+            max = self.max
 
         if min > max:
             raise ValueError("Parameter has min > max. " +
@@ -181,6 +870,56 @@ class Parameter:
                                ", max = " + str(max))
 
 
+class ParameterGroup(frozenset):
+    """
+    A ParameterGroup is an immutable set of Parameters. The type of
+    each element is checked once, when the group is created, so a
+    group can be passed to any number of Targets and Computations
+    without checking the elements again. The union of two groups,
+    with | or union(), is also a ParameterGroup and needs no checking.
+    """
+
+    def __new__(cls, parameters=()):
+        """
+        parameters can be any iterable of Parameter objects.
+        """
+        group = frozenset.__new__(cls, parameters)
+        for param in group:
+            if type(param) is not Parameter:
+                raise ValueError("Each element of a ParameterGroup must have " \
+                                     "type Parameter.")
+        return group
+
+    @classmethod
+    def _trusted(cls, parameters):
+        """
+        Create a ParameterGroup from an iterable known to contain only
+        Parameters, without checking the elements.
+        """
+        return frozenset.__new__(cls, parameters)
+
+    def __repr__(self):
+        return "ParameterGroup(" + str(len(self)) + " Parameters)"
+
+    def __or__(self, other):
+        if isinstance(other, ParameterGroup):
+            return ParameterGroup._trusted(frozenset.__or__(self, other))
+        if not isinstance(other, (set, frozenset)):
+            return NotImplemented
+        return ParameterGroup(frozenset.__or__(self, other))
+
+    def union(self, *others):
+        """
+        Return a ParameterGroup with the Parameters of this group and
+        of all the other groups or sets.
+        """
+        result = self
+        for other in others:
+            if not isinstance(other, (set, frozenset)):
+                other = frozenset(other)
+            result = result | other
+        return result
+
 class ParameterArrayOld:
     """
     This class stores arrays of parameters. However instead of storing
@@ -354,8 +1093,27 @@ class ParameterArray:
     of the individual Parameters, and getting the set of all non-fixed
     elements.
 
+    The val, fixed, min, and max attributes of all the elements are
+    stored in contiguous numpy arrays owned by the ParameterArray, and
+    each element of data is a Parameter that acts as a view into these
+    arrays. Therefore the bulk methods set_val(), set_min(),
+    set_max(), set_fixed(), and get_val() are single vectorized numpy
+    operations rather than loops over the Parameters.
+
     If type(name) is not a numpy.ndarray of the same shape as val,
     whatever name is supplied will be replicated for all Parameters.
+    Alternatively name can be a callable, which is called with the
+    indices of an element to generate its name the first time the
+    name is requested. Values of fixed, min, max, name, and observers
+    that are the same for all elements are stored only once.
+
+    A ParameterArray can be indexed and sliced like a numpy.ndarray.
+    Indexing a single element returns that Parameter, and any other
+    index returns a ParameterArray that is a view into the same
+    storage, so no new Parameters are created. For instance
+    surf.rc[2:, :].set_fixed(False) frees a block of Fourier modes with
+    one vectorized operation. Assigning to an index, as in
+    surf.rc[2:, :] = 0, sets the val of the selected Parameters.
     """
     def __init__(self, val=np.array([0.0]), observers=None, fixed=True, \
                      min=np.NINF, max=np.Inf, name=None):
@@ -371,21 +1129,25 @@ class ParameterArray:
 
         # Handle min
         if not isinstance(min, np.ndarray):
-            min = np.full(val.shape, min)
+            min = np.broadcast_to(min, val.shape)
         if min.shape != val.shape:
             raise ValueError( \
                 "Shape of min does not match shape of val.")
  
         # Handle max
         if not isinstance(max, np.ndarray):
-            max = np.full(val.shape, max)
+            max = np.broadcast_to(max, val.shape)
         if max.shape != val.shape:
             raise ValueError( \
                 "Shape of max does not match shape of val.")
 
         # Handle name
+        namer = None
+        if callable(name):
+            namer = name
+            name = None
         if type(name) is not np.ndarray:
-            name = np.full(val.shape, name)
+            name = np.broadcast_to(_scalar_array(name), val.shape)
         if name.shape != val.shape:
             raise ValueError("Shape of name does not match shape of val.")
 
@@ -393,7 +1155,7 @@ class ParameterArray:
         errstr = "fixed must be None, a bool, or " \
             + "convertable to a numpy ndarray of bools."
         if fixed is None or isbool(fixed):
-            fixed = np.full(val.shape, fixed)
+            fixed = np.broadcast_to(np.array(fixed, dtype=bool), val.shape)
         else:
             try:
                 fixed = np.array(fixed)
@@ -407,21 +1169,24 @@ class ParameterArray:
             if not isbool(x):
                 raise ValueError(errstr + " type=" + str(type(x)))
 
-        # Verify observers
+        # Verify observers. A single set of observers for the whole
+        # array is stored once. An array of sets is stored as the set
+        # of the first element plus the elements that differ from it.
         errstr = "observers must be none, a callable, or " \
             + "convertable to a numpy ndarray of callables."
+        element_observers = None
         if observers is None:
             # Set observers to the empty set.
-            observers = np.full(val.shape, set())
+            observers = _no_observers
         elif callable(observers):
-            observers = np.full(val.shape, {observers})
+            observers = frozenset((observers,))
         elif type(observers) is set:
             # Verify each element in the set is callable
             for x in observers:
                 if not callable(x):
                     raise ValueError( \
                     "Each element in the observers set must be callable.")
-            observers = np.full(val.shape, observers)
+            observers = frozenset(observers)
         else:
             try:
                 observers = np.array(observers)
@@ -431,36 +1196,51 @@ class ParameterArray:
                 raise ValueError( \
                     "Shape of observers does not match shape of val.")
             # Ensure every element is a set of callables:
-            it = np.nditer(observers, flags=['multi_index','refs_ok'])
-            for x in it:
-                y = observers[it.multi_index]
-                if type(y) is not set:
+            for y in observers.flat:
+                if not isinstance(y, (set, frozenset)):
                     raise ValueError(errstr)
                 for z in y:
                     if not callable(z):
                         raise ValueError(errstr)
-
-        # At this point, val, fixed, min, max, name, and observers
-        # should all be ndarrays of the same shape.
+            element_observers = {}
+            shared_observers = _no_observers
+            for j, y in enumerate(observers.flat):
+                y = frozenset(y)
+                if j == 0:
+                    shared_observers = y
+                elif y != shared_observers:
+                    element_observers[j] = y
+            observers = shared_observers
+            if not element_observers:
+                element_observers = None
+
+        # At this point, val, fixed, min, max, and name should all be
+        # ndarrays of the same shape.
         assert(val.shape == fixed.shape)
         assert(val.shape == min.shape)
         assert(val.shape == max.shape)
         assert(val.shape == name.shape)
-        assert(val.shape == observers.shape)
-
-        # Now build the _data array. Start with a dummy array, then
-        # over-write the elements with the real Parameters.
-        temp_param = Parameter()
-        self._data = np.full(val.shape, temp_param)
-        # See https://numpy.org/devdocs/reference/arrays.nditer.html
-        with np.nditer(self._data, flags=['multi_index','refs_ok'], op_flags=['writeonly']) as it:
-            for x in it:
-                x[...] = Parameter(val=val[it.multi_index], \
-                                       fixed=fixed[it.multi_index], \
-                                       min=min[it.multi_index], \
-                                       max=max[it.multi_index], \
-                                       name=name[it.multi_index], \
-                                       observers=observers[it.multi_index])
+
+        self._storage = _ParameterStorage( \
+            _as_storage_array(val), \
+            _as_storage_array(fixed, dtype=bool, shared=True), \
+            _as_storage_array(min, shared=True), \
+            _as_storage_array(max, shared=True), \
+            _as_storage_array(name, dtype=object, shared=True), \
+            observers, element_observers=element_observers, \
+            namer=namer, shape=val.shape)
+        # _indices maps each element of the array to its position in
+        # the storage.
+        self._indices = np.arange(val.size).reshape(val.shape)
+        self._storage.verify_bounds(self._indices)
+        # For a view, _base is the ParameterArray that owns the storage:
+        self._base = None
+
+        # Now build the _data array of Parameters that are views into
+        # the storage.
+        self._data = np.empty(val.shape, dtype=object)
+        for j in range(val.size):
+            self._data.flat[j] = Parameter._view(self._storage, j)
 
     @property
     def data(self):
@@ -469,6 +1249,41 @@ class ParameterArray:
         """
         return self._data
 
+    def __getitem__(self, key):
+        """
+        Return a single Parameter if key selects one element, or
+        otherwise a ParameterArray view of the selected elements.
+        """
+        indices = self._indices[key]
+        if np.ndim(indices) == 0:
+            return self._data[key]
+        view = object.__new__(type(self))
+        view._storage = self._storage
+        view._indices = indices
+        view._data = self._data[key]
+        view._base = self if self._base is None else self._base
+        return view
+
+    def __setitem__(self, key, val):
+        """
+        Set the val of the selected elements, as in set_val().
+        """
+        indices = np.asarray(self._indices[key])
+        try:
+            val = np.broadcast_to(np.asarray(val), indices.shape)
+        except ValueError:
+            raise ValueError("Shape of val does not match shape of the " \
+                                 "selected elements")
+        self._storage.set_val(indices, val)
+
+    @property
+    def base(self):
+        """
+        Return the ParameterArray that owns the storage if this is a
+        view, or None otherwise.
+        """
+        return self._base
+
     @property
     def shape(self):
         """
@@ -476,46 +1291,95 @@ class ParameterArray:
         """
         return self._data.shape
 
+    @property
+    def version(self):
+        """
+        Return the largest version number of the Parameters in this
+        array. This is O(1) unless the array is a view, since the
+        storage tracks it.
+        """
+        if self._base is None:
+            return self._storage.latest
+        if self._indices.size == 0:
+            return 0
+        return int(np.max(self._storage.version[self._indices]))
+
+    def changed_since(self, version):
+        """
+        Return True if the val of any Parameter in this array has
+        changed since the given version number was obtained.
+        """
+        return self.version > version
+
     @classmethod
     def from_array(cls, arr):
         """
         Build a ParameterArray given an array of Parameters. The
         argument arr must be convertable to a numpy ndarray and all
         the elements must have type Parameter.
+
+        The attributes of the Parameters are moved into the storage of
+        the new ParameterArray, so the Parameter objects remain valid
+        and become views into the new array. For this reason each
+        Parameter must be a standalone Parameter, not an element of
+        another ParameterArray, and may appear only once in arr.
         """
         try:
             arr = np.array(arr)
         except:
             raise RuntimeError('arr must be convertable to numpy.ndarray')
-        it = np.nditer(arr, flags=['multi_index','refs_ok'])
-        for x in it:
-            if type(arr[it.multi_index]) is not Parameter:
+        params = list(arr.flat)
+        for p in params:
+            if type(p) is not Parameter:
                 raise ValueError('Elements of arr must have type Parameter')
-
-        # Start with a dummy ParameterArray:
-        pa = cls([0.0])
-        # Now replace the dummy data with the actual data:
-        pa._data = arr
+            if not p._storage.standalone:
+                raise ValueError('Elements of arr must not already belong ' \
+                                     'to a ParameterArray')
+        if len(set(params)) != len(params):
+            raise ValueError('Elements of arr must be distinct')
+
+        observers = np.empty(arr.shape, dtype=object)
+        for j, p in enumerate(params):
+            observers.flat[j] = p.observers
+        pa = cls(np.array([p.val for p in params]).reshape(arr.shape), \
+                     observers=observers, \
+                     fixed=np.array([p.fixed for p in params], \
+                                        dtype=bool).reshape(arr.shape), \
+                     min=np.array([p.min for p in params]).reshape(arr.shape), \
+                     max=np.array([p.max for p in params]).reshape(arr.shape), \
+                     name=np.array([p.name for p in params], \
+                                       dtype=object).reshape(arr.shape))
+        # Re-point the original Parameter objects to the new storage:
+        for j, p in enumerate(params):
+            p._storage = pa._storage
+            p._index = j
+            pa._data.flat[j] = p
         return pa
 
+    def _expand(self, arr, label):
+        """
+        Convert a single value or an array-like argument to a
+        numpy.ndarray with the shape of this ParameterArray.
+        """
+        try:
+            return np.broadcast_to(np.asarray(arr), self.shape)
+        except ValueError:
+            raise ValueError("Shape of " + label + " does not match shape " \
+                                 "of this ParameterArray")
+
     def set_val(self, val):
         """
         Over-write the val attribute of all the Parameters. If val
         does not have type numpy.ndarray, then a ndarray will be used
         in which each element is val. If an ndarray is specified, the
         shape must match that of the original ParameterArray.
-        """
-        # Handle the case of a single (non-array) argument:
-        if not isinstance(val, np.ndarray):
-            val = np.full(self._data.shape, val)
-        if val.shape != self._data.shape:
-            raise ValueError("Shape of val does not match shape of this " \
-                                 " ParameterArray")
 
-        # Now write the values
-        it = np.nditer(self._data, flags=['multi_index','refs_ok'])
-        for x in it:
-            self._data[it.multi_index].val = val[it.multi_index]
+        Only the Parameters whose val actually changes get a new
+        version number and notify their observers. The observers are
+        notified as in a parameter_batch() block, so each distinct
+        observer is called once.
+        """
+        self._storage.set_val(self._indices, self._expand(val, "val"))
 
     def set_min(self, min):
         """
@@ -524,17 +1388,9 @@ class ParameterArray:
         in which each element is min. If an ndarray is specified, the
         shape must match that of the original ParameterArray.
         """
-        # Handle the case of a single (non-array) argument:
-        if not isinstance(min, np.ndarray):
-            min = np.full(self._data.shape, min)
-        if min.shape != self._data.shape:
-            raise ValueError("Shape of min does not match shape of this " \
-                                 " ParameterArray")
-
-        # Now write the values
-        it = np.nditer(self._data, flags=['multi_index','refs_ok'])
-        for x in it:
-            self._data[it.multi_index].min = min[it.multi_index]
+        min = self._expand(min, "min")
+        self._storage.verify_bounds(self._indices, min=min)
+        self._storage.writeable('min')[self._indices] = min
 
     def set_max(self, max):
         """
@@ -543,17 +1399,9 @@ class ParameterArray:
         in which each element is max. If an ndarray is specified, the
         shape must match that of the original ParameterArray.
         """
-        # Handle the case of a single (non-array) argument:
-        if not isinstance(max, np.ndarray):
-            max = np.full(self._data.shape, max)
-        if max.shape != self._data.shape:
-            raise ValueError("Shape of max does not match shape of this " \
-                                 " ParameterArray")
-
-        # Now write the values
-        it = np.nditer(self._data, flags=['multi_index','refs_ok'])
-        for x in it:
-            self._data[it.multi_index].max = max[it.multi_index]
+        max = self._expand(max, "max")
+        self._storage.verify_bounds(self._indices, max=max)
+        self._storage.writeable('max')[self._indices] = max
 
     def set_name(self, name):
         """
@@ -562,17 +1410,8 @@ class ParameterArray:
         in which each element is name. If an ndarray is specified, the
         shape must match that of the original ParameterArray.
         """
-        # Handle the case of a single (non-array) argument:
-        if not isinstance(name, np.ndarray):
-            name = np.full(self._data.shape, name)
-        if name.shape != self._data.shape:
-            raise ValueError("Shape of name does not match shape of this " \
-                                 " ParameterArray")
-
-        # Now write the values
-        it = np.nditer(self._data, flags=['multi_index','refs_ok'])
-        for x in it:
-            self._data[it.multi_index].name = name[it.multi_index]
+        self._storage.writeable('name')[self._indices] = \
+            self._expand(name, "name")
 
     def set_fixed(self, fixed):
         """
@@ -584,22 +1423,17 @@ class ParameterArray:
         errmsg = "fixed must be a bool, or a numpy.ndarray of bools" \
             " of the same shape as the ParameterArray."
         if isbool(fixed):
-            fixed = np.full(self._data.shape, fixed)
+            pass
         elif isinstance(fixed, np.ndarray):
             if fixed.shape != self._data.shape:
                 raise ValueError("Shape of fixed does not match shape of this " \
                                      " ParameterArray")
-            it = np.nditer(fixed, flags=['multi_index'])
-            for x in it:
-                if not isbool(fixed[it.multi_index]):
-                    raise ValueError(errmsg)
+            if fixed.dtype != bool:
+                raise ValueError(errmsg)
         else:
             raise ValueError(errmsg)
 
-        # Now write the values
-        it = np.nditer(self._data, flags=['multi_index','refs_ok'])
-        for x in it:
-            self._data[it.multi_index].fixed = fixed[it.multi_index]
+        self._storage.set_fixed(self._indices, fixed)
 
     def set_observers(self, observers):
         """
@@ -616,21 +1450,51 @@ class ParameterArray:
             if observers.shape != self._data.shape:
                 raise ValueError("Shape of observers does not match shape of" \
                                      " this ParameterArray")
+            for y in observers.flat:
+                if not isinstance(y, (set, frozenset)):
+                    raise ValueError(errmsg)
+            self._storage.set_observers(self._indices, \
+                                            [frozenset(y) for y in observers.flat])
+            return
         elif isinstance(observers, set):
             # Make sure every element of the set is callable:
             for x in observers:
                 if not callable(x):
                     raise ValueError(errmsg)
-            observers = np.full(self._data.shape, observers)
+            observers = frozenset(observers)
         elif callable(observers):
-            observers = np.full(self._data.shape, {observers})
+            observers = frozenset((observers,))
         else:
             raise ValueError(errmsg)
 
-        # Now write the values
-        it = np.nditer(self._data, flags=['multi_index','refs_ok'])
-        for x in it:
-            self._data[it.multi_index].observers = observers[it.multi_index]
+        # For the whole array, the set is stored once:
+        self._storage.set_observers(self._owner_indices(), observers)
+
+    def _owner_indices(self):
+        """
+        Return the storage indices of the elements, or None if this
+        array covers its whole storage.
+        """
+        return self._indices if self._base is not None else None
+
+    def add_observer(self, observer):
+        """
+        Add a callable to the observers of every Parameter in the
+        array. For an array that is not a view, this takes O(1) time
+        and memory, regardless of the size of the array.
+        """
+        if not callable(observer):
+            raise ValueError("observer must be callable")
+        self._storage.update_observers(self._owner_indices(), \
+                                           lambda s: s | {observer})
+
+    def remove_observer(self, observer):
+        """
+        Remove a callable from the observers of every Parameter in the
+        array, wherever it is present.
+        """
+        self._storage.update_observers(self._owner_indices(), \
+                                           lambda s: s - {observer})
 
     def get_val(self):
         """
@@ -638,13 +1502,7 @@ class ParameterArray:
         numpy.ndarray of the same shape as the original array of
         Parameters.
         """
-        # Create an array of the same type as val of the first element:
-        arr = np.full(self._data.shape, self._data.flat[0].val)
-        # Over-write with the actual vals:
-        with np.nditer(arr, flags=['multi_index'], op_flags=['writeonly']) as it:
-            for x in it:
-                x[...] = self._data[it.multi_index].val
-        return arr
+        return self._storage.val[self._indices]
 
     def get_variables(self):
         """
@@ -652,15 +1510,28 @@ class ParameterArray:
         'fixed' attribute is False. These are the variables that would
         be used for optimization.
         """
+        if self._base is None:
+            # The storage keeps track of its non-fixed elements, and its
+            # indices match the flattened data array:
+            return set(self._data.flat[self._storage.free_indices])
+        mask = np.logical_not(self._storage.fixed[self._indices])
+        return set(self._data[mask])
+
+    def to_group(self):
+        """
+        Return a ParameterGroup containing all the elements of the
+        array. The elements are known to be Parameters, so they are
+        not checked individually.
+        """
+        return ParameterGroup._trusted(self._data.flat)
 
-        vars = set()
-        it = np.nditer(self._data, flags=['multi_index','refs_ok'])
-        for x in it:
-            if not self._data[it.multi_index].fixed:
-                vars.add(self._data[it.multi_index])
-
-        return vars
-
-        # The next line fails with 
-        # AttributeError: 'numpy.ndarray' object has no attribute 'fixed'
-        #return {x for x in self._data if not x.fixed}
+    @property
+    def nfree(self):
+        """
+        Return the number of non-fixed elements. This is O(1) unless
+        the array is a view.
+        """
+        if self._base is None:
+            return self._storage.nfree
+        return int(np.count_nonzero( \
+                np.logical_not(self._storage.fixed[self._indices])))
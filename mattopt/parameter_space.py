@@ -0,0 +1,451 @@
+"""
+This module provides the ParameterSpace class, which gathers a
+collection of Parameters into one numbered state vector.
+"""
+
+from contextlib import contextmanager
+import numpy as np
+from .parameter import Parameter, parameter_batch, _fixed_tracker, \
+    _changed, _bounds_message
+
+class ParameterSnapshot:
+    """
+    This class holds the vals of all the Parameters in a
+    ParameterSpace at one moment, stored in a single numpy array. The
+    array has dtype float if all the vals are stored as floats, and
+    dtype object otherwise, so that vals such as True or 3 are
+    restored with their own type. It is created by
+    ParameterSpace.snapshot().
+    """
+
+    def __init__(self, space, compiled, state):
+        """
+        compiled is the list of groups of the space at the time of the
+        snapshot, and state is the vector of vals in order of index.
+        """
+        self._space = space
+        self._compiled = compiled
+        self._state = state
+
+    @property
+    def state(self):
+        """
+        Return the vector of vals of all the Parameters, in order of
+        their index in the space.
+        """
+        return self._state
+
+    def __len__(self):
+        return self._state.size
+
+    def restore(self):
+        """
+        Set the Parameters back to the vals held in this snapshot.
+        """
+        self._space.restore(self)
+
+class ParameterSpace:
+    """
+    A ParameterSpace assigns a stable integer index to each Parameter
+    in a collection, so the values of all the Parameters form one
+    numpy state vector. The methods get_x() and set_x() move the
+    values of the non-fixed Parameters in or out of such a vector.
+
+    Internally the Parameters are grouped by the storage that holds
+    their data (a ParameterArray, or a standalone Parameter), and each
+    group has a precomputed array of storage indices. Therefore
+    reading or writing the state costs one vectorized copy per group,
+    rather than a python loop over the Parameters. The indices of the
+    non-fixed Parameters are cached, and only recomputed after the
+    fixed attribute of some Parameter changes, so they are reused
+    across calls to get_x() and set_x().
+    """
+
+    def __init__(self, parameters=()):
+        """
+        parameters can be any iterable of Parameter objects. See add()
+        for the order in which they are numbered.
+        """
+        self._parameters = []
+        self._indices = {}
+        # For each storage, lists of positions in the state vector and
+        # of indices in the storage:
+        self._groups = {}
+        # The frozensets (such as ParameterGroups) already added, by id.
+        # They cannot change, so adding one again is skipped at once.
+        # Holding them keeps their ids from being reused.
+        self._added = {}
+        self.add(parameters)
+
+    def add(self, parameters):
+        """
+        Add Parameters to the space. Parameters that are already in
+        the space keep their index, and new Parameters get the next
+        indices. If parameters is a set, the new Parameters are
+        numbered in order of creation (and of position within a
+        ParameterArray), so the numbering is reproducible from one run
+        to the next. Otherwise the order of the iterable is used.
+        """
+        if isinstance(parameters, frozenset):
+            if id(parameters) in self._added:
+                return
+            self._added[id(parameters)] = parameters
+        if isinstance(parameters, (set, frozenset)):
+            # Only the new Parameters need to be sorted:
+            indices = self._indices
+            parameters = sorted([p for p in parameters if p not in indices], \
+                                    key=lambda p: (p._storage.serial, p._index))
+            if not parameters:
+                return
+        for p in parameters:
+            if not isinstance(p, Parameter):
+                raise ValueError("Each element of parameters must have " \
+                                     "type Parameter.")
+            if p in self._indices:
+                continue
+            index = len(self._parameters)
+            self._indices[p] = index
+            self._parameters.append(p)
+            if p._storage not in self._groups:
+                self._groups[p._storage] = ([], [])
+            positions, storage_indices = self._groups[p._storage]
+            positions.append(index)
+            storage_indices.append(p._index)
+        self._compile()
+
+    def _compile(self):
+        """
+        Convert the index lists of each group to numpy arrays, and
+        allocate the state vector.
+        """
+        self._compiled = [(storage, np.array(positions, dtype=np.int64), \
+                               np.array(storage_indices, dtype=np.int64)) \
+                              for storage, (positions, storage_indices) \
+                              in self._groups.items()]
+        # The storages of standalone Parameters hold one element each,
+        # so they are handled together by python loops over the
+        # storages, with one vectorized operation on the state for all
+        # of them, rather than with several numpy calls per storage:
+        self._arrays = [group for group in self._compiled \
+                            if not group[0].standalone]
+        self._standalone = _standalone_group([group for group \
+                                                  in self._compiled \
+                                                  if group[0].standalone])
+        self._state = np.zeros(len(self._parameters))
+        # Groups whose vals are not stored as floats, such as those of
+        # standalone Parameters, which can hold any type:
+        self._native = [group for group in self._compiled \
+                            if group[0].standalone \
+                            or group[0].val.dtype != np.float64]
+        self._free_epoch = None
+        # For changed_since(), a group with one Parameter is checked
+        # with an int index, which is much faster than numpy.max(). For
+        # a standalone Parameter, latest is its version number, and the
+        # index is None:
+        self._version_checks = [(storage, None if storage.standalone \
+                                     else int(storage_indices[0]) \
+                                     if storage_indices.size == 1 \
+                                     else storage_indices) \
+                                    for storage, positions, storage_indices \
+                                    in self._compiled]
+
+    @property
+    def parameters(self):
+        """
+        Return a list of all the Parameters, in order of their index.
+        """
+        return self._parameters
+
+    def __len__(self):
+        return len(self._parameters)
+
+    def __contains__(self, parameter):
+        return parameter in self._indices
+
+    def index(self, parameter):
+        """
+        Return the integer index of a Parameter in this space.
+        """
+        return self._indices[parameter]
+
+    @property
+    def version(self):
+        """
+        Return the largest version number of the Parameters in the
+        space. See changed_since().
+        """
+        version = 0
+        for storage, positions, storage_indices in self._compiled:
+            if storage.latest > version:
+                if storage.standalone:
+                    version = storage.latest
+                else:
+                    version = max(version, int(np.max( \
+                                storage.version[storage_indices])))
+        return version
+
+    def changed_since(self, version):
+        """
+        Return True if the val of any Parameter in the space has
+        changed since the given version number was obtained. Groups
+        whose storage has not changed at all are skipped in O(1)
+        time.
+        """
+        for storage, storage_indices in self._version_checks:
+            if storage.latest > version:
+                if storage_indices is None:
+                    return True
+                if type(storage_indices) is int:
+                    if storage.version[storage_indices] > version:
+                        return True
+                elif np.max(storage.version[storage_indices]) > version:
+                    return True
+        return False
+
+    def get_state(self):
+        """
+        Return a numpy vector with the val of every Parameter in the
+        space, in order of index.
+        """
+        state = self._state
+        for storage, positions, storage_indices in self._arrays:
+            state[positions] = storage.val[storage_indices]
+        storages, positions = self._standalone
+        if storages:
+            state[positions] = [storage.val for storage in storages]
+        return state.copy()
+
+    def snapshot(self):
+        """
+        Return a ParameterSnapshot holding the val of every Parameter
+        in the space, fixed or not.
+        """
+        state = self.get_state()
+        if self._native:
+            # get_state() converts every val to float, so the vals of
+            # the other types are copied again as they are:
+            state = state.astype(object)
+            for storage, positions, storage_indices in self._native:
+                if storage.standalone:
+                    state[positions[0]] = storage.val
+                    continue
+                for position, index in zip(positions.tolist(), \
+                                               storage_indices.tolist()):
+                    state[position] = storage.val[index]
+        return ParameterSnapshot(self, self._compiled, state)
+
+    def restore(self, snapshot):
+        """
+        Set the val of every Parameter back to the value held in a
+        ParameterSnapshot. Only the Parameters whose val differs from
+        the snapshot are written, and each observer is called at most
+        once. Parameters added to the space after the snapshot was
+        taken are not changed.
+        """
+        if snapshot._space is not self:
+            raise ValueError("The snapshot was taken from a different " \
+                                 "ParameterSpace.")
+        state = snapshot._state
+        # Find the elements to write, and check all the bounds, before
+        # anything is written:
+        writes = []
+        for storage, positions, storage_indices in snapshot._compiled:
+            val = state[positions]
+            if storage.standalone:
+                old = np.array([storage.val], dtype=object)
+            else:
+                old = storage.val[storage_indices]
+            changed = _changed(old, val)
+            if np.any(changed):
+                writes.append((storage, storage_indices[changed], \
+                                   val[changed]))
+        self._verify_bounds(writes)
+        with parameter_batch():
+            for storage, storage_indices, val in writes:
+                storage.set_val(storage_indices, val, checked=True)
+
+    @staticmethod
+    def _verify_bounds(writes):
+        """
+        Check the bounds for a list of (storage, storage indices, new
+        vals) tuples, raising one ValueError that lists the offending
+        Parameters of all the groups.
+        """
+        violations = []
+        for storage, storage_indices, val in writes:
+            violations += storage.bounds_violations(storage_indices, val=val)
+        if violations:
+            raise ValueError(_bounds_message(violations))
+
+    @contextmanager
+    def rollback_on_error(self):
+        """
+        Return a context manager that takes a snapshot on entry, and
+        restores it if the block raises an exception. The exception is
+        then re-raised. The snapshot is available with the "as" keyword:
+
+        with space.rollback_on_error() as snapshot:
+            space.set_x(x)
+            ...
+        """
+        snapshot = self.snapshot()
+        try:
+            yield snapshot
+        except:
+            self.restore(snapshot)
+            raise
+
+    def _free(self):
+        """
+        Return a tuple of three items. The first is a list with, for
+        each ParameterArray storage that has non-fixed Parameters, the
+        storage, the positions of those Parameters in the space, and
+        their indices in the storage. The second is a tuple of the list
+        of storages of the non-fixed standalone Parameters and the
+        array of their positions. The third is a sorted array with the
+        positions of all the non-fixed Parameters. The result is cached
+        until the fixed attribute of any Parameter changes.
+        """
+        if self._free_epoch == _fixed_tracker.epoch:
+            return self._free_cache
+
+        free = []
+        all_positions = [np.zeros(0, dtype=np.int64)]
+        for storage, positions, storage_indices in self._arrays:
+            # Skip groups whose Parameters are all fixed without
+            # looking at them individually:
+            if storage.nfree == 0:
+                continue
+            mask = np.logical_not(storage.fixed[storage_indices])
+            free.append((storage, positions[mask], storage_indices[mask]))
+            all_positions.append(positions[mask])
+        storages, positions = self._standalone
+        mask = np.array([storage.nfree > 0 for storage in storages], \
+                            dtype=bool)
+        standalone = ([storage for storage, free_storage \
+                           in zip(storages, mask) if free_storage], \
+                          positions[mask])
+        all_positions.append(standalone[1])
+        self._free_cache = (free, standalone, \
+                                np.sort(np.concatenate(all_positions)))
+        self._free_epoch = _fixed_tracker.epoch
+        return self._free_cache
+
+    @property
+    def free_parameters(self):
+        """
+        Return a list of the non-fixed Parameters, in the order used by
+        get_x() and set_x().
+        """
+        free, standalone, positions = self._free()
+        return [self._parameters[j] for j in positions]
+
+    @property
+    def nfree(self):
+        """
+        Return the number of non-fixed Parameters.
+        """
+        free, standalone, positions = self._free()
+        return positions.size
+
+    def get_bounds(self):
+        """
+        Return a tuple of two numpy vectors, with the min and max of
+        each non-fixed Parameter, in the same order as get_x().
+        """
+        free, (storages, standalone_positions), positions = self._free()
+        lower = np.full(len(self._parameters), np.NINF)
+        upper = np.full(len(self._parameters), np.Inf)
+        for storage, free_positions, storage_indices in free:
+            lower[free_positions] = storage.min[storage_indices]
+            upper[free_positions] = storage.max[storage_indices]
+        if storages:
+            lower[standalone_positions] = [storage.min \
+                                               for storage in storages]
+            upper[standalone_positions] = [storage.max \
+                                               for storage in storages]
+        return lower[positions], upper[positions]
+
+    def get_x(self):
+        """
+        Return a numpy vector with the val of each non-fixed Parameter,
+        in order of index.
+        """
+        free, (storages, standalone_positions), positions = self._free()
+        state = self._state
+        for storage, free_positions, storage_indices in free:
+            state[free_positions] = storage.val[storage_indices]
+        if storages:
+            state[standalone_positions] = [storage.val \
+                                               for storage in storages]
+        return state[positions]
+
+    def set_x(self, x):
+        """
+        Set the val of each non-fixed Parameter from the vector x, in
+        the same order as get_x(). The observers of the Parameters are
+        notified as in a parameter_batch() block.
+        """
+        free, (storages, standalone_positions), positions = self._free()
+        x = np.asarray(x)
+        if x.shape != positions.shape:
+            raise ValueError("Length of x (" + str(x.size) + ") does not " \
+                                 "match the number of non-fixed Parameters (" \
+                                 + str(positions.size) + ")")
+        # Scatter x into the state vector, then write each group with
+        # one vectorized operation. All the bounds are checked before
+        # anything is written.
+        state = self._state
+        state[positions] = x
+        writes = [(storage, storage_indices, state[free_positions]) \
+                      for storage, free_positions, storage_indices in free]
+        violations = []
+        for storage, storage_indices, val in writes:
+            violations += storage.bounds_violations(storage_indices, val=val)
+        if storages:
+            standalone_val = state[standalone_positions]
+            violations += _standalone_violations(storages, standalone_val)
+        if violations:
+            raise ValueError(_bounds_message(violations))
+        with parameter_batch():
+            for storage, storage_indices, val in writes:
+                storage.set_val(storage_indices, val, checked=True)
+            if storages:
+                _set_standalone(storages, standalone_val)
+
+def _standalone_group(groups):
+    """
+    Return a tuple of the list of storages and the array of positions
+    of a list of groups of standalone Parameters.
+    """
+    return ([storage for storage, positions, storage_indices in groups], \
+                np.array([positions[0] for storage, positions, \
+                              storage_indices in groups], dtype=np.int64))
+
+def _standalone_violations(storages, val):
+    """
+    Return the list of messages describing the bounds violations if
+    the storages of standalone Parameters get the vals in the vector
+    val. The bounds of all the storages are checked at once.
+    """
+    lower = np.array([storage.min for storage in storages], dtype=float)
+    upper = np.array([storage.max for storage in storages], dtype=float)
+    bad = (val < lower) | (val > upper) | (lower > upper)
+    violations = []
+    index = np.zeros(1, dtype=np.int64)
+    for j in np.flatnonzero(bad):
+        violations += storages[j].bounds_violations(index, val=val[j:j + 1])
+    return violations
+
+def _set_standalone(storages, val):
+    """
+    Write the vector val into the storages of standalone Parameters,
+    whose bounds have already been checked. Only the storages whose
+    val changes get a new version number and notify their observers.
+    """
+    old = np.array([storage.val for storage in storages], dtype=object)
+    for j in np.flatnonzero(_changed(old, val)).tolist():
+        storage = storages[j]
+        storage.val = val[j]
+        storage.touch(0)
+        storage.notify(0)
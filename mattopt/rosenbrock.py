@@ -22,7 +22,10 @@ class Rosenbrock:
         self.x2 = Parameter(0.0, self.reset, name="x2" + owner)
         params = {self.x1, self.x2}
         self.need_to_run_code = True
-        self.target1 = Target(params, self.evaluate_target1)
+        # Only the first term has an analytic gradient, so the second
+        # term is differentiated numerically:
+        self.target1 = Target(params, self.evaluate_target1, \
+                                  gradient=self.gradient_target1)
         self.target2 = Target(params, self.evaluate_target2)
 
     def reset(self):
@@ -43,6 +46,12 @@ class Rosenbrock:
         """
         return self.a - self.x1.val
 
+    def gradient_target1(self):
+        """
+        Derivatives of the first term.
+        """
+        return {self.x1: -1.0}
+
     def evaluate_target2(self):
         """
         Second term in the 2D Rosenbrock function.
@@ -4,10 +4,12 @@ surfaces.  There is a base class Surface, and several child classes
 corresponding to different discrete representations.
 """
 
+import functools
 import numpy as np
-from .parameter import Parameter, ParameterArray
+from .parameter import Parameter, ParameterArray, ParameterGroup, \
+    parameter_batch
 from .shape import Shape
-from .target import Target
+from .computation import Computation
 import logging
 
 class Surface(Shape):
@@ -56,10 +58,10 @@ class SurfaceRZFourier(Surface):
             raise RuntimeError("mpol must be at least 1")
         if ntor < 0:
             raise RuntimeError("ntor must be at least 0")
-        self.mpol = Parameter(mpol, min=1, name="mpol for SurfaceRZFourier " \
-                                  + str(hex(id(self))))
-        self.ntor = Parameter(ntor, min=0, name="ntor for SurfaceRZFourier " \
-                                  + str(hex(id(self))))
+        self.mpol = Parameter(mpol, min=1, \
+            name=functools.partial(self._parameter_name, "mpol"))
+        self.ntor = Parameter(ntor, min=0, \
+            name=functools.partial(self._parameter_name, "ntor"))
         Surface.__init__(self, nfp=nfp, stelsym=stelsym)
         self.allocate()
 
@@ -73,23 +75,22 @@ class SurfaceRZFourier(Surface):
         self.ntheta = 63
         self.nphi = 62
 
-    def _generate_names(self, prefix):
+    def _parameter_name(self, var):
         """
-        Generate the names for the Parameter objects.
+        Return the name of the Parameter var of this surface. The
+        Parameters call this method lazily, only when their name is
+        requested.
         """
-        assert(type(prefix) is str)
-        self.mdim = self.mpol.val + 1
-        self.ndim = 2 * self.ntor.val + 1
-        objstr = " for SurfaceRZFourier " + str(hex(id(self)))
-        names = []
-        for m in range(self.mdim):
-            namess = []
-            for jn in range(self.ndim):
-                newstr = prefix + "(m={: 04d},n={: 04d})".format(\
-                    m,jn - self.ntor.val) + objstr
-                namess.append(newstr)
-            names.append(namess)
-        return np.array(names)
+        return var + " for SurfaceRZFourier " + str(hex(id(self)))
+
+    def _coefficient_name(self, prefix, m, jn):
+        """
+        Return the name of the Fourier coefficient with indices (m, jn)
+        in the ParameterArray prefix. The ParameterArrays call this
+        method lazily, only when the name of an element is requested.
+        """
+        return self._parameter_name(prefix + "(m={: 04d},n={: 04d})".format( \
+                m, jn - self.ntor.val))
 
     def allocate(self):
         """
@@ -101,28 +102,34 @@ class SurfaceRZFourier(Surface):
         self.ndim = 2 * self.ntor.val + 1
         myshape = (self.mdim, self.ndim)
 
+        # The names of the coefficients are generated lazily:
         self.rc = ParameterArray(np.zeros(myshape), \
-                                     name=self._generate_names("rc"))
+            name=functools.partial(self._coefficient_name, "rc"))
         self.zs = ParameterArray(np.zeros(myshape), \
-                                     name=self._generate_names("zs"))
+            name=functools.partial(self._coefficient_name, "zs"))
 
         if not self.stelsym.val:
             self.rs = ParameterArray(np.zeros(myshape), \
-                                         name=self._generate_names("rs"))
+                name=functools.partial(self._coefficient_name, "rs"))
             self.zc = ParameterArray(np.zeros(myshape), \
-                                         name=self._generate_names("zc"))
+                name=functools.partial(self._coefficient_name, "zc"))
 
-        # Create a set of all the surface Parameters, which will be
-        # used for Targets that depend on this surface.
-        params = {self.nfp, self.stelsym, self.mpol, self.ntor}
-        params = params.union(set(self.rc.data.flat))
-        params = params.union(set(self.zs.data.flat))
+        # Create groups of the Fourier coefficients, and of all the
+        # surface Parameters, which will be shared by the Targets
+        # that depend on this surface.
+        self.coefficients = self.rc.to_group() | self.zs.to_group()
         if not self.stelsym.val:
-            params = params.union(set(self.rs.data.flat))
-            params = params.union(set(self.zc.data.flat))
-
-        self.area = Target(params, self.compute_area)
-        self.volume = Target(params, self.compute_volume)
+            self.coefficients = self.coefficients | self.rs.to_group() \
+                | self.zc.to_group()
+        params = ParameterGroup((self.nfp, self.stelsym, self.mpol, \
+                                     self.ntor)) | self.coefficients
+        self.parameters = params
+
+        # The area and volume are computed together, once for each
+        # state of the Parameters:
+        self._area_volume = Computation(params, self.area_volume)
+        self.area = self._area_volume.target(0)
+        self.volume = self._area_volume.target(1)
 
     def __repr__(self):
         return "SurfaceRZFourier " + str(hex(id(self))) + " (nfp=" + \
@@ -177,6 +184,32 @@ class SurfaceRZFourier(Surface):
         self._validate_mn(m, n)
         return self.zs.data[m, n + self.ntor.val]
 
+    @property
+    def ntheta(self):
+        """
+        Number of grid points in theta used to compute the area and
+        volume.
+        """
+        return self._ntheta
+
+    @ntheta.setter
+    def ntheta(self, ntheta):
+        self._ntheta = ntheta
+        self._area_volume.invalidate()
+
+    @property
+    def nphi(self):
+        """
+        Number of grid points in phi used to compute the area and
+        volume.
+        """
+        return self._nphi
+
+    @nphi.setter
+    def nphi(self, nphi):
+        self._nphi = nphi
+        self._area_volume.invalidate()
+
     def area_volume(self):
         """
         Compute the surface area and the volume enclosed by the surface.
@@ -204,6 +237,12 @@ class SurfaceRZFourier(Surface):
         sinphi = np.sin(phi)
         cosphi = np.cos(phi)
         nfp = self.nfp.val
+        # Extract all the Fourier amplitudes at once:
+        rc = self.rc.get_val()
+        zs = self.zs.get_val()
+        if not self.stelsym.val:
+            rs = self.rs.get_val()
+            zc = self.zc.get_val()
         for m in range(mdim):
             for jn in range(ndim):
                 # Presently this loop includes negative n when m=0.
@@ -213,8 +252,8 @@ class SurfaceRZFourier(Surface):
                 angle = m * theta - n * phi
                 sinangle = np.sin(angle)
                 cosangle = np.cos(angle)
-                rmnc = self.get_rc(m, n_without_nfp).val
-                zmns = self.get_zs(m, n_without_nfp).val
+                rmnc = rc[m, jn]
+                zmns = zs[m, jn]
                 r += rmnc * cosangle
                 x += rmnc * cosangle * cosphi
                 y += rmnc * cosangle * sinphi
@@ -230,8 +269,8 @@ class SurfaceRZFourier(Surface):
                                       + cosangle * cosphi)
                 dzdphi += zmns * (-n * cosangle)
                 if not self.stelsym.val:
-                    rmns = self.get_rs(m, n_without_nfp).val
-                    zmnc = self.get_zc(m, n_without_nfp).val
+                    rmns = rs[m, jn]
+                    zmnc = zc[m, jn]
                     r += rmns * sinangle
                     x += rmns * sinangle * cosphi
                     y += rmns * sinangle * sinphi
@@ -260,17 +299,17 @@ class SurfaceRZFourier(Surface):
 
     def compute_area(self):
         """
-        Return the area of the surface.
+        Return the area of the surface. The area and volume are
+        computed together, and reused until the surface changes.
         """
-        area, volume = self.area_volume()
-        return area
+        return self._area_volume.get(0)
 
     def compute_volume(self):
         """
-        Return the volume of the surface.
+        Return the volume of the surface. The area and volume are
+        computed together, and reused until the surface changes.
         """
-        area, volume = self.area_volume()
-        return volume
+        return self._area_volume.get(1)
 
     @classmethod
     def from_focus(cls, filename):
@@ -309,11 +348,21 @@ class SurfaceRZFourier(Surface):
         ntor = int(np.max(np.abs(n)))
 
         surf = cls(nfp=nfp, stelsym=stelsym, mpol=mpol, ntor=ntor)
-        for j in range(Nfou):
-            surf.rc.data[m[j], n[j] + ntor].val = rc[j]
-            surf.zs.data[m[j], n[j] + ntor].val = zs[j]
+        # Assemble the full arrays of amplitudes, then write each
+        # ParameterArray at once:
+        rc_arr = surf.rc.get_val()
+        zs_arr = surf.zs.get_val()
+        rc_arr[m, n + ntor] = rc
+        zs_arr[m, n + ntor] = zs
+        with parameter_batch():
+            surf.rc.set_val(rc_arr)
+            surf.zs.set_val(zs_arr)
             if not stelsym:
-                surf.rs.data[m[j], n[j] + ntor].val = rs[j]
-                surf.zc.data[m[j], n[j] + ntor].val = zc[j]
+                rs_arr = surf.rs.get_val()
+                zc_arr = surf.zc.get_val()
+                rs_arr[m, n + ntor] = rs
+                zc_arr[m, n + ntor] = zc
+                surf.rs.set_val(rs_arr)
+                surf.zc.set_val(zc_arr)
 
         return surf
@@ -3,33 +3,192 @@ This module provides the Target class for quantities that can be
 targeted in optimization.
 """
 
-from .parameter import Parameter
+from collections import OrderedDict
+import concurrent.futures
+from contextlib import contextmanager
+import functools
+import time
+from .parameter import Parameter, ParameterGroup
+from .parameter_space import ParameterSpace
+
+class _EvaluationPass:
+    """
+    This class records the values of the nodes already computed during
+    a TargetGraph.evaluate() call. While a pass is active, a Target
+    that has already been computed in the pass returns the recorded
+    value instead of calling its function again, e.g. when a
+    downstream Target evaluates it.
+    """
+    def __init__(self):
+        self.values = None
+
+_evaluation_pass = _EvaluationPass()
+
+class _Profiler:
+    """
+    This class holds the switch that turns on the collection of
+    EvaluationStats. When it is off, evaluate() only pays for checking
+    the switch.
+    """
+    def __init__(self):
+        self.enabled = False
+
+_profiler = _Profiler()
+
+def enable_target_profiling(enabled=True):
+    """
+    Turn on (or off) the collection of statistics in the stats
+    attribute of every Target and Computation.
+    """
+    _profiler.enabled = bool(enabled)
+
+@contextmanager
+def target_profiling():
+    """
+    Return a context manager in which statistics are collected for
+    every Target and Computation, as with enable_target_profiling().
+    """
+    enabled = _profiler.enabled
+    _profiler.enabled = True
+    try:
+        yield
+    finally:
+        _profiler.enabled = enabled
+
+class EvaluationStats:
+    """
+    This class holds statistics about the evaluations of a Target or
+    Computation, which are collected while profiling is enabled.
+    calls is the number of calls to evaluate(), and evaluations is the
+    number of those which called the underlying function, as opposed
+    to reusing a stored result. total_time and max_time are the total
+    and longest wall-clock time of the calls to evaluate() in seconds,
+    including the time spent in other Targets or Computations that
+    were evaluated as part of it. cache_hits and cache_misses count
+    the lookups in the cache of a Target with cache_size > 0.
+    """
+    __slots__ = ('calls', 'evaluations', 'total_time', 'max_time', \
+                     'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Set all the statistics to zero.
+        """
+        self.calls = 0
+        self.evaluations = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def record(self, elapsed):
+        """
+        Record one call to evaluate() that took elapsed seconds.
+        """
+        self.calls += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+
+    def __repr__(self):
+        return "EvaluationStats(calls=" + str(self.calls) + ", evaluations=" \
+            + str(self.evaluations) + ", total_time=" \
+            + str(self.total_time) + ", max_time=" + str(self.max_time) \
+            + ", cache_hits=" + str(self.cache_hits) + ", cache_misses=" \
+            + str(self.cache_misses) + ")"
+
+def _function_label(function):
+    """
+    Return a short description of a function, used as the default
+    name of a Target or Computation.
+    """
+    if isinstance(function, functools.partial):
+        return _function_label(function.func) + str(function.args)
+    return getattr(function, "__qualname__", repr(function))
 
 class Target:
     """
-    Target is an abstract base class for any scalar quantity that can
-    be part of an objective function for optimization.
+    Target is an abstract base class for any quantity that can be part
+    of an objective function for optimization. The quantity is usually
+    a scalar, but can also be a numpy array, such as a quantity
+    evaluated at every point of a grid.
+
+    Optionally, a Target can remember the results of its most recent
+    evaluations. If cache_size is positive, evaluate() looks up the
+    vals of the parameters in a least-recently-used cache of that
+    many entries before calling the function, and if no parameter
+    has changed since the last evaluation the last result is returned
+    without even reading the vals. This is only correct if the
+    function depends on nothing but the vals of the parameters.
+
+    Results can also be kept across runs in an EvaluationCache, given
+    as disk_cache. The results are stored under the name of the
+    Target, so each Target sharing a disk_cache must have a distinct
+    name that is the same from one run to the next.
+
+    If the function uses the results of other Targets or Computations,
+    these should be listed in dependencies. This information is used
+    by TargetGraph.
+
+    Optionally, a Target can have a gradient function, which returns
+    the derivatives of the value with respect to the Parameters. This
+    allows LeastSquaresProblem to form the Jacobian analytically
+    instead of by finite differences.
+
+    While profiling is enabled, with enable_target_profiling() or
+    target_profiling(), statistics about the evaluations are collected
+    in the stats attribute.
     """
 
-    def __init__(self, parameters, function):
+    def __init__(self, parameters, function, cache_size=0, dependencies=(), \
+                     name=None, disk_cache=None, gradient=None):
         """
         When constructing a Target, you should supply a python set in
         which the elements are the Parameter objects upon which this
-        Target depends.
+        Target depends, or a ParameterGroup. A ParameterGroup has
+        already been checked, so constructing the Target takes O(1)
+        time regardless of the number of Parameters.
+
+        function must be callable with no arguments. cache_size is the
+        number of results to remember, or 0 to disable caching.
+        dependencies is an iterable of the Targets and Computations
+        whose results are used by function. name is used in profiling
+        reports; by default it is derived from the function.
+        disk_cache can be None or an EvaluationCache.
 
-        reset_function can be None or something callable.
+        gradient can be None, or a function with no arguments that
+        returns a dict. Each key of the dict is a Parameter, and the
+        value is the derivative of the Target with respect to it: a
+        float for a scalar Target, or an array of the same shape as
+        the value of a vector-valued Target. Parameters that are not
+        in the dict have a derivative of 0.
         """
-        if type(parameters) is not set:
+        if isinstance(parameters, ParameterGroup):
+            pass
+        elif type(parameters) is not set:
             raise ValueError("Argument to Target.__init__ must have type 'set'")
-        for param in parameters:
-            if type(param) is not Parameter:
-                raise ValueError("In parameters argument to Target.__init__, " \
-                                     "each element must have type Parameter.")
+        else:
+            for param in parameters:
+                if type(param) is not Parameter:
+                    raise ValueError("In parameters argument to " \
+                                         "Target.__init__, each element " \
+                                         "must have type Parameter.")
         if not callable(function):
             raise ValueError("function must be callable.")
+        if gradient is not None and not callable(gradient):
+            raise ValueError("gradient must be callable or None.")
         self._function = function
+        self._gradient = gradient
 
         self._parameters = parameters
+        self._dependencies = _as_dependencies(dependencies)
+        self._name = name
+        self._stats = None
+        self.disk_cache = disk_cache
+        self.cache_size = cache_size
 
     def __repr__(self):
         return "Target(parameters=" + self._parameters.__repr__() + \
@@ -38,19 +197,210 @@ class Target:
     @property
     def parameters(self):
         """
-        Return a python set containing all the Parameter objects from
-        which the value of this Target can be calculated. There should
-        be no arguments.
+        Return a python set (or the ParameterGroup supplied to the
+        constructor) containing all the Parameter objects from which
+        the value of this Target can be calculated. There should be no
+        arguments.
         """
         return self._parameters
 
+    @property
+    def dependencies(self):
+        """
+        Return a tuple of the Targets and Computations whose results
+        are used by this Target.
+        """
+        return self._dependencies
+
+    @property
+    def name(self):
+        """
+        Return the name of this Target, as used in profiling reports.
+        """
+        if self._name is None:
+            return _function_label(self._function)
+        return self._name
+
+    @property
+    def has_gradient(self):
+        """
+        Return True if this Target has a gradient function.
+        """
+        return self._gradient is not None
+
+    def evaluate_gradient(self):
+        """
+        Return a dict mapping Parameters to the derivatives of the
+        value of this Target with respect to them. Parameters that are
+        not in the dict have a derivative of 0.
+        """
+        if self._gradient is None:
+            raise ValueError("Target " + self.name + " has no gradient " \
+                                 "function.")
+        gradient = self._gradient()
+        if not isinstance(gradient, dict):
+            raise ValueError("The gradient function of Target " + self.name \
+                                 + " must return a dict.")
+        return gradient
+
+    @property
+    def stats(self):
+        """
+        Return the EvaluationStats of this Target.
+        """
+        if self._stats is None:
+            self._stats = EvaluationStats()
+        return self._stats
+
+    @property
+    def cache_size(self):
+        """
+        Return the number of results remembered by evaluate().
+        """
+        return self._cache_size
+
+    @cache_size.setter
+    def cache_size(self, cache_size):
+        if not isinstance(cache_size, int) or cache_size < 0:
+            raise ValueError("cache_size must be a non-negative int")
+        self._cache_size = cache_size
+        self.clear_cache()
+
+    def clear_cache(self):
+        """
+        Forget all remembered results.
+        """
+        self._cache = OrderedDict()
+        self._space = None
+        self._last_version = None
+        self._last_value = None
+
     def evaluate(self):
         """
         Return a float, the scalar value that can be part of an
-        objective function. Doing this generally requires running a
-        physics code. There should be no arguments.
+        objective function, or a numpy array for a vector-valued
+        Target. Doing this generally requires running a physics
+        code. There should be no arguments.
+        """
+        # Within a TargetGraph pass, reuse the value if this Target
+        # has already been computed:
+        values = _evaluation_pass.values
+        if values is not None and self in values:
+            return values[self]
+
+        if not _profiler.enabled:
+            return self._evaluate(None)
+        stats = self.stats
+        start = time.perf_counter()
+        try:
+            return self._evaluate(stats)
+        finally:
+            stats.record(time.perf_counter() - start)
+
+    def evaluate_async(self, executor=None):
+        """
+        Start the evaluation and return a concurrent.futures.Future for
+        the value. executor can be any object with a submit() method
+        like the executors of concurrent.futures, e.g. a
+        ThreadPoolExecutor. If executor is None, the Target is
+        evaluated immediately and the returned Future is already done.
+        Exceptions raised by the function are re-raised by the
+        result() method of the Future. To await the value in asyncio
+        code, wrap the Future with asyncio.wrap_future().
+
+        With a ProcessPoolExecutor, the Target is pickled and
+        evaluated in another process, so its cache and any side
+        effects of the function are not kept in this process.
         """
-        return self._function()
+        if executor is not None:
+            return executor.submit(self.evaluate)
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(self.evaluate())
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+    def _evaluate(self, stats):
+        """
+        Compute the value, or find it in the cache. If stats is not
+        None, the evaluations and cache lookups are counted in it.
+        """
+        if self._cache_size == 0 and self.disk_cache is None:
+            if stats is not None:
+                stats.evaluations += 1
+            return self._function()
+
+        # The set of parameters may have been modified in place:
+        space = self._space
+        if space is None or len(space) != len(self._parameters):
+            self.clear_cache()
+            space = ParameterSpace(self._parameters)
+            self._space = space
+        elif self._last_version is not None \
+                and not space.changed_since(self._last_version):
+            if stats is not None:
+                stats.cache_hits += 1
+            return self._last_value
+
+        version = space.version
+        state = space.get_state()
+        key = state.tobytes()
+        cache = self._cache
+        if key in cache:
+            cache.move_to_end(key)
+            value = cache[key]
+            if stats is not None:
+                stats.cache_hits += 1
+        else:
+            value = self._lookup_or_compute(state, stats)
+            if self._cache_size > 0:
+                cache[key] = value
+                if len(cache) > self._cache_size:
+                    cache.popitem(last=False)
+        self._last_version = version
+        self._last_value = value
+        return value
+
+    def _lookup_or_compute(self, state, stats):
+        """
+        Return the result for the vector of parameter vals state from
+        the disk cache if possible, or otherwise call the function
+        (and store the result in the disk cache).
+        """
+        disk_cache = self.disk_cache
+        if disk_cache is not None:
+            value = disk_cache.get(self.name, state, _missing)
+            if value is not _missing:
+                if stats is not None:
+                    stats.cache_hits += 1
+                return value
+        if stats is not None:
+            stats.cache_misses += 1
+            stats.evaluations += 1
+        value = self._function()
+        if disk_cache is not None:
+            disk_cache.put(self.name, state, value)
+        return value
+
+# Marker for results that are not in a cache:
+_missing = object()
+
+def _as_dependencies(dependencies):
+    """
+    Validate the dependencies of a Target or Computation, and return
+    them as a tuple.
+    """
+    try:
+        dependencies = tuple(dependencies)
+    except TypeError:
+        raise ValueError("dependencies must be an iterable of Targets " \
+                             "and Computations.")
+    for node in dependencies:
+        if not callable(getattr(node, "evaluate", None)):
+            raise ValueError("Each dependency must be a Target or a " \
+                                 "Computation.")
+    return dependencies
 
 class Identity:
     """
@@ -65,7 +415,7 @@ class Identity:
         publically accessible through the @property decorator.
         """
         self._x = Parameter(name="x for Identity " + str(hex(id(self))))
-        self._target = Target({self._x}, self.eval)
+        self._target = Target({self._x}, self.eval, gradient=self.gradient)
 
     @property
     def x(self):
@@ -86,3 +436,9 @@ class Identity:
         Just return the value of the sole Parameter.
         """
         return self._x.val
+
+    def gradient(self):
+        """
+        The derivative of the target with respect to x is 1.
+        """
+        return {self._x: 1.0}
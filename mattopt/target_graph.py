@@ -0,0 +1,297 @@
+"""
+This module provides the TargetGraph class, which organizes Targets
+and Computations into a dependency graph.
+"""
+
+import concurrent.futures
+from .parameter import _next_version
+from .parameter_space import ParameterSpace
+from .target import Target, _evaluation_pass
+from .computation import Computation
+
+class TargetGraph:
+    """
+    A TargetGraph is the directed acyclic graph formed by some Targets
+    and Computations (the nodes) together with everything they depend
+    on, following the dependencies attribute of each node. For
+    instance the out_target of a LeastSquaresTerm depends on its
+    in_target, and the Targets returned by Computation.target() depend
+    on the Computation.
+
+    evaluate() brings the values of all the nodes up to date, in
+    topological order, recomputing only the nodes that are stale: those
+    for which the val of one of their parameters has changed since
+    their last computation, and those downstream of a node that was
+    recomputed. This assumes each node is a function of its parameters
+    and dependencies only. If not, call invalidate() when something
+    else changes.
+
+    The structure of the graph is exposed through nodes (in
+    topological order), levels, dependencies(), and dependents(). The
+    nodes in one level do not depend on each other, so they can be
+    computed concurrently by passing an executor to evaluate().
+    """
+
+    def __init__(self, nodes):
+        """
+        nodes is an iterable of Targets and Computations. Their
+        dependencies, and the dependencies of those, and so on, are
+        added to the graph automatically.
+        """
+        self._order = []
+        self._dependents = {}
+        self._levels = {}
+        # Depth-first search, adding each node after everything it
+        # depends on, so _order is a topological order. Cycles are
+        # detected with the set of nodes on the current path.
+        on_path = set()
+        def visit(node):
+            if node in self._levels:
+                return
+            if node in on_path:
+                raise ValueError("The dependencies of the Targets and " \
+                                     "Computations contain a cycle.")
+            on_path.add(node)
+            level = 0
+            for dependency in node.dependencies:
+                visit(dependency)
+                level = max(level, self._levels[dependency] + 1)
+            on_path.remove(node)
+            self._levels[node] = level
+            self._dependents[node] = []
+            for dependency in node.dependencies:
+                self._dependents[dependency].append(node)
+            self._order.append(node)
+        for node in nodes:
+            visit(node)
+
+        # Everything evaluate() needs is stored per node. Nodes often
+        # share one parameters object, e.g. the Targets of a
+        # Computation, so they share one ParameterSpace:
+        shared = {}
+        self._spaces = {}
+        for node in self._order:
+            key = id(node.parameters)
+            if key not in shared:
+                shared[key] = ParameterSpace(node.parameters)
+            self._spaces[node] = shared[key]
+        self._versions = {}
+        self._values = {}
+        self._levels_cache = None
+
+    @property
+    def nodes(self):
+        """
+        Return a list of all the nodes, in topological order: each node
+        comes after all the nodes it depends on.
+        """
+        return self._order
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, node):
+        return node in self._levels
+
+    @property
+    def levels(self):
+        """
+        Return a list of lists of nodes. Level 0 contains the nodes with
+        no dependencies, and each node in level j > 0 depends on at
+        least one node in level j - 1. The nodes within a level do not
+        depend on each other.
+        """
+        levels = [[] for j in range(max(self._levels.values(), default=-1) \
+                                        + 1)]
+        for node in self._order:
+            levels[self._levels[node]].append(node)
+        return levels
+
+    def dependencies(self, node):
+        """
+        Return a tuple of the nodes that node depends on directly.
+        """
+        return node.dependencies
+
+    def dependents(self, node):
+        """
+        Return a list of the nodes that depend directly on node.
+        """
+        return self._dependents[node]
+
+    def invalidate(self, node=None):
+        """
+        Mark node as stale, so it and everything downstream of it are
+        recomputed at the next evaluate(). If node is None, all the
+        nodes are marked as stale.
+        """
+        if node is None:
+            self._versions = {}
+            self._values = {}
+            nodes = self._order
+        else:
+            self._versions.pop(node, None)
+            nodes = [node]
+        # Also discard the results remembered by the nodes themselves:
+        for node in nodes:
+            if isinstance(node, Computation):
+                node.invalidate()
+            elif isinstance(node, Target):
+                node.clear_cache()
+
+    def stale(self):
+        """
+        Return a list, in topological order, of the nodes whose
+        parameters have changed since their last computation. Nodes
+        that are only stale because something upstream is stale are
+        not included.
+        """
+        stale = []
+        for node in self._order:
+            space = self._space(node)
+            version = self._versions.get(node)
+            if version is None or space.changed_since(version):
+                stale.append(node)
+        return stale
+
+    def _space(self, node):
+        """
+        Return the ParameterSpace of a node, rebuilding it if the set
+        of parameters has been modified in place.
+        """
+        space = self._spaces[node]
+        if len(space) != len(node.parameters):
+            space = ParameterSpace(node.parameters)
+            self._spaces[node] = space
+            self._versions.pop(node, None)
+        return space
+
+    def evaluate(self, executor=None):
+        """
+        Recompute the stale nodes level by level, and return a dict
+        mapping every node to its value.
+
+        If executor is not None, it must have a submit() method like
+        the executors of concurrent.futures, and the stale nodes of
+        each level are computed concurrently. Nodes that share a
+        Parameter may rely on the same underlying code (for instance
+        the state of one Vmec object), so they are computed one after
+        another in the same task. Only nodes with disjoint parameters
+        run concurrently.
+        """
+        outer = _evaluation_pass.values
+        values = {} if outer is None else dict(outer)
+        _evaluation_pass.values = values
+        # Every Parameter changed before now has a smaller version
+        # number, so this number is recorded for the nodes computed in
+        # this pass:
+        version_now = _next_version()
+        versions = self._versions
+        spaces = self._spaces
+        try:
+            recomputed = set()
+            for level in self._level_lists():
+                stale = []
+                for node in level:
+                    space = spaces[node]
+                    # Only a set of parameters can be modified in place:
+                    if type(node.parameters) is set \
+                            and len(space) != len(node.parameters):
+                        space = self._space(node)
+                    version = versions.get(node)
+                    upstream = False
+                    if node.dependencies:
+                        upstream = any(dependency in recomputed \
+                                           for dependency in node.dependencies)
+                    if upstream or version is None \
+                            or space.changed_since(version):
+                        # A Computation only tracks its own parameters:
+                        if upstream and isinstance(node, Computation):
+                            node.invalidate()
+                        stale.append((node, version_now))
+                    elif isinstance(node, Computation):
+                        # The Computation may have been invalidated
+                        # directly. Otherwise this returns its stored
+                        # result:
+                        value = node.evaluate()
+                        if value is not self._values[node]:
+                            self._values[node] = value
+                            recomputed.add(node)
+
+                if executor is None or len(stale) < 2:
+                    for node, version in stale:
+                        self._values[node] = node.evaluate()
+                        self._versions[node] = version
+                else:
+                    self._evaluate_concurrently(stale, executor)
+                for node, version in stale:
+                    recomputed.add(node)
+                for node in level:
+                    values[node] = self._values[node]
+        finally:
+            _evaluation_pass.values = outer
+        return dict(self._values)
+
+    def _level_lists(self):
+        """
+        Return the levels, computing them only once.
+        """
+        if self._levels_cache is None:
+            self._levels_cache = self.levels
+        return self._levels_cache
+
+    def _evaluate_concurrently(self, stale, executor):
+        """
+        Compute a list of (node, version) pairs from one level with an
+        executor, one task per group of nodes with shared parameters.
+        """
+        tasks = []
+        for group in _parameter_groups([node for node, version in stale]):
+            tasks.append((group, executor.submit(_evaluate_nodes, group)))
+        # Wait for every task, so no task is still running if one of
+        # them raised an exception:
+        concurrent.futures.wait([future for group, future in tasks])
+        versions = dict(stale)
+        for group, future in tasks:
+            for node, value in zip(group, future.result()):
+                self._values[node] = value
+                self._versions[node] = versions[node]
+
+def _evaluate_nodes(nodes):
+    """
+    Evaluate a list of nodes in order, returning the list of values.
+    """
+    return [node.evaluate() for node in nodes]
+
+def _parameter_groups(nodes):
+    """
+    Partition a list of nodes into lists, such that nodes in different
+    lists have no Parameter in common. The order of the nodes is
+    preserved within each list.
+    """
+    # Union-find on the nodes, merged through the Parameters they
+    # depend on:
+    parent = list(range(len(nodes)))
+    def find(j):
+        while parent[j] != j:
+            parent[j] = parent[parent[j]]
+            j = parent[j]
+        return j
+    owners = {}
+    seen = {}
+    for j, node in enumerate(nodes):
+        parameters = node.parameters
+        # Nodes with the same set of parameters (such as a shared
+        # ParameterGroup) are merged without looking at the elements:
+        if id(parameters) in seen:
+            parent[find(j)] = find(seen[id(parameters)])
+            continue
+        seen[id(parameters)] = j
+        for param in parameters:
+            owner = owners.setdefault(param, j)
+            if owner != j:
+                parent[find(j)] = find(owner)
+    groups = {}
+    for j, node in enumerate(nodes):
+        groups.setdefault(find(j), []).append(node)
+    return list(groups.values())
@@ -0,0 +1,61 @@
+import unittest
+from mattopt.parameter import Parameter
+from mattopt.computation import Computation
+
+class Bundle:
+    def __init__(self, total, difference):
+        self.total = total
+        self.difference = difference
+
+class ComputationTests(unittest.TestCase):
+    def test_shared(self):
+        """
+        Targets from the same Computation should share one call of the
+        function per state of the Parameters.
+        """
+        p1 = Parameter(3.0)
+        p2 = Parameter(1.0)
+        self.ncalls = 0
+        def f():
+            self.ncalls += 1
+            return (p1.val + p2.val, p1.val - p2.val)
+        c = Computation({p1, p2}, f)
+        total = c.target(0)
+        difference = c.target(1)
+        self.assertIs(total.parameters, c.parameters)
+        self.assertEqual(total.evaluate(), 4)
+        self.assertEqual(difference.evaluate(), 2)
+        self.assertEqual(self.ncalls, 1)
+        p2.val = 2.0
+        self.assertEqual(difference.evaluate(), 1)
+        self.assertEqual(total.evaluate(), 5)
+        self.assertEqual(self.ncalls, 2)
+        c.invalidate()
+        self.assertEqual(total.evaluate(), 5)
+        self.assertEqual(self.ncalls, 3)
+
+    def test_fields(self):
+        """
+        Fields can be indices, dict keys, or attribute names.
+        """
+        p = Parameter(2.0)
+        c = Computation({p}, lambda: {"double": 2 * p.val})
+        self.assertEqual(c.target("double").evaluate(), 4)
+        c = Computation({p}, lambda: Bundle(p.val + 1, p.val - 1))
+        self.assertEqual(c.get("total"), 3)
+        self.assertEqual(c.target("difference").evaluate(), 1)
+
+    def test_exceptions(self):
+        """
+        Invalid arguments should raise exceptions.
+        """
+        p = Parameter()
+        with self.assertRaises(ValueError):
+            Computation(p, lambda: 1)
+        with self.assertRaises(ValueError):
+            Computation({p, 3}, lambda: 1)
+        with self.assertRaises(ValueError):
+            Computation({p}, 7)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import unittest
+import os
+import pickle
+import tempfile
+import numpy as np
+from mattopt.parameter import Parameter
+from mattopt.target import Target
+from mattopt.least_squares_term import LeastSquaresTerm
+from mattopt.least_squares_problem import LeastSquaresProblem
+from mattopt.evaluation_cache import EvaluationCache
+
+class EvaluationCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "cache.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_basic(self):
+        """
+        Results should be found again by a new cache on the same file,
+        but only with the same fingerprint.
+        """
+        cache = EvaluationCache(self.filename, fingerprint="v1")
+        self.assertIsNone(cache.get("a", [1.0, 2.0]))
+        cache.put("a", [1.0, 2.0], np.array([3.0, 4.0]))
+        cache.put("b", [1.0, 2.0], 5.0)
+        self.assertEqual(len(cache), 2)
+        cache.close()
+
+        cache = EvaluationCache(self.filename, fingerprint="v1")
+        np.testing.assert_allclose(cache.get("a", np.array([1, 2])), [3, 4])
+        self.assertEqual(cache.get("b", [1.0, 2.0]), 5.0)
+        self.assertEqual(cache.get("b", [1.0, 2.5], default=-1), -1)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+        other = EvaluationCache(self.filename, fingerprint="v2")
+        self.assertIsNone(other.get("b", [1.0, 2.0]))
+        other.put("b", [1.0, 2.0], 6.0)
+        self.assertEqual(cache.get("b", [1.0, 2.0]), 5.0)
+        other.clear()
+        self.assertEqual(len(cache), 2)
+        cache.clear(all_fingerprints=True)
+        self.assertEqual(len(cache), 0)
+        cache.close()
+        other.close()
+
+        with self.assertRaises(ValueError):
+            EvaluationCache(self.filename, fingerprint=3)
+
+    def test_pickle(self):
+        """
+        A pickled cache should open its own connection to the file.
+        """
+        cache = EvaluationCache(self.filename, fingerprint="v1")
+        cache.put("a", [1.0], 2.0)
+        copy = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(copy.fingerprint, "v1")
+        self.assertEqual(copy.get("a", [1.0]), 2.0)
+        copy.put("b", [1.0], 3.0)
+        self.assertEqual(cache.get("b", [1.0]), 3.0)
+        copy.close()
+        cache.close()
+
+    def test_eviction(self):
+        """
+        The least recently used results should be deleted when the
+        cache is too large.
+        """
+        cache = EvaluationCache(self.filename, max_bytes=3000)
+        for j in range(3):
+            cache.put("a", [j], np.zeros(100))
+        self.assertEqual(len(cache), 3)
+        cache.get("a", [0])
+        cache.put("a", [3], np.zeros(100))
+        self.assertLessEqual(cache.nbytes, 3000)
+        self.assertIsNotNone(cache.get("a", [0]))
+        self.assertIsNone(cache.get("a", [1]))
+        self.assertIsNotNone(cache.get("a", [3]))
+        cache.close()
+
+    def test_target(self):
+        """
+        A Target should reuse results stored by an earlier run.
+        """
+        self.ncalls = 0
+        def run():
+            p = Parameter(2.0)
+            def f():
+                self.ncalls += 1
+                return p.val * p.val
+            cache = EvaluationCache(self.filename)
+            t = Target({p}, f, name="square", disk_cache=cache)
+            values = [t.evaluate()]
+            p.val = 3.0
+            values.append(t.evaluate())
+            cache.close()
+            return values
+        self.assertEqual(run(), [4, 9])
+        self.assertEqual(self.ncalls, 2)
+        self.assertEqual(run(), [4, 9])
+        self.assertEqual(self.ncalls, 2)
+
+    def test_problem(self):
+        """
+        The residuals of a LeastSquaresProblem should be stored.
+        """
+        self.ncalls = 0
+        p = Parameter(1.0, fixed=False)
+        def f():
+            self.ncalls += 1
+            return p.val
+        cache = EvaluationCache(self.filename)
+        prob = LeastSquaresProblem([LeastSquaresTerm(Target({p}, f), 3, 1)], \
+                                       disk_cache=cache)
+        prob.solve()
+        self.assertAlmostEqual(p.val, 3)
+        ncalls = self.ncalls
+        p.val = 1.0
+        prob.solve()
+        self.assertAlmostEqual(p.val, 3)
+        self.assertEqual(self.ncalls, ncalls)
+        np.testing.assert_allclose(prob._residual_func(np.array([2.0])), [-1])
+
+        # A problem with a different goal and sigma gets the value of
+        # the Target from the cache, but computes its own residuals:
+        target = Target({p}, f, name=prob._in_targets[0].name)
+        other = LeastSquaresProblem([LeastSquaresTerm(target, 5, 2)], \
+                                        disk_cache=cache)
+        np.testing.assert_allclose(other._residual_func(np.array([2.0])), \
+                                       [-1.5])
+        self.assertEqual(self.ncalls, ncalls)
+        cache.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,18 @@
 import unittest
-from mattopt.target import Identity
+import numpy as np
+import multiprocessing
+import os
+import pickle
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from mattopt.parameter import Parameter, ParameterArray
+from mattopt.target import Target, Identity, target_profiling
 from mattopt.least_squares_term import LeastSquaresTerm
-from mattopt.least_squares_problem import LeastSquaresProblem
+from mattopt.least_squares_problem import LeastSquaresProblem, \
+    _init_worker, _worker_residuals, _BroydenJacobian
 from mattopt.rosenbrock import Rosenbrock
+from mattopt.evaluation_cache import EvaluationCache
+from mattopt.computation import Computation
 
 class LeastSquaresProblemTests(unittest.TestCase):
 
@@ -32,6 +42,128 @@ class LeastSquaresProblemTests(unittest.TestCase):
         #print("[iden1.x, iden2.x]:",[iden1.x, iden2.x])
         self.assertEqual(set(prob.parameters), {iden1.x, iden2.x})
 
+    def test_parameter_order(self):
+        """
+        The parameters should be numbered reproducibly: term by term,
+        and within a term in order of creation.
+        """
+        r = Rosenbrock()
+        iden = Identity()
+        term1 = LeastSquaresTerm(iden.target, 0, 1)
+        term2 = LeastSquaresTerm(r.target2, 0, 1)
+        prob = LeastSquaresProblem([term1, term2])
+        self.assertEqual(prob.parameters, [iden.x, r.x1, r.x2])
+
+    def test_residual_observers(self):
+        """
+        Each observer should be called once per residual evaluation,
+        no matter how many of its Parameters change.
+        """
+        iden1 = Identity()
+        iden2 = Identity()
+        self.count = 0
+        def observer():
+            self.count += 1
+        iden1.x.observers = {observer}
+        iden2.x.observers = {observer}
+        iden1.x.fixed = False
+        iden2.x.fixed = False
+        term1 = LeastSquaresTerm(iden1.target, 1, 1)
+        term2 = LeastSquaresTerm(iden2.target, 2, 1)
+        prob = LeastSquaresProblem([term1, term2])
+        prob._residual_func([3.0, 4.0])
+        self.assertEqual(self.count, 1)
+
+    def test_invalidate(self):
+        """
+        After something other than the Parameters changes, invalidate()
+        should make the Targets be recomputed, and solve() should start
+        from fresh values.
+        """
+        p = Parameter(1.0, fixed=False)
+        shift = [0.0]
+        term = LeastSquaresTerm(Target({p}, lambda: p.val + shift[0]), 0, 1)
+        prob = LeastSquaresProblem([term])
+        self.assertEqual(prob.objective, 1.0)
+        shift[0] = 1.0
+        # The Parameter has not changed, so the stored value is used:
+        self.assertEqual(prob.objective, 1.0)
+        prob.invalidate()
+        self.assertEqual(prob.objective, 4.0)
+        shift[0] = 2.0
+        prob.solve()
+        self.assertAlmostEqual(p.val, -2.0)
+        self.assertAlmostEqual(prob.objective, 0.0)
+
+    def test_solve_rollback(self):
+        """
+        If the solve fails, the Parameters should be set back to their
+        initial values.
+        """
+        p = Parameter(2.0, fixed=False)
+        def func():
+            if p.val != 2.0:
+                raise RuntimeError("Physics code failed")
+            return p.val
+        term = LeastSquaresTerm(Target({p}, func), 0, 1)
+        prob = LeastSquaresProblem([term])
+        snapshot = prob.snapshot()
+        with self.assertRaises(RuntimeError):
+            prob.solve()
+        self.assertEqual(p.val, 2.0)
+        p.val = 3.0
+        prob.restore(snapshot)
+        self.assertEqual(p.val, 2.0)
+
+    def test_incremental_residuals(self):
+        """
+        Only the Targets whose Parameters change should be recomputed.
+        """
+        p1 = Parameter(1.0, fixed=False)
+        p2 = Parameter(2.0, fixed=False)
+        self.calls = []
+        def f1():
+            self.calls.append(1)
+            return p1.val
+        def f2():
+            self.calls.append(2)
+            return p2.val
+        prob = LeastSquaresProblem([LeastSquaresTerm(Target({p1}, f1), 0, 1), \
+                                        LeastSquaresTerm(Target({p2}, f2), 0, 1)])
+        np.testing.assert_allclose(prob._residual_func([1.0, 2.0]), [1, 2])
+        self.assertEqual(self.calls, [1, 2])
+        np.testing.assert_allclose(prob._residual_func([1.0, 3.0]), [1, 3])
+        self.assertEqual(self.calls, [1, 2, 2])
+        self.assertAlmostEqual(prob.objective, 10)
+        self.assertEqual(self.calls, [1, 2, 2])
+
+    def test_profile(self):
+        """
+        profile() should report the statistics of every Target.
+        """
+        r = Rosenbrock()
+        r.x1.fixed = False
+        r.x2.fixed = False
+        term1 = LeastSquaresTerm(r.target1, 0, 1)
+        term2 = LeastSquaresTerm(r.target2, 0, 1)
+        prob = LeastSquaresProblem([term1, term2])
+        with target_profiling():
+            prob.solve()
+        report = prob.profile()
+        nresiduals = prob._residual_stats.calls
+        self.assertGreater(nresiduals, 0)
+        self.assertIn("Residual evaluations: " + str(nresiduals), report)
+        self.assertIn("Rosenbrock.evaluate_target2", report)
+        self.assertIn("Rosenbrock.evaluate_target1", report)
+        # The out_targets of the terms are not evaluated:
+        self.assertNotIn("LeastSquaresTerm(", report)
+        self.assertEqual(len(report.splitlines()), 4)
+        # The finite differences of target2 also evaluate target1:
+        self.assertGreater(r.target1.stats.evaluations, nresiduals)
+        prob.reset_profile()
+        self.assertEqual(r.target1.stats.calls, 0)
+        self.assertIn("Residual evaluations: 0", prob.profile())
+
     def test_exceptions(self):
         """
         Verify that exceptions are raised when invalid inputs are
@@ -45,6 +177,123 @@ class LeastSquaresProblemTests(unittest.TestCase):
         with self.assertRaises(ValueError):
             prob = LeastSquaresProblem([7, 1])
 
+    def test_jacobian(self):
+        """
+        The Jacobian should combine analytic blocks with finite
+        differences for the Targets with no gradient function, and
+        only the free Parameters of each Target should be perturbed.
+        """
+        p = ParameterArray([1.0, 2.0, 3.0])
+        p.set_fixed(np.array([False, False, True]))
+        p1, p2, p3 = p[0], p[1], p[2]
+        t1 = Target({p1, p3}, lambda: np.array([p1.val * p3.val, p1.val]), \
+                        gradient=lambda: {p1: np.array([p3.val, 1.0]), \
+                                              p3: np.array([p1.val, 0.0])})
+        self.ncalls = 0
+        def f():
+            self.ncalls += 1
+            return p2.val ** 2 + p3.val
+        t2 = Target({p2, p3}, f)
+        term1 = LeastSquaresTerm(t1, 0, np.array([1.0, 2.0]))
+        term2 = LeastSquaresTerm(t2, 1, 4)
+        prob = LeastSquaresProblem([term1, term2])
+        jac = prob.jacobian()
+        np.testing.assert_allclose(jac, [[3, 0], [0.5, 0], [0, 1]], \
+                                       rtol=1e-6, atol=1e-12)
+        # One call at the present point, and one for p2 only:
+        self.assertEqual(self.ncalls, 2)
+        # Targets with no gradient function are differenced together,
+        # so a shared Computation runs once per column:
+        self.ncalls = 0
+        q = ParameterArray(np.array([1.0, 2.0]), fixed=False)
+        def g():
+            self.ncalls += 1
+            return (q[0].val * q[1].val, q[1].val ** 2)
+        c = Computation(set(q.data), g)
+        prob = LeastSquaresProblem([LeastSquaresTerm(c.target(0), 0, 1), \
+                                        LeastSquaresTerm(c.target(1), 0, 1)])
+        np.testing.assert_allclose(prob.jacobian(), [[2, 1], [0, 4]], \
+                                       rtol=1e-6, atol=1e-6)
+        self.assertEqual(self.ncalls, 3)
+        np.testing.assert_equal(q.get_val(), [1.0, 2.0])
+        # The Parameters are restored:
+        np.testing.assert_equal(p.get_val(), [1.0, 2.0, 3.0])
+
+    def test_parallel_jacobian(self):
+        """
+        The Jacobian computed by worker processes should agree with the
+        serial one, and solve() should converge with it.
+        """
+        r = Rosenbrock()
+        r.x1.fixed = False
+        r.x2.fixed = False
+        r.x1.val = 0.5
+        r.x2.val = -0.3
+        term1 = LeastSquaresTerm(r.target1, 0, 1)
+        term2 = LeastSquaresTerm(r.target2, 0, 1)
+        prob = LeastSquaresProblem([term1, term2])
+        jac = prob.jacobian()
+        with ProcessPoolExecutor(max_workers=2, initializer=_init_worker, \
+                                     initargs=(pickle.dumps(prob),)) as pool:
+            parallel = prob._parallel_jacobian(pool, 2, prob._space.get_x())
+        np.testing.assert_allclose(parallel, jac, rtol=1e-6)
+        np.testing.assert_allclose(jac, [[-1, 0], [-10, 10]], rtol=1e-6)
+
+        prob.solve(jacobian_processes=2)
+        self.assertAlmostEqual(prob.objective, 0)
+        self.assertAlmostEqual(r.x1.val, 1)
+        self.assertAlmostEqual(r.x2.val, 1)
+        with self.assertRaises(ValueError):
+            prob.solve(jacobian_processes=0)
+
+    def test_parallel_jacobian_spawn(self):
+        """
+        The workers of a parallel Jacobian should see the changes of
+        the Parameters when they are started by spawn, so that their
+        version numbers start again from 1, after the Parameters have
+        been changed many times in this process.
+        """
+        r = Rosenbrock()
+        r.x1.fixed = False
+        r.x2.fixed = False
+        for j in range(100):
+            r.x1.val = float(j)
+        term1 = LeastSquaresTerm(r.target1, 0, 1)
+        term2 = LeastSquaresTerm(r.target2, 0, 1)
+        prob = LeastSquaresProblem([term1, term2])
+        prob.residuals()
+        x = np.array([0.5, 0.7])
+        with ProcessPoolExecutor(max_workers=2, initializer=_init_worker, \
+                                     initargs=(pickle.dumps(prob),), \
+                                     mp_context=multiprocessing.get_context( \
+                                         "spawn")) as pool:
+            np.testing.assert_allclose(pool.submit(_worker_residuals, \
+                                                       x).result(), \
+                                           [0.5, 4.5])
+            parallel = prob._parallel_jacobian(pool, 2, x)
+        np.testing.assert_allclose(parallel, prob.jacobian(), rtol=1e-6)
+        np.testing.assert_allclose(parallel, [[-1, 0], [-10, 10]], rtol=1e-6)
+
+    def test_parallel_jacobian_disk_cache(self):
+        """
+        The parallel Jacobian should work when the residuals come from
+        a disk cache, as when a solve is restarted.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            cache = EvaluationCache(os.path.join(directory, "cache.sqlite"))
+            for restart in range(2):
+                r = Rosenbrock()
+                r.x1.fixed = False
+                r.x2.fixed = False
+                terms = [LeastSquaresTerm(r.target1, 0, 1), \
+                             LeastSquaresTerm(r.target2, 0, 1)]
+                prob = LeastSquaresProblem(terms, disk_cache=cache)
+                prob.solve(jacobian_processes=2)
+                self.assertAlmostEqual(r.x1.val, 1)
+                self.assertAlmostEqual(r.x2.val, 1)
+            self.assertGreater(cache.hits, 0)
+            cache.close()
+
     def test_solve_quadratic(self):
         """
         Minimize f(x,y,z) = ((x-1)/1)^2 + ((y-2)/2)^2 + ((z-3)/3)^2.
@@ -66,6 +315,23 @@ class LeastSquaresProblemTests(unittest.TestCase):
         self.assertAlmostEqual(iden2.x.val, 2)
         self.assertAlmostEqual(iden3.x.val, 3)
 
+    def test_solve_quadratic_executor(self):
+        """
+        Same as test_solve_quadratic, with the independent Targets
+        evaluated concurrently in a thread pool.
+        """
+        idens = [Identity() for j in range(3)]
+        terms = []
+        for j, iden in enumerate(idens):
+            iden.x.fixed = False
+            terms.append(LeastSquaresTerm(iden.target, j + 1, j + 1))
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            prob = LeastSquaresProblem(terms, executor=executor)
+            prob.solve()
+        self.assertAlmostEqual(prob.objective, 0)
+        for j, iden in enumerate(idens):
+            self.assertAlmostEqual(iden.x.val, j + 1)
+
     def test_solve_quadratic_fixed(self):
         """
         Same as test_solve_quadratic, except x and z are fixed, so
@@ -91,6 +357,189 @@ class LeastSquaresProblemTests(unittest.TestCase):
         self.assertAlmostEqual(iden2.x.val, 2)
         self.assertAlmostEqual(iden3.x.val, 6)
 
+    def test_solve_vector(self):
+        """
+        Fit a polynomial to data on a grid, using one vector-valued
+        term, together with a scalar term.
+        """
+        coeffs = ParameterArray(np.zeros(3), fixed=False)
+        grid = np.linspace(-1, 1, 50)
+        data = 1 + 2 * grid - 3 * grid * grid
+        def fit():
+            return np.polyval(coeffs.get_val()[::-1], grid)
+        term1 = LeastSquaresTerm(Target(set(coeffs.data), fit), data, 0.1)
+        iden = Identity()
+        iden.x.fixed = False
+        term2 = LeastSquaresTerm(iden.target, 4, 1)
+        prob = LeastSquaresProblem([term1, term2])
+        residuals = prob.residuals()
+        self.assertEqual(residuals.shape, (51,))
+        np.testing.assert_allclose(residuals[:50], -data / 0.1)
+        self.assertEqual(residuals[50], -4)
+        prob.solve()
+        np.testing.assert_allclose(coeffs.get_val(), [1, 2, -3], atol=1e-8)
+        self.assertAlmostEqual(iden.x.val, 4)
+        self.assertAlmostEqual(prob.objective, 0)
+
+    def test_residual_layout(self):
+        """
+        The residual vector should follow changes in the sizes of the
+        blocks, and every call should return a new vector.
+        """
+        p = Parameter(1.0)
+        self.size = 3
+        def f():
+            if self.size == 0:
+                return 2 * p.val
+            return np.full(self.size, p.val)
+        iden = Identity()
+        terms = [LeastSquaresTerm(Target({p}, f), 1, 2), \
+                     LeastSquaresTerm(iden.target, -1, 4)]
+        prob = LeastSquaresProblem(terms)
+        r1 = prob.residuals()
+        np.testing.assert_allclose(r1, [0, 0, 0, 0.25])
+        p.val = 3.0
+        r2 = prob.residuals()
+        self.assertIsNot(r1, r2)
+        np.testing.assert_allclose(r1, [0, 0, 0, 0.25])
+        np.testing.assert_allclose(r2, [1, 1, 1, 0.25])
+        self.size = 2
+        p.val = 5.0
+        np.testing.assert_allclose(prob.residuals(), [2, 2, 0.25])
+        # A vector-valued Target that becomes a scalar:
+        self.size = 0
+        p.val = 1.0
+        np.testing.assert_allclose(prob.residuals(), [0.5, 0.25])
+        self.size = 1
+        p.val = 3.0
+        np.testing.assert_allclose(prob.residuals(), [1, 0.25])
+
+    def test_many_terms(self):
+        """
+        The residuals of many scalar terms should be computed in one
+        vectorized operation.
+        """
+        idens = [Identity() for j in range(1000)]
+        goals = np.arange(1000.0)
+        sigmas = 1 + np.arange(1000.0) % 7
+        terms = [LeastSquaresTerm(iden.target, goal, sigma) \
+                     for iden, goal, sigma in zip(idens, goals, sigmas)]
+        prob = LeastSquaresProblem(terms)
+        np.testing.assert_allclose(prob.residuals(), -goals / sigmas)
+        idens[10].x.val = 4.0
+        expected = -goals / sigmas
+        expected[10] = (4 - 10) / sigmas[10]
+        np.testing.assert_allclose(prob.residuals(), expected)
+
+    def test_solve_bounds(self):
+        """
+        The min and max of the Parameters should be respected by the
+        optimizer, and the residuals never evaluated outside them.
+        """
+        p = ParameterArray([0.0, 0.5, 0.0], fixed=False, min=-1.0, \
+                               max=np.array([2.0, 1.0, np.Inf]))
+        p[2].fixed = True
+        self.points = []
+        def f():
+            val = p.get_val()
+            self.points.append(val)
+            return val[:2] - [3.0, -4.0]
+        term = LeastSquaresTerm(Target(set(p.data), f), 0, 1)
+        prob = LeastSquaresProblem([term])
+        lower, upper = prob._space.get_bounds()
+        np.testing.assert_equal(lower, [-1, -1])
+        np.testing.assert_equal(upper, [2, 1])
+        prob.solve()
+        np.testing.assert_allclose(p.get_val(), [2, -1, 0], atol=1e-6)
+        points = np.array(self.points)
+        self.assertTrue(np.all(points[:, :2] >= -1))
+        self.assertTrue(np.all(points[:, :2] <= [2, 1]))
+
+        # A free Parameter with min == max cannot be optimized:
+        p[1].val = 0.5
+        p[1].min = 0.5
+        p[1].max = 0.5
+        with self.assertRaises(ValueError):
+            prob.solve()
+
+    def test_broyden_update(self):
+        """
+        The Broyden update should satisfy the secant condition, and the
+        Jacobian should be recomputed in full periodically.
+        """
+        def fun(x):
+            return np.array([x[0] ** 2, x[0] * x[1], x[1]])
+        def jac(x):
+            return np.array([[2 * x[0], 0], [x[1], x[0]], [0, 1]])
+        broyden = _BroydenJacobian(fun, jac, 2, 0.0)
+        x1 = np.array([1.0, 2.0])
+        x2 = np.array([0.5, 1.0])
+        f1 = broyden.fun(x1)
+        np.testing.assert_allclose(broyden(x1), jac(x1))
+        self.assertTrue(broyden.fresh)
+        f2 = broyden.fun(x2)
+        j2 = broyden(x2)
+        self.assertFalse(broyden.fresh)
+        np.testing.assert_allclose(j2 @ (x2 - x1), f2 - f1)
+        x3 = np.array([0.25, 0.5])
+        broyden(x3)
+        # After 2 updates, the next Jacobian is computed in full:
+        np.testing.assert_allclose(broyden(np.array([0.1, 0.2])), \
+                                       jac([0.1, 0.2]))
+        self.assertEqual((broyden.nfull, broyden.nupdates), (2, 2))
+
+    def test_solve_broyden(self):
+        """
+        The Broyden mode should find the same solution as the default
+        mode, with fewer evaluations on a smooth problem.
+        """
+        n = 10
+        rng = np.random.default_rng(1)
+        matrix = 3 * np.eye(n) + 0.3 * rng.normal(size=(n, n))
+        rhs = rng.normal(size=n)
+        ncalls = []
+        for broyden_refresh in (None, 10):
+            p = ParameterArray(np.zeros(n), fixed=False)
+            self.ncalls = 0
+            def f():
+                self.ncalls += 1
+                x = p.get_val()
+                return matrix @ x - rhs + 0.2 * np.sin(x)
+            term = LeastSquaresTerm(Target(set(p.data), f), 0, 1)
+            prob = LeastSquaresProblem([term])
+            prob.solve(broyden_refresh=broyden_refresh)
+            self.assertAlmostEqual(prob.objective, 0)
+            ncalls.append(self.ncalls)
+        self.assertLess(ncalls[1], ncalls[0])
+        with self.assertRaises(ValueError):
+            prob.solve(broyden_refresh=0)
+
+    def test_serial_jacobian(self):
+        """
+        The Jacobian used for the full refreshes of the Broyden mode
+        should agree with jacobian(), and should run a Computation
+        shared by several terms once per column.
+        """
+        p = ParameterArray(np.array([1.0, 2.0, 3.0]), fixed=False)
+        self.ncalls = 0
+        def f():
+            self.ncalls += 1
+            x = p.get_val()
+            return (x[0] * x[1], x[1] + x[2] ** 2)
+        c = Computation(set(p.data), f)
+        terms = [LeastSquaresTerm(c.target(0), 0, 1), \
+                     LeastSquaresTerm(c.target(1), 0, 2)]
+        prob = LeastSquaresProblem(terms)
+        x = prob._space.get_x()
+        jac = prob._serial_jacobian(x)
+        np.testing.assert_allclose(jac, [[2, 1, 0], [0, 0.5, 3]], \
+                                       rtol=1e-6, atol=1e-6)
+        np.testing.assert_allclose(jac, prob.jacobian(), rtol=1e-6)
+        np.testing.assert_equal(p.get_val(), [1.0, 2.0, 3.0])
+        self.ncalls = 0
+        prob._serial_jacobian(x + 0.1)
+        self.assertEqual(self.ncalls, 4)
+
     def test_solve_rosenbrock(self):
         """
         Minimize the Rosenbrock function.
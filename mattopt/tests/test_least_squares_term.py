@@ -1,6 +1,9 @@
 import unittest
-from mattopt.target import Identity
+import numpy as np
+from mattopt.parameter import ParameterArray
+from mattopt.target import Target, Identity
 from mattopt.least_squares_term import LeastSquaresTerm
+from mattopt.least_squares_problem import LeastSquaresProblem
 
 class LeastSquaresTermTests(unittest.TestCase):
 
@@ -24,6 +27,36 @@ class LeastSquaresTermTests(unittest.TestCase):
         # Check that out_target correctly has iden.x as its parameter:
         self.assertEqual(lst.out_target.parameters, {iden.x})
 
+    def test_vector(self):
+        """
+        A vector-valued Target can have array goals and sigmas.
+        """
+        pa = ParameterArray(np.array([1.0, 2.0, 3.0]))
+        t = Target(set(pa.data), pa.get_val)
+        lst = LeastSquaresTerm(t, [1.0, 0.0, 5.0], np.array([1, 2, 4]))
+        np.testing.assert_allclose(lst.goal, [1, 0, 5])
+        np.testing.assert_allclose(lst.residual, [0, 1, -0.5])
+        self.assertAlmostEqual(lst.out_val, 1.25, places=13)
+        self.assertAlmostEqual(lst.out_target.evaluate(), 1.25, places=13)
+        # A scalar goal and sigma apply to every element:
+        lst = LeastSquaresTerm(t, 2, 0.5)
+        np.testing.assert_allclose(lst.residual, [-2, 0, 2])
+        self.assertAlmostEqual(lst.out_val, 8, places=13)
+        # The goal cannot be modified in place:
+        lst = LeastSquaresTerm(t, [1.0, 0.0, 5.0], 1)
+        with self.assertRaises(ValueError):
+            lst.goal[0] = 7
+        # goal and sigma must have the shape of the value of the
+        # Target, rather than be broadcast:
+        for goal, sigma in ((np.ones((3, 1)), 1), ([1.0], 1), \
+                                (0, np.ones((1, 3))), (0, [1.0, 2.0])):
+            lst = LeastSquaresTerm(t, goal, sigma)
+            with self.assertRaises(ValueError) as cm:
+                lst.out_val
+            self.assertIn("does not match the shape", str(cm.exception))
+            with self.assertRaises(ValueError):
+                LeastSquaresProblem([lst]).residuals()
+
     def test_exceptions(self):
         """
         Test that exceptions are thrown when invalid inputs are
@@ -39,12 +72,20 @@ class LeastSquaresTermTests(unittest.TestCase):
             lst = LeastSquaresTerm(iden.target, "hello", 0.1)
         with self.assertRaises(ValueError):
             lst = LeastSquaresTerm(iden.target, 3, iden)
+        for bad in ("3", b"3", True, np.bool_(True), ["1", "2"], \
+                        [True, False], np.array([1, 2], dtype=object)):
+            with self.assertRaises(ValueError):
+                lst = LeastSquaresTerm(iden.target, bad, 1)
+            with self.assertRaises(ValueError):
+                lst = LeastSquaresTerm(iden.target, 0, bad)
 
         # sigma cannot be zero
         with self.assertRaises(ValueError):
             lst = LeastSquaresTerm(iden.target, 3, 0)
         with self.assertRaises(ValueError):
             lst = LeastSquaresTerm(iden.target, 3, 0.0)
+        with self.assertRaises(ValueError):
+            lst = LeastSquaresTerm(iden.target, 3, [1.0, 0.0])
 
 if __name__ == "__main__":
     unittest.main()
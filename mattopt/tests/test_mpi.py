@@ -0,0 +1,98 @@
+import unittest
+import importlib.util
+import os
+import shutil
+import tempfile
+import numpy as np
+from mattopt.least_squares_term import LeastSquaresTerm
+from mattopt.least_squares_problem import LeastSquaresProblem
+from mattopt.rosenbrock import Rosenbrock
+from mattopt.target import Identity
+from mattopt.mpi import MpiPartition
+from mattopt.evaluation_cache import EvaluationCache
+
+# These tests can also be run with several processes, e.g.
+# mpiexec -n 4 python -m unittest mattopt.tests.test_mpi
+have_mpi4py = importlib.util.find_spec("mpi4py") is not None
+
+@unittest.skipIf(not have_mpi4py, "mpi4py is not installed")
+class MpiPartitionTests(unittest.TestCase):
+    def test_groups(self):
+        """
+        Each group should consist of consecutive ranks, and the columns
+        should be divided among the groups.
+        """
+        from mpi4py import MPI
+        size = MPI.COMM_WORLD.Get_size()
+        for ngroups in range(1, size + 1):
+            mpi = MpiPartition(ngroups)
+            self.assertEqual(mpi.nprocs_world, size)
+            groups = mpi.comm_world.allgather(mpi.group)
+            self.assertEqual(groups, sorted(groups))
+            self.assertEqual(set(groups), set(range(ngroups)))
+            self.assertEqual(mpi.nprocs_groups, groups.count(mpi.group))
+            self.assertEqual(mpi.comm_leaders is not None, mpi.proc0_groups)
+            if mpi.comm_leaders is not None:
+                self.assertEqual(mpi.comm_leaders.Get_rank(), mpi.group)
+            columns = []
+            for group in range(ngroups):
+                columns += list(mpi.columns(7, group))
+            self.assertEqual(columns, list(range(7)))
+        with self.assertRaises(ValueError):
+            MpiPartition(0)
+        with self.assertRaises(ValueError):
+            MpiPartition(size + 1)
+
+    def test_solve(self):
+        """
+        Every process should end at the optimum of the Rosenbrock
+        function.
+        """
+        mpi = MpiPartition()
+        r = Rosenbrock()
+        r.x1.fixed = False
+        r.x2.fixed = False
+        iden = Identity()
+        iden.x.fixed = False
+        terms = [LeastSquaresTerm(r.target1, 0, 1), \
+                     LeastSquaresTerm(r.target2, 0, 1), \
+                     LeastSquaresTerm(iden.target, 3, 1)]
+        prob = LeastSquaresProblem(terms)
+        prob.solve(mpi=mpi)
+        self.assertAlmostEqual(r.x1.val, 1)
+        self.assertAlmostEqual(r.x2.val, 1)
+        self.assertAlmostEqual(iden.x.val, 3)
+        self.assertAlmostEqual(prob.objective, 0)
+        with self.assertRaises(ValueError):
+            prob.solve(jacobian_processes=2, mpi=mpi)
+
+    def test_solve_disk_cache(self):
+        """
+        A restarted MPI solve should work with residuals from a disk
+        cache.
+        """
+        mpi = MpiPartition()
+        directory = None
+        if mpi.proc0_world:
+            directory = tempfile.mkdtemp()
+        directory = mpi.comm_world.bcast(directory, root=0)
+        cache = EvaluationCache(os.path.join(directory, "cache.sqlite"))
+        for restart in range(2):
+            r = Rosenbrock()
+            r.x1.fixed = False
+            r.x2.fixed = False
+            terms = [LeastSquaresTerm(r.target1, 0, 1), \
+                         LeastSquaresTerm(r.target2, 0, 1)]
+            prob = LeastSquaresProblem(terms, disk_cache=cache)
+            prob.solve(mpi=mpi)
+            self.assertAlmostEqual(r.x1.val, 1)
+            self.assertAlmostEqual(r.x2.val, 1)
+        if mpi.proc0_world:
+            self.assertGreater(cache.hits, 0)
+        cache.close()
+        mpi.comm_world.barrier()
+        if mpi.proc0_world:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    unittest.main()
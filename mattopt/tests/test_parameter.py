@@ -1,6 +1,8 @@
 import unittest
+import pickle
 import numpy as np
 from mattopt.parameter import *
+from mattopt.parameter_space import ParameterSpace
 
 class IsboolTests(unittest.TestCase):
     def test_basic(self):
@@ -188,6 +190,267 @@ class ParameterTests(unittest.TestCase):
         self.assertTrue(self.observer1_called)
         self.assertTrue(self.observer2_called)
 
+class ParameterCompactTests(unittest.TestCase):
+    def test_slots(self):
+        """
+        Parameters should not carry a __dict__.
+        """
+        p = Parameter()
+        self.assertFalse(hasattr(p, '__dict__'))
+        with self.assertRaises(AttributeError):
+            p.foo = 1
+        pa = ParameterArray(np.zeros(3))
+        self.assertFalse(hasattr(pa.data[0], '__dict__'))
+
+    def test_standalone_storage(self):
+        """
+        A standalone Parameter should hold its attributes as plain
+        objects, without numpy arrays, and keep them through pickling.
+        """
+        p = Parameter(3, fixed=False, min=0, name="nfp")
+        storage = p._storage
+        self.assertFalse(hasattr(storage, '__dict__'))
+        for attr in storage.__slots__:
+            self.assertNotIsInstance(getattr(storage, attr), np.ndarray)
+        self.assertIs(type(p.val), int)
+        version = p.version
+        p.val = 4
+        self.assertGreater(p.version, version)
+        q = pickle.loads(pickle.dumps(p))
+        self.assertEqual((q.val, q.fixed, q.min, q.name), (4, False, 0, "nfp"))
+        self.assertEqual(q.version, p.version)
+        q.val = 5
+        self.assertTrue(q.changed_since(p.version))
+
+    def test_shared_defaults(self):
+        """
+        Changing the bounds of one Parameter should not affect others
+        that started with the same default bounds.
+        """
+        p1 = Parameter()
+        p2 = Parameter()
+        p1.min = -1
+        p1.max = 1
+        p1.fixed = False
+        self.assertEqual(p2.min, np.NINF)
+        self.assertEqual(p2.max, np.Inf)
+        self.assertTrue(p2.fixed)
+
+        pa = ParameterArray(np.zeros((2, 2)))
+        pa.data[0, 1].min = -3
+        self.assertEqual(pa.data[0, 1].min, -3)
+        self.assertEqual(pa.data[1, 1].min, np.NINF)
+        pa.set_max(5)
+        self.assertEqual(pa.data[1, 0].max, 5)
+
+    def test_lazy_names(self):
+        """
+        A callable name should only be called when the name is
+        requested.
+        """
+        calls = []
+        def namer(*indices):
+            calls.append(indices)
+            return "p" + str(indices)
+        p = Parameter(name=namer)
+        self.assertEqual(calls, [])
+        self.assertEqual(p.name, "p()")
+        p.name = "q"
+        self.assertEqual(p.name, "q")
+
+        pa = ParameterArray(np.zeros((2, 3)), name=namer)
+        self.assertEqual(pa.data[1, 2].name, "p(1, 2)")
+        self.assertEqual(len(calls), 2)
+        pa.set_name("r")
+        self.assertEqual(pa.data[1, 2].name, "r")
+
+    def test_shared_observers(self):
+        """
+        Observers added to a whole ParameterArray should be stored
+        once, and elements can still have their own observers.
+        """
+        calls = []
+        def f():
+            calls.append('f')
+        def g():
+            calls.append('g')
+        pa = ParameterArray(np.zeros((20, 30)), observers=f)
+        pa.add_observer(g)
+        self.assertEqual(pa.data[5, 7].observers, {f, g})
+        self.assertIsNone(pa._storage.element_observers)
+
+        # Changing the observers of some elements only stores those:
+        pa[0, :2].remove_observer(g)
+        self.assertEqual(set(pa._storage.element_observers), {0, 1})
+        self.assertEqual(pa.data[0, 1].observers, {f})
+        pa.data[3, 3].observers = {g}
+        self.assertEqual(pa.data[3, 3].observers, {g})
+        pa.data[3, 3].add_observer(f)
+        self.assertEqual(set(pa._storage.element_observers), {0, 1})
+
+        pa.set_val(1.0)
+        self.assertEqual(calls, ['f', 'g'])
+        calls.clear()
+        pa.data[0, 0].val = 2.0
+        self.assertEqual(calls, ['f'])
+        calls.clear()
+
+        # Setting the observers of the whole array removes the
+        # per-element sets:
+        pa.set_observers(g)
+        self.assertIsNone(pa._storage.element_observers)
+        pa.data[0, 0].val = 3.0
+        self.assertEqual(calls, ['g'])
+
+        with self.assertRaises(ValueError):
+            pa.add_observer(5)
+
+        p = Parameter(observers=f)
+        p.add_observer(g)
+        self.assertEqual(p.observers, {f, g})
+        p.remove_observer(f)
+        self.assertEqual(p.observers, {g})
+
+class ParameterVersionTests(unittest.TestCase):
+    def observer(self):
+        self.count += 1
+
+    def test_parameter(self):
+        """
+        The version of a Parameter should increase only when val
+        changes to a different value.
+        """
+        self.count = 0
+        p = Parameter(1.0, observers=self.observer)
+        v0 = p.version
+        self.assertFalse(p.changed_since(v0))
+        p.val = 1.0
+        self.assertEqual(p.version, v0)
+        self.assertEqual(self.count, 0)
+        p.val = 2.0
+        v1 = p.version
+        self.assertGreater(v1, v0)
+        self.assertTrue(p.changed_since(v0))
+        self.assertFalse(p.changed_since(v1))
+        self.assertEqual(self.count, 1)
+
+        # Versions come from one counter, so they are comparable
+        # between Parameters:
+        p2 = Parameter()
+        self.assertGreater(p2.version, v1)
+        p.val = 3.0
+        self.assertGreater(p.version, p2.version)
+
+    def test_array(self):
+        """
+        The version of a ParameterArray should increase when any
+        element changes.
+        """
+        self.count = 0
+        pa = ParameterArray(np.zeros((3, 4)), observers=self.observer)
+        v0 = pa.version
+        pa.set_val(0.0)
+        self.assertFalse(pa.changed_since(v0))
+        self.assertEqual(self.count, 0)
+        pa.data[1, 2].val = 5.0
+        self.assertTrue(pa.changed_since(v0))
+        self.assertEqual(pa.version, pa.data[1, 2].version)
+        v1 = pa.version
+        pa.set_val(np.arange(12.0).reshape((3, 4)))
+        self.assertTrue(pa.changed_since(v1))
+        self.assertEqual(self.count, 2)
+        # Only the elements whose val changed get a new version:
+        self.assertEqual(pa.data[0, 0].version, v0)
+        self.assertEqual(pa.data[0, 1].version, pa.version)
+
+class ParameterBatchTests(unittest.TestCase):
+    def setUp(self):
+        self.counts = {"a": 0, "b": 0}
+
+    def observer_a(self):
+        self.counts["a"] += 1
+
+    def observer_b(self):
+        self.counts["b"] += 1
+
+    def test_basic(self):
+        """
+        Inside a parameter_batch() block, each distinct observer
+        should be called exactly once, when the block exits.
+        """
+        p1 = Parameter(observers={self.observer_a, self.observer_b})
+        p2 = Parameter(observers=self.observer_a)
+        p3 = Parameter()
+        with parameter_batch():
+            p1.val = 1
+            p2.val = 2
+            p1.val = 3
+            p3.val = 4
+            self.assertEqual(self.counts, {"a": 0, "b": 0})
+        self.assertEqual(self.counts, {"a": 1, "b": 1})
+        self.assertEqual(p1.val, 3)
+
+        # Nested blocks only notify when the outermost block exits:
+        with parameter_batch():
+            with parameter_batch():
+                p2.val = 5
+            self.assertEqual(self.counts, {"a": 1, "b": 1})
+        self.assertEqual(self.counts, {"a": 2, "b": 1})
+
+        # Outside a block, observers are called immediately:
+        p2.val = 6
+        self.assertEqual(self.counts, {"a": 3, "b": 1})
+
+    def test_exception(self):
+        """
+        If an exception is raised inside the block, the observers of
+        the Parameters already changed should still be called.
+        """
+        p = Parameter(observers=self.observer_a)
+        with self.assertRaises(RuntimeError):
+            with parameter_batch():
+                p.val = 1
+                raise RuntimeError()
+        self.assertEqual(self.counts["a"], 1)
+
+    def test_set_val(self):
+        """
+        ParameterArray.set_val should call each observer once.
+        """
+        p = ParameterArray(np.zeros((10, 10)), observers=self.observer_a)
+        p.set_val(1.0)
+        self.assertEqual(self.counts["a"], 1)
+
+class ParameterGroupTests(unittest.TestCase):
+    def test_basic(self):
+        """
+        A ParameterGroup is an immutable set of Parameters, and unions
+        of groups are groups.
+        """
+        p1 = Parameter()
+        p2 = Parameter()
+        pa = ParameterArray(np.zeros((2, 3)))
+        g1 = ParameterGroup([p1, p2, p1])
+        self.assertEqual(len(g1), 2)
+        self.assertIsInstance(g1, frozenset)
+        g2 = pa.to_group()
+        self.assertIsInstance(g2, ParameterGroup)
+        self.assertEqual(g2, set(pa.data.flat))
+        g3 = g1 | g2
+        self.assertIsInstance(g3, ParameterGroup)
+        self.assertEqual(len(g3), 8)
+        self.assertIsInstance(g1 | {pa.data[0, 0]}, ParameterGroup)
+        self.assertIsInstance(g1.union(g2, [pa.data[1, 1]]), ParameterGroup)
+        self.assertEqual(g1.union(g2), g3)
+        self.assertEqual(hash(g1 | g2), hash(g2 | g1))
+        with self.assertRaises(AttributeError):
+            g1.add(Parameter())
+
+        with self.assertRaises(ValueError):
+            ParameterGroup([p1, 3])
+        with self.assertRaises(ValueError):
+            g1 | {4}
+
 class ParameterArrayTests(unittest.TestCase):
     def myfunc(self):
         """
@@ -405,5 +668,169 @@ class ParameterArrayTests(unittest.TestCase):
         self.assertAlmostEqual(pa.data[0].val, 1.0, places=13)
         self.assertAlmostEqual(pa.data[1].val, 2.0, places=13)
 
+    def test_views(self):
+        """
+        The elements of a ParameterArray are views into the array's
+        storage, so changes made through either are visible in the
+        other.
+        """
+        p = ParameterArray(np.zeros((2, 3)))
+        p.data[1, 2].val = 5.0
+        np.testing.assert_allclose(p.get_val(), [[0, 0, 0], [0, 0, 5]])
+        p.set_val(np.array([[1, 2, 3], [4, 5, 6]]))
+        self.assertEqual(p.data[0, 1].val, 2)
+        self.assertEqual(p.data[1, 2].val, 6)
+        p.set_fixed(np.array([[True, False, True], [False, True, True]]))
+        self.assertFalse(p.data[0, 1].fixed)
+        self.assertTrue(p.data[0, 2].fixed)
+
+        # Integer vals are stored as floats so later assignments are
+        # not truncated:
+        p = ParameterArray([1, 2, 3])
+        p.data[0].val = 0.5
+        self.assertEqual(p.get_val()[0], 0.5)
+
+    def test_set_val_bounds(self):
+        """
+        set_val should check the bounds of all elements before
+        writing anything.
+        """
+        p = ParameterArray(np.zeros(3), min=-1, max=1)
+        with self.assertRaises(ValueError):
+            p.set_val(np.array([0.5, 2.0, 0.5]))
+        np.testing.assert_allclose(p.get_val(), [0, 0, 0])
+        with self.assertRaises(ValueError):
+            p.set_min(np.array([0.5, -2.0, -2.0]))
+        with self.assertRaises(ValueError):
+            ParameterArray(np.zeros(3), min=1)
+
+    def test_bounds_message(self):
+        """
+        A bounds error should list the offending elements.
+        """
+        pa = ParameterArray(np.zeros((3, 4)), max=10, \
+                                name=lambda m, n: "c" + str(m) + str(n))
+        val = np.zeros((3, 4))
+        val[1, 2] = 11
+        val[2, 0] = -np.inf
+        val[2, 3] = 12
+        pa.set_min(-1)
+        with self.assertRaises(ValueError) as cm:
+            pa.set_val(val)
+        message = str(cm.exception)
+        self.assertIn("2 Parameter(s) have val > max", message)
+        self.assertIn("(1, 2) (c12): val = 11.0, max = 10.0", message)
+        self.assertIn("(2, 3) (c23)", message)
+        self.assertIn("1 Parameter(s) have val < min: (2, 0) (c20)", message)
+        self.assertNotIn("(0, 0)", message)
+        np.testing.assert_allclose(pa.get_val(), np.zeros((3, 4)))
+
+        # Long lists are truncated:
+        with self.assertRaises(ValueError) as cm:
+            ParameterArray(np.arange(100.0), max=50)
+        self.assertIn("49 Parameter(s) have val > max", str(cm.exception))
+        self.assertIn("and 39 more", str(cm.exception))
+
+    def test_from_array_views(self):
+        """
+        The Parameters passed to from_array should become views into
+        the new ParameterArray.
+        """
+        p1 = Parameter(1.0, fixed=False, name="p1")
+        p2 = Parameter(2.0, min=0)
+        pa = ParameterArray.from_array([p1, p2])
+        self.assertIs(pa.data[0], p1)
+        self.assertEqual(pa.data[0].name, "p1")
+        self.assertFalse(pa.data[0].fixed)
+        self.assertEqual(pa.data[1].min, 0)
+        pa.set_val(np.array([3.0, 4.0]))
+        self.assertEqual(p1.val, 3.0)
+        self.assertEqual(p2.val, 4.0)
+
+        # Parameters already in a ParameterArray cannot be moved:
+        with self.assertRaises(ValueError):
+            ParameterArray.from_array([p1])
+        p3 = Parameter()
+        with self.assertRaises(ValueError):
+            ParameterArray.from_array([p3, p3])
+
+    def test_nfree(self):
+        """
+        The count of non-fixed Parameters should be updated as fixed
+        changes, through either the array or its elements.
+        """
+        pa = ParameterArray(np.zeros((2, 3)))
+        self.assertEqual(pa.nfree, 0)
+        self.assertEqual(pa.get_variables(), set())
+        pa.set_fixed(np.array([[False, True, False], [True, True, False]]))
+        self.assertEqual(pa.nfree, 3)
+        self.assertEqual(pa.get_variables(), \
+                             {pa.data[0, 0], pa.data[0, 2], pa.data[1, 2]})
+        pa.data[0, 1].fixed = False
+        pa.data[1, 2].fixed = True
+        # Setting fixed to its current value changes nothing:
+        pa.data[0, 0].fixed = False
+        self.assertEqual(pa.nfree, 3)
+        self.assertEqual(pa.get_variables(), \
+                             {pa.data[0, 0], pa.data[0, 1], pa.data[0, 2]})
+        pa.set_fixed(False)
+        self.assertEqual(pa.nfree, 6)
+
+        # A view that repeats an element:
+        pa = ParameterArray(np.zeros(2))
+        pa.data[0].fixed = False
+        pa[[0, 0]].set_fixed(True)
+        pa.data[1].fixed = False
+        self.assertEqual(pa.nfree, 1)
+        self.assertEqual(pa.get_variables(), {pa.data[1]})
+        self.assertEqual(ParameterSpace(pa.to_group()).get_x().size, 1)
+
+    def test_slices(self):
+        """
+        Slicing a ParameterArray should give a view that shares the
+        storage and the Parameter objects.
+        """
+        pa = ParameterArray(np.zeros((3, 4)), max=10)
+        self.assertIs(pa[1, 2], pa.data[1, 2])
+        view = pa[1:, ::2]
+        self.assertIsInstance(view, ParameterArray)
+        self.assertIs(view.base, pa)
+        self.assertIsNone(pa.base)
+        self.assertEqual(view.shape, (2, 2))
+        self.assertIs(view.data[1, 1], pa.data[2, 2])
+        # A view of a view refers to the same base:
+        self.assertIs(view[0].base, pa)
+        self.assertIs(view[0][1], pa.data[1, 2])
+
+        view.set_fixed(False)
+        self.assertEqual(pa.nfree, 4)
+        self.assertEqual(view[1].nfree, 2)
+        self.assertEqual(view[1].get_variables(), \
+                             {pa.data[2, 0], pa.data[2, 2]})
+
+        view.set_val(np.array([[1.0, 2.0], [3.0, 4.0]]))
+        np.testing.assert_allclose(pa.get_val(), \
+                                       [[0, 0, 0, 0], [1, 0, 2, 0], \
+                                            [3, 0, 4, 0]])
+        version = pa.version
+        pa[0, :] = 5.0
+        pa[[2], 1] = 6.0
+        np.testing.assert_allclose(pa.get_val(), \
+                                       [[5, 5, 5, 5], [1, 0, 2, 0], \
+                                            [3, 6, 4, 0]])
+        self.assertTrue(pa[0].changed_since(version))
+        self.assertFalse(pa[1].changed_since(version))
+        self.assertFalse(view.changed_since(version))
+        pa[2, 2] = 7.0
+        self.assertTrue(view.changed_since(version))
+
+        # Bounds and shapes are checked:
+        with self.assertRaises(ValueError):
+            pa[0, 0] = 20.0
+        with self.assertRaises(ValueError):
+            view.set_val(np.zeros(3))
+        with self.assertRaises(ValueError):
+            pa[1:] = np.zeros(3)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,228 @@
+import unittest
+import numpy as np
+from mattopt.parameter import Parameter, ParameterArray, ParameterGroup
+from mattopt.parameter_space import ParameterSpace
+
+class ParameterSpaceTests(unittest.TestCase):
+    def test_indices(self):
+        """
+        Parameters should be numbered in the order they are added, and
+        keep their index when added again.
+        """
+        p1 = Parameter(1.0)
+        p2 = Parameter(2.0)
+        pa = ParameterArray(np.array([3.0, 4.0, 5.0]))
+        space = ParameterSpace([p2, p1])
+        self.assertEqual(space.index(p2), 0)
+        self.assertEqual(space.index(p1), 1)
+        # A set is numbered in order of creation:
+        space.add({pa.data[2], p1, pa.data[0], pa.data[1]})
+        self.assertEqual(len(space), 5)
+        self.assertEqual(space.parameters, \
+                             [p2, p1, pa.data[0], pa.data[1], pa.data[2]])
+        self.assertIn(pa.data[1], space)
+        self.assertNotIn(Parameter(), space)
+        np.testing.assert_allclose(space.get_state(), [2, 1, 3, 4, 5])
+
+        with self.assertRaises(ValueError):
+            space.add([7])
+
+        # Adding a group again leaves the numbering unchanged:
+        group = ParameterGroup(pa.data)
+        space = ParameterSpace([p1])
+        space.add(group)
+        space.add({p2} | group)
+        space.add(group)
+        self.assertEqual(space.parameters, \
+                             [p1, pa.data[0], pa.data[1], pa.data[2], p2])
+
+    def test_get_set_x(self):
+        """
+        get_x() and set_x() should act on the non-fixed Parameters.
+        """
+        p1 = Parameter(1.0, fixed=False)
+        p2 = Parameter(2.0)
+        pa = ParameterArray(np.array([3.0, 4.0, 5.0]), \
+                                fixed=np.array([False, True, False]))
+        space = ParameterSpace([p1, p2] + list(pa.data))
+        np.testing.assert_allclose(space.get_x(), [1, 3, 5])
+        self.assertEqual(space.free_parameters, [p1, pa.data[0], pa.data[2]])
+
+        space.set_x([10, 30, 50])
+        self.assertEqual(p1.val, 10)
+        self.assertEqual(p2.val, 2)
+        np.testing.assert_allclose(pa.get_val(), [30, 4, 50])
+
+        # Changes to fixed are picked up:
+        p2.fixed = False
+        pa.data[0].fixed = True
+        np.testing.assert_allclose(space.get_x(), [10, 2, 50])
+
+        # x must have the right length:
+        with self.assertRaises(ValueError):
+            space.set_x([1, 2])
+
+    def test_free_cache(self):
+        """
+        The non-fixed indices should be reused until fixed changes.
+        """
+        p = Parameter(1.0, fixed=False)
+        pa = ParameterArray(np.array([3.0, 4.0]))
+        space = ParameterSpace([p] + list(pa.data))
+        free = space._free()
+        self.assertIs(space._free(), free)
+        space.set_x([2.0])
+        self.assertIs(space._free(), free)
+        self.assertEqual(space.nfree, 1)
+        pa.set_fixed(np.array([True, False]))
+        self.assertIsNot(space._free(), free)
+        self.assertEqual(space.nfree, 2)
+        np.testing.assert_allclose(space.get_x(), [2, 4])
+        # Adding Parameters also refreshes the indices:
+        p2 = Parameter(5.0, fixed=False)
+        space.add([p2])
+        np.testing.assert_allclose(space.get_x(), [2, 4, 5])
+
+    def test_version(self):
+        """
+        changed_since() should only consider the Parameters in the
+        space.
+        """
+        p = Parameter(1.0)
+        pa = ParameterArray(np.zeros(3))
+        space = ParameterSpace([p, pa.data[1]])
+        version = space.version
+        self.assertFalse(space.changed_since(version))
+        pa.data[0].val = 2.0
+        self.assertFalse(space.changed_since(version))
+        pa.data[1].val = 2.0
+        self.assertTrue(space.changed_since(version))
+        self.assertEqual(space.version, pa.data[1].version)
+
+    def test_set_x_bounds(self):
+        """
+        If any value in x violates a bound, nothing should be written.
+        """
+        p1 = Parameter(1.0, fixed=False)
+        pa = ParameterArray(np.array([3.0, 4.0]), fixed=False, max=10)
+        space = ParameterSpace([p1] + list(pa.data))
+        p1.min = 0
+        with self.assertRaises(ValueError) as cm:
+            space.set_x([-1, 5, 20])
+        np.testing.assert_allclose(space.get_x(), [1, 3, 4])
+        # The error lists the violations in all the groups:
+        self.assertIn("Parameter: val = -1.0, min = 0", str(cm.exception))
+        self.assertIn("(1,): val = 20.0, max = 10", str(cm.exception))
+
+    def test_set_x_standalone(self):
+        """
+        set_x() should check the bounds of all the standalone
+        Parameters before writing, and only touch the ones that change.
+        """
+        params = [Parameter(float(j), fixed=False, min=0, max=10) \
+                      for j in range(5)]
+        fixed = Parameter(7.0, min=0, max=10)
+        space = ParameterSpace(params[:2] + [fixed] + params[2:])
+        with self.assertRaises(ValueError) as cm:
+            space.set_x([1, -1, 2, 3, 11])
+        np.testing.assert_allclose(space.get_x(), [0, 1, 2, 3, 4])
+        self.assertIn("val = -1.0, min = 0", str(cm.exception))
+        self.assertIn("val = 11.0, max = 10", str(cm.exception))
+        versions = [p.version for p in params]
+        space.set_x([0, 1, 5, 3, 4])
+        self.assertEqual(params[2].val, 5)
+        self.assertEqual(fixed.val, 7)
+        self.assertEqual([p.version == v for p, v in zip(params, versions)], \
+                             [True, True, False, True, True])
+
+    def test_observers(self):
+        """
+        set_x() should call each observer once.
+        """
+        self.count = 0
+        def observer():
+            self.count += 1
+        pa = ParameterArray(np.zeros(4), fixed=False, observers=observer)
+        p = Parameter(fixed=False, observers=observer)
+        space = ParameterSpace(list(pa.data) + [p])
+        space.set_x(np.arange(1.0, 6.0))
+        self.assertEqual(self.count, 1)
+
+    def test_snapshot(self):
+        """
+        restore() should write back the vals of all the Parameters,
+        calling each observer once.
+        """
+        self.count = 0
+        def observer():
+            self.count += 1
+        p1 = Parameter(1.0, fixed=False, observers=observer)
+        p2 = Parameter(2.0)
+        pa = ParameterArray(np.array([3.0, 4.0, 5.0]), fixed=False, \
+                                observers=observer)
+        space = ParameterSpace([p1, p2] + list(pa.data))
+        snapshot = space.snapshot()
+        self.assertEqual(len(snapshot), 5)
+        self.assertEqual(list(snapshot.state), [1, 2, 3, 4, 5])
+
+        space.set_x([10, 30, 40, 50])
+        p2.val = 20
+        pa.data[2].val = 5.0
+        version = pa.data[2].version
+        self.count = 0
+        snapshot.restore()
+        np.testing.assert_allclose(space.get_state(), [1, 2, 3, 4, 5])
+        self.assertEqual(self.count, 1)
+        # Parameters whose val did not change are not written:
+        self.assertFalse(pa.data[2].changed_since(version))
+
+        # Parameters added later are left alone:
+        p3 = Parameter(6.0)
+        space.add([p3])
+        p3.val = 7.0
+        space.restore(snapshot)
+        self.assertEqual(p3.val, 7.0)
+
+        with self.assertRaises(ValueError):
+            ParameterSpace([p1]).restore(snapshot)
+
+    def test_snapshot_types(self):
+        """
+        restore() should give back the vals with their own types.
+        """
+        stelsym = Parameter(True)
+        nfp = Parameter(3)
+        pa = ParameterArray(np.array([1.0, 2.0]), fixed=False)
+        space = ParameterSpace([stelsym, nfp] + list(pa.data))
+        snapshot = space.snapshot()
+        stelsym.val = False
+        nfp.val = 5
+        space.set_x([3.0, 4.0])
+        snapshot.restore()
+        self.assertIs(stelsym.val, True)
+        self.assertIs(type(nfp.val), int)
+        self.assertEqual(nfp.val, 3)
+        np.testing.assert_allclose(pa.get_val(), [1, 2])
+        # Without such vals, the snapshot is a float vector:
+        self.assertEqual(ParameterSpace(pa.data).snapshot().state.dtype, \
+                             np.float64)
+
+    def test_rollback_on_error(self):
+        """
+        The Parameters should be restored only if the block raises.
+        """
+        pa = ParameterArray(np.array([1.0, 2.0]), fixed=False)
+        space = ParameterSpace(pa.data)
+        with space.rollback_on_error() as snapshot:
+            space.set_x([3.0, 4.0])
+        np.testing.assert_allclose(pa.get_val(), [3, 4])
+        np.testing.assert_allclose(snapshot.state, [1, 2])
+
+        with self.assertRaises(RuntimeError):
+            with space.rollback_on_error():
+                space.set_x([5.0, 6.0])
+                raise RuntimeError("VMEC did not converge")
+        np.testing.assert_allclose(pa.get_val(), [3, 4])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+import numpy as np
 import os
 from mattopt.surface import *
 
@@ -53,6 +54,29 @@ class SurfaceRZFourierTests(unittest.TestCase):
         self.assertEqual(s.rs.shape, (2, 7))
         self.assertEqual(s.zc.shape, (2, 7))
 
+    def test_parameter_groups(self):
+        """
+        The Targets of a surface should share its groups of
+        Parameters.
+        """
+        s = SurfaceRZFourier(nfp=2, mpol=3, ntor=2, stelsym=False)
+        self.assertEqual(len(s.coefficients), 4 * 4 * 5)
+        self.assertIn(s.get_zc(1, -1), s.coefficients)
+        self.assertEqual(len(s.parameters), 4 * 4 * 5 + 4)
+        self.assertIn(s.mpol, s.parameters)
+        self.assertIs(s.area.parameters, s.parameters)
+        self.assertIs(s.volume.parameters, s.parameters)
+
+    def test_names(self):
+        """
+        The names of the Parameters are generated on request.
+        """
+        s = SurfaceRZFourier(nfp=2, mpol=3, ntor=2)
+        objstr = " for SurfaceRZFourier " + str(hex(id(s)))
+        self.assertEqual(s.get_rc(3, -2).name, "rc(m= 003,n=-002)" + objstr)
+        self.assertEqual(s.get_zs(1, 0).name, "zs(m= 001,n= 000)" + objstr)
+        self.assertEqual(s.mpol.name, "mpol" + objstr)
+
     def test_from_focus(self):
         """
         Try reading in a focus-format file.
@@ -95,5 +119,29 @@ class SurfaceRZFourierTests(unittest.TestCase):
         self.assertAlmostEqual(s.compute_area(), true_area, places=4)
         self.assertAlmostEqual(s.compute_volume(), true_volume, places=3)
 
+    def test_area_volume_shared(self):
+        """
+        The area and volume Targets should share one computation.
+        """
+        s = SurfaceRZFourier()
+        area = s.area.evaluate()
+        volume = s.volume.evaluate()
+        self.assertAlmostEqual(area, 4 * np.pi * np.pi * 0.1, places=4)
+        self.assertAlmostEqual(volume, 2 * np.pi * np.pi * 0.01, places=4)
+        self.ncalls = 0
+        area_volume = s.area_volume
+        def counter():
+            self.ncalls += 1
+            return area_volume()
+        s._area_volume._function = counter
+        s.get_rc(0, 0).val = 2.0
+        self.assertAlmostEqual(s.volume.evaluate(), 2 * volume, places=4)
+        self.assertAlmostEqual(s.area.evaluate(), 2 * area, places=4)
+        self.assertEqual(self.ncalls, 1)
+        # Changing the resolution means a new computation:
+        s.ntheta = 30
+        s.compute_area()
+        self.assertEqual(self.ncalls, 2)
+
 if __name__ == "__main__":
     unittest.main()
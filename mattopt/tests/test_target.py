@@ -1,6 +1,8 @@
 import unittest
-from mattopt.parameter import Parameter
-from mattopt.target import Target, Identity
+from concurrent.futures import ThreadPoolExecutor
+from mattopt.parameter import Parameter, ParameterGroup
+from mattopt.target import Target, Identity, enable_target_profiling, \
+    target_profiling
 
 def my_function():
     return 7
@@ -38,6 +40,54 @@ class TargetTests(unittest.TestCase):
         t3 = Target({p1}, self.another_function)
         self.assertEqual(t3.evaluate(), 106)
 
+    def test_group(self):
+        """
+        A Target can depend on a ParameterGroup, which is not copied.
+        """
+        p1 = Parameter(6)
+        group = ParameterGroup([p1, Parameter()])
+        t = Target(group, my_function)
+        self.assertIs(t.parameters, group)
+        self.assertEqual(t.evaluate(), 7)
+
+    def test_stats(self):
+        """
+        Statistics should only be collected while profiling is
+        enabled.
+        """
+        p = Parameter(1.0)
+        t = Target({p}, my_function)
+        self.assertEqual(t.name, "my_function")
+        self.assertEqual(Target({p}, my_function, name="seven").name, "seven")
+        t.evaluate()
+        self.assertEqual(t.stats.calls, 0)
+        with target_profiling():
+            t.evaluate()
+            t.evaluate()
+        t.evaluate()
+        self.assertEqual(t.stats.calls, 2)
+        self.assertEqual(t.stats.evaluations, 2)
+        self.assertGreaterEqual(t.stats.total_time, t.stats.max_time)
+        self.assertGreater(t.stats.max_time, 0)
+
+        # Cache hits and misses are counted:
+        t.stats.reset()
+        t.cache_size = 2
+        enable_target_profiling()
+        try:
+            t.evaluate()
+            t.evaluate()
+            p.val = 2.0
+            t.evaluate()
+            p.val = 1.0
+            t.evaluate()
+        finally:
+            enable_target_profiling(False)
+        self.assertEqual(t.stats.calls, 4)
+        self.assertEqual(t.stats.evaluations, 2)
+        self.assertEqual(t.stats.cache_hits, 2)
+        self.assertEqual(t.stats.cache_misses, 2)
+
     def test_exceptions(self):
         """
         Test that exceptions are raised if invalid parameters are
@@ -68,6 +118,99 @@ class TargetTests(unittest.TestCase):
         with self.assertRaises(ValueError):
             t4 = Target({p1, 4, p2}, my_function)
 
+    def test_cache(self):
+        """
+        With cache_size > 0, results for recent parameter values
+        should be returned without calling the function.
+        """
+        p1 = Parameter(1.0)
+        p2 = Parameter(2.0)
+        self.ncalls = 0
+        def f():
+            self.ncalls += 1
+            return p1.val + 10 * p2.val
+        t = Target({p1, p2}, f, cache_size=2)
+        self.assertEqual(t.evaluate(), 21)
+        self.assertEqual(t.evaluate(), 21)
+        self.assertEqual(self.ncalls, 1)
+        p1.val = 3.0
+        self.assertEqual(t.evaluate(), 23)
+        self.assertEqual(self.ncalls, 2)
+        # Going back to a recent point does not call the function:
+        p1.val = 1.0
+        self.assertEqual(t.evaluate(), 21)
+        self.assertEqual(self.ncalls, 2)
+        # Only 2 results are remembered:
+        p2.val = 0.0
+        self.assertEqual(t.evaluate(), 1)
+        p1.val = 3.0
+        self.assertEqual(t.evaluate(), 3)
+        p2.val = 2.0
+        self.assertEqual(t.evaluate(), 23)
+        self.assertEqual(self.ncalls, 5)
+
+        # Without a cache the function is always called:
+        t.cache_size = 0
+        t.evaluate()
+        t.evaluate()
+        self.assertEqual(self.ncalls, 7)
+        with self.assertRaises(ValueError):
+            t.cache_size = -1
+
+        # Changes to the set of parameters are noticed:
+        t.cache_size = 4
+        t2 = Target({p1}, f, cache_size=4)
+        self.assertEqual(t2.evaluate(), 23)
+        t2.parameters.add(p2)
+        p2.val = 5.0
+        self.assertEqual(t2.evaluate(), 53)
+
+    def test_gradient(self):
+        """
+        A Target can have an optional gradient function.
+        """
+        p1 = Parameter(2.0)
+        p2 = Parameter(3.0)
+        t = Target({p1, p2}, lambda: p1.val * p2.val, \
+                       gradient=lambda: {p1: p2.val, p2: p1.val})
+        self.assertTrue(t.has_gradient)
+        self.assertEqual(t.evaluate_gradient(), {p1: 3.0, p2: 2.0})
+        t = Target({p1}, lambda: p1.val)
+        self.assertFalse(t.has_gradient)
+        with self.assertRaises(ValueError):
+            t.evaluate_gradient()
+        with self.assertRaises(ValueError):
+            Target({p1}, lambda: p1.val, gradient=5)
+        t = Target({p1}, lambda: p1.val, gradient=lambda: [1.0])
+        with self.assertRaises(ValueError):
+            t.evaluate_gradient()
+        iden = Identity()
+        self.assertEqual(iden.target.evaluate_gradient(), {iden.x: 1.0})
+
+    def test_evaluate_async(self):
+        """
+        evaluate_async() should return a Future for the value, with or
+        without an executor.
+        """
+        p = Parameter(2.0)
+        t = Target({p}, lambda: 3 * p.val)
+        future = t.evaluate_async()
+        self.assertTrue(future.done())
+        self.assertEqual(future.result(), 6)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [t.evaluate_async(executor) for j in range(3)]
+            self.assertEqual([f.result() for f in futures], [6, 6, 6])
+
+        # Exceptions are raised by result():
+        def f():
+            raise RuntimeError("failed")
+        t = Target({p}, f)
+        with self.assertRaises(RuntimeError):
+            t.evaluate_async().result()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with self.assertRaises(RuntimeError):
+                t.evaluate_async(executor).result()
+
 
 class IdentityTests(unittest.TestCase):
     def test_basic(self):
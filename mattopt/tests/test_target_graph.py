@@ -0,0 +1,167 @@
+import unittest
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from mattopt.parameter import Parameter
+from mattopt.target import Target
+from mattopt.computation import Computation
+from mattopt.target_graph import TargetGraph
+from mattopt.least_squares_term import LeastSquaresTerm
+
+class TargetGraphTests(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def counted(self, label, function):
+        """
+        Return a function that records each call to function.
+        """
+        def wrapper():
+            self.calls.append(label)
+            return function()
+        return wrapper
+
+    def test_structure(self):
+        """
+        The graph should contain all the dependencies, in topological
+        order and by level.
+        """
+        p1 = Parameter(1.0)
+        p2 = Parameter(2.0)
+        c = Computation({p1, p2}, lambda: (p1.val, p2.val))
+        t1 = c.target(0)
+        t2 = c.target(1)
+        t3 = Target({p2}, lambda: 3 * p2.val)
+        term = LeastSquaresTerm(t1, 0, 1)
+        graph = TargetGraph([term.out_target, t2, t3])
+        self.assertEqual(len(graph), 5)
+        self.assertEqual(graph.nodes, [c, t1, term.out_target, t2, t3])
+        self.assertEqual(graph.levels, [[c, t3], [t1, t2], [term.out_target]])
+        self.assertEqual(graph.dependencies(t1), (c,))
+        self.assertEqual(graph.dependents(c), [t1, t2])
+        self.assertEqual(graph.dependents(t3), [])
+        self.assertIn(t3, graph)
+        self.assertNotIn(Target({p1}, lambda: 0), graph)
+        # The Targets of the Computation share its parameters, and so
+        # one ParameterSpace:
+        self.assertIs(graph._spaces[t1], graph._spaces[c])
+        self.assertIsNot(graph._spaces[t3], graph._spaces[c])
+
+    def test_cycle(self):
+        """
+        A cycle in the dependencies should be detected.
+        """
+        p = Parameter()
+        t1 = Target({p}, lambda: 0)
+        t2 = Target({p}, lambda: 0, dependencies=[t1])
+        t1._dependencies = (t2,)
+        with self.assertRaises(ValueError):
+            TargetGraph([t2])
+
+    def test_incremental(self):
+        """
+        Only the nodes whose Parameters changed, and the nodes
+        downstream of them, should be recomputed.
+        """
+        p1 = Parameter(1.0)
+        p2 = Parameter(2.0)
+        t1 = Target({p1}, self.counted("t1", lambda: 10 * p1.val))
+        t2 = Target({p2}, self.counted("t2", lambda: 10 * p2.val))
+        term = LeastSquaresTerm(t1, 0, 1)
+        graph = TargetGraph([term.out_target, t2])
+        values = graph.evaluate()
+        self.assertEqual(values[t1], 10)
+        self.assertEqual(values[t2], 20)
+        self.assertEqual(values[term.out_target], 100)
+        # The out_target used the value of t1 from the same pass:
+        self.assertEqual(self.calls, ["t1", "t2"])
+
+        self.calls = []
+        self.assertEqual(graph.stale(), [])
+        graph.evaluate()
+        self.assertEqual(self.calls, [])
+        p2.val = 3.0
+        self.assertEqual(graph.stale(), [t2])
+        values = graph.evaluate()
+        self.assertEqual(self.calls, ["t2"])
+        self.assertEqual(values[t2], 30)
+        p1.val = 2.0
+        values = graph.evaluate()
+        self.assertEqual(self.calls, ["t2", "t1"])
+        self.assertEqual(values[term.out_target], 400)
+
+        graph.invalidate(t2)
+        graph.evaluate()
+        self.assertEqual(self.calls, ["t2", "t1", "t2"])
+        graph.invalidate()
+        graph.evaluate()
+        self.assertEqual(self.calls, ["t2", "t1", "t2", "t1", "t2"])
+
+    def test_computation(self):
+        """
+        A Computation that is invalidated directly should cause its
+        Targets to be recomputed.
+        """
+        p = Parameter(1.0)
+        self.scale = 2
+        c = Computation({p}, self.counted("c", lambda: (self.scale * p.val,)))
+        t = c.target(0)
+        graph = TargetGraph([t])
+        self.assertEqual(graph.evaluate()[t], 2)
+        self.scale = 3
+        c.invalidate()
+        self.assertEqual(graph.evaluate()[t], 3)
+        self.assertEqual(self.calls, ["c", "c"])
+        graph.evaluate()
+        self.assertEqual(self.calls, ["c", "c"])
+
+    def test_executor(self):
+        """
+        With an executor, nodes with disjoint parameters should be
+        computed concurrently, and nodes that share a Parameter should
+        be computed in the same thread.
+        """
+        p1 = Parameter(1.0)
+        p2 = Parameter(2.0)
+        p3 = Parameter(3.0)
+        # Each of the two groups waits for the other, so this only
+        # finishes if they run at the same time:
+        barrier = threading.Barrier(2, timeout=10)
+        threads = {}
+        def f(label, value):
+            def wrapper():
+                threads[label] = threading.get_ident()
+                if label in ("a", "c"):
+                    barrier.wait()
+                return value()
+            return wrapper
+        ta = Target({p1}, f("a", lambda: p1.val))
+        tb = Target({p1, p2}, f("b", lambda: p1.val + p2.val))
+        tc = Target({p3}, f("c", lambda: p3.val))
+        terms = [LeastSquaresTerm(t, 0, 1) for t in (ta, tb, tc)]
+        graph = TargetGraph([term.out_target for term in terms])
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            values = graph.evaluate(executor)
+        self.assertEqual(threads["a"], threads["b"])
+        self.assertNotEqual(threads["a"], threads["c"])
+        self.assertEqual([values[term.out_target] for term in terms], \
+                             [1, 9, 9])
+
+        # Only the stale nodes are recomputed:
+        threads.clear()
+        p2.val = 4.0
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            values = graph.evaluate(executor)
+        self.assertEqual(list(threads), ["b"])
+        self.assertEqual(values[terms[1].out_target], 25)
+
+        # Exceptions are raised after all the tasks have finished:
+        def fail():
+            raise RuntimeError("failed")
+        graph = TargetGraph([Target({p2}, fail), \
+                                 Target({p3}, lambda: p3.val)])
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            with self.assertRaises(RuntimeError):
+                graph.evaluate(executor)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+from mattopt.parameter import Parameter, ParameterArray
+from mattopt.target import Target, Identity, target_profiling
+from mattopt.least_squares_term import LeastSquaresTerm
+from mattopt.least_squares_problem import LeastSquaresProblem
+from mattopt.trace import TraceRecorder, read_trace
+
+class TraceTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "trace.bin")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_basic(self):
+        """
+        Records should be written in chunks, and read back with
+        read_trace(), including after reopening the file.
+        """
+        recorder = TraceRecorder(self.filename, chunk_size=2)
+        for j in range(3):
+            recorder.record([j, 2.0 * j], [j, 0.0, 1.0], [1.0], 0.5)
+        # Only the first chunk has been written:
+        self.assertEqual(len(read_trace(self.filename)), 2)
+        recorder.close()
+        trace = read_trace(self.filename)
+        self.assertEqual(len(trace), 3)
+        np.testing.assert_equal(trace['x'], [[0, 0], [1, 2], [2, 4]])
+        np.testing.assert_equal(trace['residuals'][2], [2, 0, 1])
+        np.testing.assert_equal(trace['duration'], 0.5)
+
+        # Appending to the file:
+        with TraceRecorder(self.filename) as recorder:
+            recorder.record([3, 6], [3, 0, 1], [1.0], 0.5)
+        self.assertEqual(len(read_trace(self.filename)), 4)
+        # Records of a different size are rejected:
+        recorder = TraceRecorder(self.filename)
+        with self.assertRaises(ValueError):
+            recorder.record([1.0], [1.0], [1.0], 0.0)
+        recorder = TraceRecorder(self.filename + "2")
+        recorder.record([1.0], [1.0], [1.0], 0.0)
+        with self.assertRaises(ValueError):
+            recorder.record([1.0, 2.0], [1.0], [1.0], 0.0)
+        recorder.close()
+        with self.assertRaises(ValueError):
+            TraceRecorder(self.filename, chunk_size=0)
+
+    def test_incomplete_record(self):
+        """
+        An incomplete record at the end of the file, as left by a
+        crash, should be ignored by the reader and overwritten by the
+        recorder.
+        """
+        with TraceRecorder(self.filename) as recorder:
+            recorder.record([1.0], [2.0], [4.0], 0.1)
+        with open(self.filename, "ab") as f:
+            f.write(b"abc")
+        self.assertEqual(len(read_trace(self.filename)), 1)
+        with TraceRecorder(self.filename) as recorder:
+            recorder.record([3.0], [4.0], [16.0], 0.1)
+        np.testing.assert_equal(read_trace(self.filename)['terms'], \
+                                    [[4.0], [16.0]])
+
+    def test_solve(self):
+        """
+        Every residual evaluation of a solve should be recorded.
+        """
+        iden1 = Identity()
+        iden2 = Identity()
+        iden1.x.fixed = False
+        iden2.x.fixed = False
+        p = Parameter(1.0)
+        t = Target({p}, lambda: np.array([p.val, 2 * p.val]))
+        terms = [LeastSquaresTerm(iden1.target, 1, 1), \
+                     LeastSquaresTerm(iden2.target, 2, 2), \
+                     LeastSquaresTerm(t, 0, 1)]
+        recorder = TraceRecorder(self.filename)
+        prob = LeastSquaresProblem(terms, trace=recorder)
+        prob.solve()
+        trace = read_trace(self.filename)
+        self.assertEqual(len(trace), recorder.nrecords)
+        self.assertGreater(len(trace), 1)
+        self.assertEqual(trace['x'].shape[1], 2)
+        self.assertEqual(trace['residuals'].shape[1], 4)
+        np.testing.assert_allclose(trace['terms'][-1], [0, 0, 5], atol=1e-10)
+        np.testing.assert_allclose(np.sum(trace['terms'], axis=1), \
+                                       np.sum(trace['residuals'] ** 2, axis=1))
+        recorder.close()
+
+    def test_solve_broyden(self):
+        """
+        In the Broyden mode, the evaluations of the full Jacobians
+        should be recorded too.
+        """
+        pa = ParameterArray(np.array([1.0, 2.0, 3.0]), fixed=False)
+        self.ncalls = 0
+        def f():
+            self.ncalls += 1
+            x = pa.get_val()
+            return x - np.array([3.0, 2.0, 1.0]) + 0.1 * np.sin(x)
+        term = LeastSquaresTerm(Target(set(pa.data), f), 0, 1)
+        recorder = TraceRecorder(self.filename)
+        prob = LeastSquaresProblem([term], trace=recorder)
+        with target_profiling():
+            prob.solve(broyden_refresh=5)
+        self.assertAlmostEqual(prob.objective, 0)
+        # Each call of f was at a point evaluated by _residual_func():
+        self.assertLessEqual(self.ncalls, recorder.nrecords)
+        self.assertEqual(prob._residual_stats.calls, recorder.nrecords)
+        recorder.close()
+
+if __name__ == "__main__":
+    unittest.main()
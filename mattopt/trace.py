@@ -0,0 +1,179 @@
+"""
+This module provides the TraceRecorder class, which records the points
+visited by an optimization in a binary file, and read_trace() to load
+such a file.
+"""
+
+import os
+import time
+import numpy as np
+
+# The file starts with this marker, followed by the format version and
+# the numbers of parameters, residuals, and terms, as 64-bit integers:
+_magic = b"MATTRACE"
+_format_version = 1
+_header_size = len(_magic) + 4 * 8
+
+def _record_dtype(nx, nresiduals, nterms):
+    """
+    Return the numpy structured dtype of one record.
+    """
+    return np.dtype([('time', '<f8'), ('duration', '<f8'), \
+                         ('x', '<f8', (nx,)), \
+                         ('residuals', '<f8', (nresiduals,)), \
+                         ('terms', '<f8', (nterms,))])
+
+def _read_header(f):
+    """
+    Read and check the header of a trace file, returning the numbers
+    of parameters, residuals, and terms.
+    """
+    header = f.read(_header_size)
+    if len(header) != _header_size or header[:len(_magic)] != _magic:
+        raise ValueError("Not a trace file: " + repr(f.name))
+    version, nx, nresiduals, nterms = \
+        np.frombuffer(header[len(_magic):], dtype='<i8')
+    if version != _format_version:
+        raise ValueError("Unsupported trace file version " + str(version))
+    return int(nx), int(nresiduals), int(nterms)
+
+class TraceRecorder:
+    """
+    A TraceRecorder appends one record for each evaluation of the
+    residuals to a binary file: the wall-clock time, the duration of
+    the evaluation, the vector x of non-fixed Parameters, the residual
+    vector, and the value of each term. Records are collected in a
+    preallocated buffer and written in chunks of chunk_size records,
+    so recording costs a few array copies per evaluation. Call flush()
+    or close() to write the records still in the buffer; a
+    LeastSquaresProblem does so at the end of solve().
+
+    The file is append-only, so a restarted optimization can continue
+    an existing trace, provided the numbers of parameters, residuals,
+    and terms are the same. Every record has the same size, so the
+    file can be read with read_trace() while it is being written, or
+    after a crash, in which case only complete records are read.
+    """
+
+    def __init__(self, filename, chunk_size=256):
+        """
+        filename is the trace file, which is created if it does not
+        exist. chunk_size is the number of records written at once.
+        """
+        if not isinstance(chunk_size, int) or chunk_size < 1:
+            raise ValueError("chunk_size must be a positive int")
+        self._filename = filename
+        self._chunk_size = chunk_size
+        self._file = None
+        self._buffer = None
+        self._count = 0
+        self.nrecords = 0
+
+    def __repr__(self):
+        return "TraceRecorder(" + repr(self._filename) + ")"
+
+    @property
+    def filename(self):
+        """
+        Return the name of the trace file.
+        """
+        return self._filename
+
+    def _open(self, nx, nresiduals, nterms):
+        """
+        Open the file for appending, writing the header of a new file
+        or checking the header of an existing one, and allocate the
+        buffer.
+        """
+        sizes = (nx, nresiduals, nterms)
+        if os.path.exists(self._filename) \
+                and os.path.getsize(self._filename) > 0:
+            with open(self._filename, "rb") as f:
+                if _read_header(f) != sizes:
+                    raise ValueError("The trace file " \
+                                         + repr(self._filename) + " has " \
+                                         "records of a different size.")
+            dtype = _record_dtype(*sizes)
+            self._file = open(self._filename, "r+b")
+            # Drop an incomplete record left by a crash:
+            nrecords = (os.path.getsize(self._filename) - _header_size) \
+                // dtype.itemsize
+            self._file.truncate(_header_size + nrecords * dtype.itemsize)
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(self._filename, "wb")
+            self._file.write(_magic)
+            self._file.write(np.array((_format_version,) + sizes, \
+                                          dtype='<i8').tobytes())
+        self._buffer = np.zeros(self._chunk_size, \
+                                    dtype=_record_dtype(*sizes))
+        self._sizes = sizes
+
+    def record(self, x, residuals, terms, duration):
+        """
+        Add a record. x, residuals, and terms are 1D arrays, and
+        duration is the time taken by the evaluation, in seconds.
+        """
+        x = np.ravel(x)
+        residuals = np.ravel(residuals)
+        terms = np.ravel(terms)
+        if self._file is None:
+            self._open(x.size, residuals.size, terms.size)
+        elif (x.size, residuals.size, terms.size) != self._sizes:
+            raise ValueError("The number of parameters, residuals, or " \
+                                 "terms changed during the trace.")
+        entry = self._buffer[self._count]
+        entry['time'] = time.time()
+        entry['duration'] = duration
+        entry['x'] = x
+        entry['residuals'] = residuals
+        entry['terms'] = terms
+        self._count += 1
+        self.nrecords += 1
+        if self._count == self._chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered records to the file.
+        """
+        if self._file is None:
+            return
+        if self._count > 0:
+            self._file.write(self._buffer[:self._count].tobytes())
+            self._count = 0
+        self._file.flush()
+
+    def close(self):
+        """
+        Write the buffered records and close the file. A later record()
+        reopens the file and appends to it.
+        """
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def read_trace(filename):
+    """
+    Return the records of a trace file as a read-only numpy structured
+    array, memory-mapped from the file so that long traces are not
+    loaded into memory. The fields are time, duration, x, residuals,
+    and terms, so for instance read_trace(filename)['x'] is a 2D array
+    with one row per evaluation.
+    """
+    with open(filename, "rb") as f:
+        sizes = _read_header(f)
+    dtype = _record_dtype(*sizes)
+    nrecords = (os.path.getsize(filename) - _header_size) // dtype.itemsize
+    if nrecords == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=_header_size, \
+                         shape=(nrecords,))
@@ -23,6 +23,20 @@ class VmecTests(unittest.TestCase):
         self.assertFalse(v.free_boundary)
         self.assertTrue(v.need_to_run_code)
 
+    def test_boundary_observer(self):
+        """
+        Changing the boundary shape should mean VMEC must be re-run.
+        """
+        v = Vmec()
+        v.need_to_run_code = False
+        v.boundary.get_rc(1, 0).val = 0.2
+        self.assertTrue(v.need_to_run_code)
+        v.need_to_run_code = False
+        v.boundary.zs.set_val(v.boundary.zs.get_val())
+        self.assertFalse(v.need_to_run_code)
+        v.boundary.zs[1, :] = 0.3
+        self.assertTrue(v.need_to_run_code)
+
     def test_parse_namelist_var(self):
         """
         Try adding a variable from an input namelist to a Vmec instance.
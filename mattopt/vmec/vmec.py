@@ -2,6 +2,7 @@
 This module provides a class that handles the VMEC equilibrium code.
 """
 
+import functools
 import numpy as np
 from mattopt import *
 #from FortranNamelist import NamelistFile
@@ -16,18 +17,25 @@ class Vmec(Equilibrium):
         """
         Constructor
         """
-        objstr = " for Vmec " + str(hex(id(self)))
         # nfp and stelsym are initialized by the Equilibrium constructor:
         Equilibrium.__init__(self)
-        self.mpol = Parameter(1, min=1, name="mpol" + objstr, observers=self.reset)
-        self.ntor = Parameter(0, min=0, name="ntor" + objstr, observers=self.reset)
-        self.delt = Parameter(0.7, min=0, max=1, name="delt" + objstr, observers=self.reset)
-        self.tcon0 = Parameter(2.0, name="tcon0" + objstr, observers=self.reset)
-        self.phiedge = Parameter(1.0, name="phiedge" + objstr, observers=self.reset)
-        self.curtor = Parameter(0.0, name="curtor" + objstr, observers=self.reset)
-        self.gamma = Parameter(0.0, name="gamma" + objstr, observers=self.reset)
+        name = self._parameter_name
+        self.mpol = Parameter(1, min=1, name=name("mpol"), observers=self.reset)
+        self.ntor = Parameter(0, min=0, name=name("ntor"), observers=self.reset)
+        self.delt = Parameter(0.7, min=0, max=1, name=name("delt"), observers=self.reset)
+        self.tcon0 = Parameter(2.0, name=name("tcon0"), observers=self.reset)
+        self.phiedge = Parameter(1.0, name=name("phiedge"), observers=self.reset)
+        self.curtor = Parameter(0.0, name=name("curtor"), observers=self.reset)
+        self.gamma = Parameter(0.0, name=name("gamma"), observers=self.reset)
         self.boundary = SurfaceRZFourier(nfp=self.nfp.val, stelsym=self.stelsym.val, \
                                       mpol=self.mpol.val, ntor=self.ntor.val)
+        # VMEC must also be re-run if the boundary shape changes. The
+        # observer is registered once per array of coefficients:
+        self.boundary.rc.add_observer(self.reset)
+        self.boundary.zs.add_observer(self.reset)
+        if not self.boundary.stelsym.val:
+            self.boundary.rs.add_observer(self.reset)
+            self.boundary.zc.add_observer(self.reset)
         # Handle a few variables that are not Parameters:
         self.ncurr = 1
         self.free_boundary = False
@@ -42,6 +50,20 @@ class Vmec(Equilibrium):
         logger.info("Resetting VMEC")
         self.need_to_run_code = True
 
+    def _full_name(self, var):
+        """
+        Return the name of the Parameter var of this Vmec object.
+        """
+        return var + " for Vmec " + str(hex(id(self)))
+
+    def _parameter_name(self, var):
+        """
+        Return a callable that generates the name of the Parameter var
+        of this Vmec object, so the string is only built when the name
+        is requested.
+        """
+        return functools.partial(self._full_name, var)
+
     def __repr__(self):
         """
         Print the object in an informative way.
@@ -56,7 +78,6 @@ class Vmec(Equilibrium):
         This method is used to streamline from_input_file(), and would
         not usually be called by users.
         """
-        objstr = " for Vmec " + str(hex(id(self)))
         if var in varlist:
             val_to_use = varlist[var]
         else:
@@ -69,7 +90,8 @@ class Vmec(Equilibrium):
 
         if parameter:
             setattr(self, name, Parameter(val_to_use, min=min, max=max, \
-                                              name=name + objstr, observers=self.reset))
+                                              name=self._parameter_name(name), \
+                                              observers=self.reset))
         else:
             setattr(self, name, val_to_use)
 